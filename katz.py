@@ -30,6 +30,9 @@ from pprint import pprint
 import shutil
 from zipfile import ZipFile
 
+# Archives are locked while they are read or changed, so that several copies of katz (GUI or command line) can share them.
+from katz_commandLine import ArchiveFileLock
+
 kivy.require('1.11.1')
 
 # ===== FEATURE REQUESTS AND TODO ITEMS ======================
@@ -254,8 +257,8 @@ class KatzWindow(FloatLayout):
             lf = ListFiles()
             lf.ids.file_chooser.path = self.tmp_path
 
-            # Extract the zip file to the temporary directory.
-            with ZipFile(self.zip_filename, 'r') as f:
+            # Extract the zip file to the temporary directory. Other programs may read the archive meanwhile, but not change it.
+            with ArchiveFileLock(self.zip_filename), ZipFile(self.zip_filename, 'r') as f:
                 f.extractall(path=self.tmp_path)
 
             # Create a popup displaying the folders and files extracted from the archive. The filechooser that is shown uses the path established by the code 5 lines up from here.
@@ -273,6 +276,11 @@ class KatzWindow(FloatLayout):
 
             self._popup.open()
 
+        except TimeoutError as error:
+            self.show_msg(str(error), 600, 200)
+            self.remove_tmp()
+            return
+
         except:
             msg = 'The temporary folder, "_tmp_zip_",\nalready exists. Delete that folder\nbefore proceeding.'
             self.show_msg(msg, 400, 300)
@@ -391,29 +399,41 @@ class KatzWindow(FloatLayout):
 
         print('instance:', instance)
 
-        # Create a list of all archive files, so we don't add a file already present.
-        zfile = ZipFile(self.zip_filename)
-        archive_files = zfile.namelist()
-        for ndx, file in enumerate(archive_files):
-            file = file.replace('/', '\\')
-            archive_files[ndx] = file
-
-        # Iterate through "selected_file" and add each file to the archive, using relative paths.
-        cnt_files = 0
-        with ZipFile(self.zip_filename, 'a') as this_zip:
-            for file in self.selected_files:
-
-                """
-                  absolute path to the zip file: c:\\foo\\my_zip.zip
-                absolute path to the added file: c:\foo\foobar\newfile.txt
-                                  add_this_file: foobar\newfile.txt
-                """
-                relative_path = os.path.relpath(os.path.dirname(file), os.path.dirname(self.zip_filename))
-                add_this_file = os.path.join(relative_path, os.path.basename(file))
-
-                if add_this_file not in archive_files:
-                    this_zip.write(add_this_file)
-                    cnt_files += 1
+        # Other programs may not use the archive while files are added to it.
+        lock = ArchiveFileLock(self.zip_filename, exclusive=True)
+        try:
+            lock.acquire()
+        except TimeoutError as error:
+            self.show_msg(str(error), 600, 200)
+            return
+
+        try:
+            # Create a list of all archive files, so we don't add a file already present.
+            with ZipFile(self.zip_filename) as zfile:
+                archive_files = zfile.namelist()
+            for ndx, file in enumerate(archive_files):
+                file = file.replace('/', '\\')
+                archive_files[ndx] = file
+
+            # Iterate through "selected_file" and add each file to the archive, using relative paths.
+            cnt_files = 0
+            with ZipFile(self.zip_filename, 'a') as this_zip:
+                for file in self.selected_files:
+
+                    """
+                      absolute path to the zip file: c:\\foo\\my_zip.zip
+                    absolute path to the added file: c:\foo\foobar\newfile.txt
+                                      add_this_file: foobar\newfile.txt
+                    """
+                    relative_path = os.path.relpath(os.path.dirname(file), os.path.dirname(self.zip_filename))
+                    add_this_file = os.path.join(relative_path, os.path.basename(file))
+
+                    if add_this_file not in archive_files:
+                        this_zip.write(add_this_file)
+                        cnt_files += 1
+
+        finally:
+            lock.release()
 
         # "Erase" the content being shown on the white screen, including the ScrollView and buttons.
         self.cancel_scroll("")
@@ -434,11 +454,15 @@ class KatzWindow(FloatLayout):
             self.show_msg("No zip file is open.\nOpen a zip file, first.")
             return
 
-        # Extract all the files in the zipfile to a subfolder of the same name as the zipfile.
-        with ZipFile(self.zip_filename, 'r') as f:
-            print('\nExtracting...')
-            extract_location = str(Path(self.default_path, self.zip_filename[:-4]))
-            f.extractall(path=extract_location)
+        # Extract all the files in the zipfile to a subfolder of the same name as the zipfile. Other programs may read the archive meanwhile, but not change it.
+        try:
+            with ArchiveFileLock(self.zip_filename), ZipFile(self.zip_filename, 'r') as f:
+                print('\nExtracting...')
+                extract_location = str(Path(self.default_path, self.zip_filename[:-4]))
+                f.extractall(path=extract_location)
+        except TimeoutError as error:
+            self.show_msg(str(error), 600, 200)
+            return
 
         msg = 'Extracting finished.'
         self.show_msg(msg)
@@ -474,7 +498,7 @@ class KatzWindow(FloatLayout):
             os.chdir(self.tmp_path)
 
             # Extract the archive to the temporary folder.
-            with ZipFile(self.zip_filename, 'r') as f:
+            with ArchiveFileLock(self.zip_filename), ZipFile(self.zip_filename, 'r') as f:
                 f.extractall(path=self.tmp_path)
 
             # Now, the file chooser displayed by self._popup will contain all the files in the archive.
@@ -492,6 +516,11 @@ class KatzWindow(FloatLayout):
 
             self._popup.open()
 
+        except TimeoutError as error:
+            self.show_msg(str(error), 600, 200)
+            self.remove_tmp()
+            return
+
         except:
             msg = 'The temporary folder, "_tmp_zip_",\nalready exists. Delete that folder\nbefore proceeding.'
             self.show_msg(msg, 400, 300)
@@ -570,30 +599,35 @@ class KatzWindow(FloatLayout):
 
     def remove_the_files(self, instance):
         """
-        When the user presses the "Go!" button on the white screen, files that have been selected by the user will be removed from the temporary folder. The archive is recreated in the temporary folder, but this time without the deleted file(s). The newly recreated archive in the temporary folder has the same name as the original. It is moved to the same folder as the original archive, overwriting the original archive.
+        When the user presses the "Go!" button on the white screen, the files that have been selected by the user are removed from the archive. While the archive is locked, it is recreated next to the original, but this time without the deleted file(s), and the new archive then replaces the original.
         """
 
-        # tmp_path = os.getcwd()
-        os.chdir(self.tmp_path)
-
-        # Find each of the files in "remove_these" and delete each one.
-        zfile =  os.path.basename(self.zip_filename)
-        with ZipFile(zfile, 'w') as this_zip:
-            for root, dirs, files in os.walk(".", topdown=False):
-                for name in files:
-                    file_name = os.path.join(root, name)
-                    file_name = file_name[2:]
-                    if file_name not in self.remove_these and name != zfile:
-                        this_zip.write(file_name)
-                    else:
-                        if name != zfile:
-                            os.remove(file_name)
+        # Other programs may not use the archive while it is rebuilt and replaced.
+        lock = ArchiveFileLock(self.zip_filename, exclusive=True)
+        try:
+            lock.acquire()
+        except TimeoutError as error:
+            self.show_msg(str(error), 600, 200)
+            return
 
-        # Move the newly created zip file to the location of the original zip file.
+        # Rebuild the archive from the archive itself, read while it is locked, not from the files extracted to "tmp_path" before it was locked, so that changes another program made in the meantime are kept.
         self.default_path = os.path.dirname(self.zip_filename)
-        new_zip_file = os.path.join(self.tmp_path, os.path.basename(self.zip_filename))
-        shutil.move(new_zip_file, self.zip_filename)
-        os.chdir(self.default_path)
+        new_zip_file = self.zip_filename[:-4] + '._temp_zipfile_.zip'
+        remove_these = {os.path.normpath(name) for name in self.remove_these}
+        try:
+            with ZipFile(self.zip_filename) as old_zip, ZipFile(new_zip_file, 'w') as this_zip:
+                for info in old_zip.infolist():
+                    if os.path.normpath(info.filename) not in remove_these:
+                        this_zip.writestr(info, old_zip.read(info))
+
+            # Move the newly created zip file to the location of the original zip file.
+            shutil.move(new_zip_file, self.zip_filename)
+
+        finally:
+            lock.release()
+            if os.path.exists(new_zip_file):
+                os.remove(new_zip_file)
+            os.chdir(self.default_path)
 
         # Alert user if no files were removed.
         if not self.remove_these:
@@ -624,10 +658,14 @@ class KatzWindow(FloatLayout):
             self.show_msg("No zip file is open.\nOpen a zip file, first.")
             return
 
-        # Test integrity of zip file using testzip().
-        with ZipFile(self.zip_filename, 'r') as f:
-            bad_files = f.testzip()
-            num_zip_files = len(f.infolist())
+        # Test integrity of zip file using testzip(). Other programs may read the archive meanwhile, but not change it.
+        try:
+            with ArchiveFileLock(self.zip_filename), ZipFile(self.zip_filename, 'r') as f:
+                bad_files = f.testzip()
+                num_zip_files = len(f.infolist())
+        except TimeoutError as error:
+            self.show_msg(str(error), 600, 200)
+            return
 
         # Display the results of the testing function.
         if bad_files:
@@ -0,0 +1,210 @@
+"""
+katz_async.py
+
+asyncio API for katz archives: AsyncArchive runs list, read, extract and
+add on a pool of threads, under the same ArchiveSession rules as the daemon
+"""
+
+import asyncio
+import glob
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import katz_commandLine as katz
+from katz_daemon import ArchiveSession
+
+# AsyncArchive.add() adds files in batches of up to this many files or
+# bytes; the archive is complete after each batch, so an add that is
+# cancelled stops between two batches
+async_add_files = 1000
+async_add_bytes = 64 * katz.buffer_size
+
+
+class AsyncArchive:
+    """
+    An archive for asyncio programs. Every method is a coroutine; reading, decompressing, compressing and writing run on a pool of threads, so the event loop is never blocked. For example:
+
+        archive = await AsyncArchive.open('data.zip')
+        files = await archive.list()
+        data = await archive.read('proj/notes.txt')
+        async for chunk in archive.stream('proj/video.mp4'):
+            ...
+        await archive.extract(['proj/notes.txt'], policy='newer')
+        await archive.add('proj', ['*.txt'])
+        await archive.close()
+
+    Any number of streams can be read at once. Cancelling a task is cooperative: a stream stops at the next chunk, extract() stops before the next file, and add() stops after the current batch of files (see async_add_files), leaving a complete archive. Operations use the same ArchiveSession (and so the same files, rules and locks) as the daemon: reads share the archive, while add() has it to itself.
+    """
+
+    def __init__(self, full_filename, executor=None):
+        file_name, full_path, self.full_filename = katz.parse_full_filename(full_filename)
+        self.session = ArchiveSession(self.full_filename)
+        self.workers = katz.default_workers or max(8, 4 * (os.cpu_count() or 1))
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.workers)
+
+    @classmethod
+    async def open(cls, full_filename, executor=None):
+        """Open an archive and read its list of files."""
+        archive = cls(full_filename, executor)
+        await archive._run(archive.session.index)
+
+        return archive
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        await self._run(self.session.invalidate)
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def _run(self, fxn, *args):
+        """
+        Run fxn(*args) on the pool of threads. A thread can't be stopped, so if the task is cancelled meanwhile, the cancellation takes effect once fxn is done.
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fxn, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    def _reading(self, fxn, *args):
+        """fxn(index, *args), with the archive shared by readers."""
+        with self.session.lock.reading():
+            return fxn(self.session.index(), *args)
+
+    async def list(self):
+        """The archive's files, as list_members() describes them."""
+        return await self._run(self._reading, katz.list_members)
+
+    async def read(self, name):
+        """The whole contents of one file."""
+        return b''.join([chunk async for chunk in self.stream(name)])
+
+    async def stream(self, name):
+        """
+        Generate the contents of one file, chunk by chunk; each chunk is read and decompressed on the pool of threads.
+        """
+        def chunks():
+            with self.session.lock.reading():
+                index = self.session.index()
+                found = index.find(name)
+                if found is None:
+                    raise KeyError('There is no item named %r in the archive' % name)
+                f = index.archives[found[0]]
+                yield from f.read_chunks(f.members[found[1]])
+
+        source = chunks()
+        try:
+            while True:
+                chunk = await self._run(next, source, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # closing the generator lets go of the archive
+            await self._run(source.close)
+
+    async def extract(self, files=None, extract_location=None, policy='skip', durability=None):
+        """
+        Extract files (default: all) like the daemon's "extract" request, several at a time.
+
+        Arguments:
+            files {list} -- names of files or folders in the archive
+            extract_location {str} -- where to extract them (default: a folder named after the archive, next to it)
+            policy {str} -- what to do about files that already exist (see ExtractionPlan.resolve())
+            durability {str} -- one of durability_modes (default: the durability setting)
+
+        Returns:
+            extracted {list} -- paths of the extracted files
+        """
+        durability = katz.durability_mode({'durability': durability})
+        extract_location = extract_location or self.full_filename[:-4]
+        lock, locked = self.session.lock, []
+
+        def plan_extraction():
+            lock.acquire_read()
+            locked.append(lock)
+            index = self.session.index()
+            plan = katz.ExtractionPlan(index, katz.select_members(index, files), extract_location)
+            if plan.conflicts:
+                plan.resolve(policy)
+            if plan.free_space() < plan.total_size:
+                raise OSError('Not enough disk space: ' + str(plan.total_size) + ' bytes needed.')
+            plan.make_dirs()
+            return plan
+
+        extracted, tasks = [], []
+        try:
+            plan = await self._run(plan_extraction)
+            items = iter(plan.items())
+
+            # a few workers take turns at the files; cancelling stops them
+            # before their next file
+            async def worker():
+                for item in items:
+                    path = await self._run(plan.extract_item, item, None, durability, False)
+                    if path:
+                        extracted.append(path)
+
+            tasks = [asyncio.ensure_future(worker()) for n in range(self.workers)]
+            await asyncio.gather(*tasks)
+            await self._run(plan.finish, extracted, durability)
+        finally:
+            # if one worker failed, the others stop too
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for lock in locked:
+                lock.release_read()
+
+        return extracted
+
+    async def add(self, folder, files=None, num_shards=0):
+        """
+        Add files from a folder like the daemon's "add" request: "files" are names or wildcards relative to folder (default: all files). Files are added in batches (see async_add_files); after each batch the archive is complete.
+
+        Returns:
+            num_added {int} -- number of files added
+        """
+        folder = os.path.abspath(folder)
+        scanned = await self._run(katz.scan_tree, folder)
+        if files is None:
+            selected_files = [file for file, arcname, st in scanned]
+        else:
+            selected_files = []
+            for pattern in files:
+                found = await self._run(lambda: glob.glob(os.path.join(glob.escape(folder), pattern), recursive=True))
+                if not found:
+                    raise ValueError('No files match: ' + pattern)
+                selected_files.extend(file for file in sorted(found) if os.path.isfile(file))
+
+        sizes = {file: st.st_size for file, arcname, st in scanned}
+        batches, batch, batch_size = [], [], 0
+        for file in selected_files:
+            batch.append(file)
+            batch_size += sizes.get(file, 0)
+            if len(batch) >= async_add_files or batch_size >= async_add_bytes:
+                batches.append(batch)
+                batch, batch_size = [], 0
+        if batch:
+            batches.append(batch)
+
+        def add_batch(batch):
+            with self.session.lock.writing():
+                if not os.path.exists(self.full_filename):
+                    zipfile.ZipFile(self.full_filename, 'w').close()
+                self.session.invalidate()
+                return katz.add_to_archive(self.full_filename, batch, folder, scanned, num_shards)
+
+        num_added = 0
+        for batch in batches:
+            num_added += await self._run(add_batch, batch)
+
+        return num_added
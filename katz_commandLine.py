@@ -11,24 +11,77 @@ command-line zip archiving utility
     5. remove file(s) or folders from the archive
     6. test the integrity of the archive
     7. perform shell commands including dir, cls, and cd
+    8. merge the files from other archives into the archive
+    9. search the files in the archive for lines that contain a pattern (grep)
+    10. find files in the archive by name (find)
+    11. verify that the archive holds a folder on disk as it is now (verify)
+    12. share the archive, read-only, over HTTP (serve)
 """
 
+import bisect
+import contextlib
+import fnmatch
 import glob
+import heapq
+import io
+import itertools
+import json
+import mmap
 import os
+import queue
+import re
 import shutil
+import stat
 import string
+import struct
 import sys
 import textwrap
+import threading
+import time
 import zipfile
+import zlib
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
-from subprocess import check_output
+from subprocess import CalledProcessError, DEVNULL, check_output
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# bzip2 and lzma members can be read only if python was built with them
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# archives are locked with fcntl on Unix and with msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 # the following if... prevents a warning being issued to user if they try to add a duplicate file to an archive; this warning is handled in add_file()
 if not sys.warnoptions:
     import warnings
     warnings.simplefilter("ignore")
 
+# katz_daemon.py, katz_http.py and katz_async.py import this module by name;
+# when katz runs as a script, that name must be this module rather than a
+# second copy of it, with settings of its own
+sys.modules.setdefault('katz_commandLine', sys.modules[__name__])
+
 
 # feature: -- Version 3:
 #       -- 1. Write katz so it can be used as an importable module.
@@ -41,18 +94,131 @@ if not sys.warnoptions:
 # declare global variables
 dsh, slsh = '=', '/'
 
+# files with these extensions are already compressed; compressing them again
+# gains nothing, so addFiles() stores them in the archive as they are
+stored_extensions = {'.7z', '.aac', '.avi', '.bz2', '.docx', '.flac', '.gif',
+                     '.gz', '.heic', '.jpeg', '.jpg', '.m4a', '.mkv', '.mov',
+                     '.mp3', '.mp4', '.ogg', '.png', '.pptx', '.rar', '.webm',
+                     '.webp', '.xlsx', '.xz', '.zip'}
+
+# size of the chunks in which archive data is read, written and decompressed
+buffer_size = 1024 * 1024
+
+# deflated members at least this big are extracted by pipelined_inflate(),
+# with reading, decompressing and writing overlapped; pipeline_depth is the
+# number of chunks that may wait between two stages
+pipeline_threshold = 8 * buffer_size
+pipeline_depth = 4
+
+# files up to small_file_size are added by add_small_files(), which reads,
+# compresses and writes them in batches of about small_batch_size bytes
+small_file_size = 64 * 1024
+small_batch_size = 4 * buffer_size
+
+# how hard extraction and archive rewrites work to survive a power loss:
+#   none  -- leave writing to disk up to the OS (fastest)
+#   batch -- flush all files to disk once the whole job is done
+#   file  -- flush every file to disk as soon as it is written (safest)
+durability_modes = ('none', 'batch', 'file')
+
+# performance settings; apply_settings() replaces these defaults with the
+# values in katz.config (or in the profile chosen at startup)
+default_workers = 0                 # threads per job; 0 = one per CPU
+compression_method = 'auto'         # auto, deflate, store, bzip2 or lzma
+compression_level = None            # None = the method's default level
+max_memory = 0                      # bytes; 0 = no limit
+cache_location = str(Path(Path.home(), '.katz'))
+
+# the values of the settings before apply_settings() first changed them
+setting_defaults = None
+
+# "auto" deflates everything except stored_extensions, which are stored
+compression_methods = {'auto': zipfile.ZIP_DEFLATED, 'deflate': zipfile.ZIP_DEFLATED,
+                       'store': zipfile.ZIP_STORED, 'bzip2': zipfile.ZIP_BZIP2,
+                       'lzma': zipfile.ZIP_LZMA}
+
+# memory a job may use for other things than katz's buffers (the python
+# interpreter, the archive's member table, ...), and the most threads
+# that fit in the budget; set by govern_memory()
+memory_available = 0
+memory_workers = 0
+
+# limits the rate at which a job reads and writes (a TokenBucket), if the
+# job has a rate limit; set by start_job()
+io_limiter = None
+low_priority = False
+
+# commands that read or write archives (see start_job() and report_memory())
+job_cmds = ['A', 'ADD', 'E', 'EXTRACT', 'R', 'REMOVE', 'T', 'TEST', 'MERGE', 'SERVE', 'GREP', 'FIND', 'VERIFY']
+
+# the only switches of the commands that take a pattern, text or folder,
+# which may start with "/", too (see split_switches())
+cmd_switches = {'GREP': ('i', 'f', 'name', 'rate', 'low'),
+                'FIND': ('fuzzy', 'max', 'rate', 'low'),
+                'VERIFY': ('crc', 'rate', 'low')}
+
+# how long a job waits for an archive that another program is using (see
+# ArchiveFileLock), in seconds; on Windows, a lock file has lock_slots
+# bytes, one of which each reader locks
+lock_timeout = 30
+lock_slots = 64
+
+# katz.config, parsed once by read_config(), and the profile in use
+config_cache = None
+active_profile = ''
+
+# dir() prints its lines in batches of dir_print_batch
+dir_print_batch = 512
+
+# ZipAppender writes members into zipfile.ZipFile archives itself, which
+# takes these ZipFile internals; they are there in the python versions
+# from zipfile_versions[0] to zipfile_versions[1], and on any other
+# version check_zipfile() looks for them before they are used
+zipfile_versions = ((3, 7), (3, 13))
+zipfile_internals = ('_lock', '_writing', '_writecheck', '_didModify', 'start_dir', 'filelist',
+                     'NameToInfo', 'fp')
+zipfile_checked = False
+
+# "serve" shares the open archive over HTTP (see serveFiles()) at this
+# address, unless the switches "/host=..." and "/port=..." say otherwise
+serve_host = '127.0.0.1'
+serve_port = 8080
+
+# "find" searches file names with a NameIndex, which groups the names in
+# blocks of name_index_block names; the last index used stays in memory.
+# find prints at most find_results files (unless "/max=n"), and a fuzzy
+# search looks at no more than fuzzy_blocks blocks. The files found last
+# (archive, its NameIndex, their positions) can be selected as "found" by
+# <E>xtract and <R>emove
+name_index_block = 64
+name_index_cache = None
+find_results = 50
+fuzzy_blocks = 256
+found_files = ('', None, [])
+
+# the "/o:" switch of dir: sort by name, size, date or extension
+dir_sort_keys = {'N': lambda e: e[0].lower(),
+                 'S': lambda e: e[2],
+                 'D': lambda e: e[3],
+                 'E': lambda e: (Path(e[0]).suffix.lower(), e[0].lower())}
+
 # shell_cmds dict holds help information for commands
 shell_cmds = {
-    'DIR': 'Displays a list of files and subdirectories in a directory.\n\nDIR [drive:][path][filename]\n',
+    'DIR': 'Displays a list of files and subdirectories in a directory.\n\nDIR [drive:][path][filename] [/O:[-]N|S|D|E]\n\n-- [filename] may include wildcard characters (*, ?).\n\n-- "/o:n", "/o:s", "/o:d" and "/o:e" sort the list by name, size, date or extension; "/o:-s" lists the largest files first, and so on. Without "/o", files are listed as they are read, which starts at once even in very large folders.\n',
     'CD': 'Displays the name of or changes the current directory.\n\nCD [/D][drive:][path]\n\n".." changes to the parent directory.\n',
     'CLS': 'Clears the screen. ("CLEAR" on Unix systems.)\n',
     'OPEN': '-- Open an existing zip file. Optionally include a path. The zip extension does need to be entered:\n         prompt> o data    # opens data.zip.\n\n-- For easiest usage, use the "cd" command to change the current directory to the directory containing the zip file that you want to work with.\n',
     'NEW': 'Create a new zip file in the current directory or, if a path is supplied, in another directory. katz 1.0 archives files using only the zip file format (not gzip or tar). File compression is automatic.\n',
     'LIST': '<L>ist all the files in the archive. In contrast, <DIR> lists files in a directory on disk, while <L>ist produces a list of files in the archive.\n',
-    'ADD': '-- Use the "cd" command to navigate to the directory holding files you want to add.\n\n-- Even if you include the name of your archive in the list of files to <A>dd, "katz" cannot add a zip file to itself.\n\n-- For speed, three methods are provided for identifying files that you want to <A>dd. Don\'t mix methods! You can mix numbers and ranges, though. Examples:\n     (1) a comma-separated list of numbers or ranges\n     (2) "all" to add all files\n     (3) wildcard characters (*, ?) details.\n\n--<A>dding folders by naming a folder is not permitted.',
-    'EXTRACT': '-- Files are extracted to a subfolder of the directory holding the open zip file, and the new folder has the same name as the archive file. This location/name is not configurable.\n\n--If the directory already exists, <E>xtract will not overwrite files without the user\'s permission.\n\n-- <E>xtract provides a numbered list of files to <E>xtract. To select files for extraction, you can mix individual "file numbers" and ranges. Examples of different ways of identifying files for extraction:\n     (1) 1, 2, 8, 4  [order does not matter]\n     (2) 3-8, 11, 14  [mix a range and numbers]\n     (3) enter a folder name\n     (4) all  [extracts all files]\n\nSYMLINKS:\n"katz" will archive file and folder symlinks. When extracted, files/folders will not extract as a symlink but as the original files/folders.\n',
-    'REMOVE': '-- <R>emoves files or a single folder from the archive. This operation cannot be reversed! If the specified folder has subfolders, only the files in the folder will be removed; subfolders (and contents) will be retained. "katz" will confirm before removing any files or folders from the archive.\n\n-- Generally, "katz" retains folder structure when <A>dding files. Files in the same directory as the archive file are placed in a folder of the same name holding the archive file. However, some archive files may have files in the "root"directory. <L>ist will designate the "folder" for these files with a ".". To remove these files, use "." as the folder name. \n',
-    'TEST': '<T>est the integrity of the archive. SPECIAL NOTE: If you archive a corrupted file, testing will not identify the fact that it is corrupted! Presumably, it was archived perfectly well as a corrupted file!\n',
+    'ADD': '-- Use the "cd" command to navigate to the directory holding files you want to add.\n\n-- Even if you include the name of your archive in the list of files to <A>dd, "katz" cannot add a zip file to itself.\n\n-- For speed, three methods are provided for identifying files that you want to <A>dd. Don\'t mix methods! You can mix numbers and ranges, though. Examples:\n     (1) a comma-separated list of numbers or ranges\n     (2) "all" to add all files\n     (3) wildcard characters (*, ?) details.\n\n--<A>dding folders by naming a folder is not permitted.\n\n-- For very large additions, "add /shards=n" writes the files, in parallel, into n separate archives of roughly equal size named after the open archive (e.g., data.001.zip, data.002.zip, ...) plus a manifest (data.manifest). <L>ist, <E>xtract, <R>emove and <T>est treat the shards as one archive.\n\n-- "/rate=20M" limits the job to reading and writing 20 MB per second (see also the io_rate setting), and "/low" runs katz at low CPU and disk priority for the rest of the session (see also the low_priority setting).',
+    'EXTRACT': '-- Files are extracted to a subfolder of the directory holding the open zip file, and the new folder has the same name as the archive file. This location/name is not configurable.\n\n--If files being extracted already exist on disk, <E>xtract asks once what to do with all of them: <S>kip them, <O>verwrite them, overwrite only if the archived file is <N>ewer, overwrite only if the files are <D>ifferent (size or CRC), or <R>ename the extracted files. Extracted files keep the modification time they had when archived, so extracting again with <N>ewer or <D>ifferent writes only what changed.\n\n-- "extract /durability=file" flushes every file to disk as soon as it is extracted; "/durability=batch" flushes them all at the end; "/durability=none" leaves it to the operating system. Without the switch, the "durability" setting in katz.config is used (default: none).\n\n-- <E>xtract provides a numbered list of files to <E>xtract. To select files for extraction, you can mix individual "file numbers" and ranges. Examples of different ways of identifying files for extraction:\n     (1) 1, 2, 8, 4  [order does not matter]\n     (2) 3-8, 11, 14  [mix a range and numbers]\n     (3) enter a folder name\n     (4) all  [extracts all files]\n\nSYMLINKS:\n"katz" will archive file and folder symlinks. When extracted, files/folders will not extract as a symlink but as the original files/folders.\n\n-- "/rate=20M" limits the job to reading and writing 20 MB per second (see also the io_rate setting), and "/low" runs katz at low CPU and disk priority for the rest of the session (see also the low_priority setting).\n',
+    'REMOVE': '-- <R>emoves files or a single folder from the archive. This operation cannot be reversed! If the specified folder has subfolders, only the files in the folder will be removed; subfolders (and contents) will be retained. "katz" will confirm before removing any files or folders from the archive.\n\n-- Generally, "katz" retains folder structure when <A>dding files. Files in the same directory as the archive file are placed in a folder of the same name holding the archive file. However, some archive files may have files in the "root"directory. <L>ist will designate the "folder" for these files with a ".". To remove these files, use "." as the folder name. \n\n-- Unless durability is "none" ("remove /durability=batch", or the "durability" setting in katz.config), the rebuilt archive is flushed to disk before it replaces the original.\n\n-- "/rate=20M" limits the job to reading and writing 20 MB per second (see also the io_rate setting), and "/low" runs katz at low CPU and disk priority for the rest of the session (see also the low_priority setting).\n',
+    'TEST': '<T>est the integrity of the archive. SPECIAL NOTE: If you archive a corrupted file, testing will not identify the fact that it is corrupted! Presumably, it was archived perfectly well as a corrupted file!\n\n-- "/rate=20M" limits the job to reading and writing 20 MB per second (see also the io_rate setting), and "/low" runs katz at low CPU and disk priority for the rest of the session (see also the low_priority setting).\n',
+    'MERGE': '-- Copies all the files from one or more other archives into the open archive. Enter the archives to merge as a comma-separated list; wildcard characters (*, ?) are allowed:\n         prompt> merge daily_*.zip\n\n-- Files are copied exactly as they are compressed; nothing is extracted.\n\n-- If a file name is found in more than one archive, choose to keep the <N>ewest file, the <F>irst one found (the open archive comes first), or to <R>ename the later ones, e.g., "notes (1).txt".\n',
+    'SERVE': '-- Shares the open archive over HTTP, read-only, until you press Ctrl+C. Other programs can then download single files without extracting the archive:\n         http://127.0.0.1:8080/folder/file.txt\n\n-- "http://127.0.0.1:8080/" lists the files in the archive (as JSON).\n\n-- Downloads may ask for part of a file (a byte range). This is quick for files stored without compression; compressed files are decompressed up to the part asked for.\n\n-- "serve /port=8000" uses another port; "/host=0.0.0.0" shares the archive with other computers, too.\n',
+    'GREP': '-- Searches the files in the open archive for lines that contain a pattern, and prints each line found as file:line number:line. Nothing is extracted to disk.\n\nGREP pattern [/I] [/F] [/NAME=wildcards]\n\n-- The pattern is a regular expression, e.g., grep def \\w+_files; "/f" searches for the text exactly as typed, and "/i" ignores upper and lower case.\n\n-- "/name=*.py" searches only the files whose names match; use "/" in the wildcards to match folders, too, e.g., "/name=src/*.py".\n\n-- Only the switches above count as switches, so a pattern may start with "/", e.g., grep /usr/lib; put "--" before a pattern that looks like one of them, e.g., grep -- /i\n\n-- Binary files (images, zip files, ...) are skipped.\n',
+    'FIND': '-- Finds the files in the open archive whose names contain some text, and prints them numbered as <L>ist numbers them, the best matches first. Folder names are searched, too, and upper and lower case are the same:\n         prompt> find report\n\nFIND text [/FUZZY] [/MAX=n]\n\n-- Wildcards (*, ?) match whole names, e.g., find *.py; use "/" in the wildcards to match folders, too, e.g., find src/*.py.\n\n-- "/fuzzy" also finds names that match the text only roughly, e.g., misspelled.\n\n-- "/max=n" prints up to n files (default: 50).\n\n-- Put "--" before text that looks like a switch, e.g., find -- /max\n\n-- To <E>xtract or <R>emove the files found, enter "found" when asked which files.\n\n-- The first search in an archive indexes its names, which takes a while for a very large archive; the index is kept and used until the archive changes.\n',
+    'VERIFY': '-- Checks that the open archive holds a folder on disk as it is now, e.g., after a nightly <A>dd, and prints the files that are missing from the archive, the files in the archive that are no longer on disk, and the files that differ:\n         prompt> verify C:\\projects\\report\n\nVERIFY [folder] [/CRC]\n\n-- Without a folder, the current directory is verified. As with <A>dd, the folder is the top folder in the archive, and only the files that <A>dd would add are compared. Put "--" before a folder that looks like a switch, e.g., verify -- /crc\n\n-- Files are compared by name, size and modification time. "/crc" compares their contents instead: the files on disk are read (several at a time) and their CRCs compared with the archived ones. CRCs are remembered, so only files that changed since the last "verify /crc" are read again.\n',
     'MENU': '<M>enu shows a formatted menu of available commands.\n',
     'SETUP': '--<S>etup allows editing of the "katz" configuration file.\n\n--Two settings are configurable:\n      (1) startup_directory=[starting path when "katz" starts]\n\n      (2) use_last_location=[True or False]\n\n-- If use_last_location is set to "True", then the next time "katz" starts, it will start in the directory in use at the time the program was last closed, regardless of the setting for startup_directory.\n\n-- Paths do not need to be quoted.\n\n--Other variables can be saved in the .config file, but these will not be used by "katz."',
     'HELP': 'HELP is helpless.\n',
@@ -94,6 +260,11 @@ translate = {
     'TEST': 'TEST',
     'M': 'MENU',
     'MENU': 'MENU',
+    'MERGE': 'MERGE',
+    'SERVE': 'SERVE',
+    'GREP': 'GREP',
+    'FIND': 'FIND',
+    'VERIFY': 'VERIFY',
     'B': 'ABOUT',
     'ABOUT': 'ABOUT',
     'S': 'SETUP',
@@ -102,7 +273,8 @@ translate = {
 # the following list is used in sub_menu() to filter zip-file commands
 command_list = ['DIR', 'CLS', 'CLEAR', 'EXIT', 'N', 'NEW',
                 'O', 'OPEN', 'CD', 'CD.', 'CD..', '.', '..',
-                'H', 'HELP', 'Q', 'QUIT', 'A', 'L', 'A', 'E', 'R', 'T', 'M', "MENU"]
+                'H', 'HELP', 'Q', 'QUIT', 'A', 'L', 'A', 'E', 'R', 'T', 'M', "MENU",
+                'MERGE', 'SERVE', 'GREP', 'FIND', 'VERIFY']
 
 
 def parse_full_filename(path):
@@ -235,6 +407,16 @@ def openFile(file):
     if not file:
         file = input("\nName of archive: ").strip()
 
+    # an add that was interrupted may have left the archive without a
+    # central directory: repair it before it is opened
+    archive = file if Path(file).suffix else file + '.zip'
+    if Journal(journal_path(archive, 'add')).exists():
+        try:
+            with ArchiveFileLock(archive, exclusive=True):
+                recover_add(archive)
+        except TimeoutError as error:
+            print(error)
+
     # if only a file.ext was entered, get the full path
     if '\\' not in file:
         file = str(Path(file).absolute())
@@ -261,12 +443,13 @@ def openFile(file):
     return full_filename
 
 
-def listFiles(full_filename):
+def listFiles(full_filename, index=None):
     """
     Print a numbered list of all the files and folders in the archive.
 
     Arguments:
         full_filename {str} -- full qualified path to an open archive file
+        index {ArchiveIndex} -- the archive's files, if the caller already has them
 
     Returns:
         full_filename
@@ -276,10 +459,8 @@ def listFiles(full_filename):
         print("No archive file is open.")
         return full_filename
 
-    # get the list of files from the archive
-    with zipfile.ZipFile(full_filename, 'r') as f:
-        zip_files = f.namelist()
-        zip_files = sorted(zip_files, reverse=True)
+    # get the list of files from the archive (and its shards)
+    zip_files = index if index is not None else ArchiveIndex(full_filename)
 
     # if there are no files in the archive, print a notice, then return
     if len(zip_files) == 0:
@@ -318,10 +499,14 @@ def listFiles(full_filename):
     return full_filename
 
 
-def addFiles(full_filename):
+def addFiles(full_filename, switch=''):
     """
     Add file(s) to the open archive from the selected directory and sub-directories.
 
+    With the switch "/shards=n", files are written in parallel to n separate archives (shards) named after the open archive, e.g., data.001.zip ... data.016.zip, balanced by size. A manifest (e.g., data.manifest) records which shard holds which file. Once an archive is sharded, all files added later go into its shards.
+
+    While files are added, a journal (e.g., data.add.journal) records each file that is completely in the archive. If katz is stopped part way, opening the archive or the next add rebuilds it from the files the journal lists (see recover_add()).
+
     Tasks:
         (1) user should already have cd'ed to the folder containing files
     to be added
@@ -331,6 +516,7 @@ def addFiles(full_filename):
 
     Arguments:
         full_filename {str} -- fully qualified path to an archive file
+        switch {str} -- optional switches, e.g., "/shards=16"
 
     Returns:
         full_filename
@@ -341,6 +527,10 @@ def addFiles(full_filename):
         return full_filename
 
     file_name, full_path, full_filename = parse_full_filename(full_filename)
+    switches = parse_switches(switch)
+
+    # if an earlier add was interrupted, repair the archive before it is read
+    recover_add(full_filename)
 
     cwd = os.getcwd()
 
@@ -349,17 +539,13 @@ def addFiles(full_filename):
     #       AND PRINT THE LIST ON SCREEN
     # ==================================================
 
-    dir_list = sorted(Path(cwd).glob('**/*.*'))
-
-    cnt = 1
-    for file in dir_list:
-        # get the folder name relative to the cwd
-        rel_path = os.path.relpath(Path(file).parent, Path(cwd).parent)
+    # one scan of the folder tree finds the files, their names relative
+    # to the cwd's parent and their stat()s
+    scanned = scan_tree(cwd)
+    dir_list = [file for file, arcname, st in scanned]
 
-        # add the current file name to the relative path
-        this_file = Path(rel_path, Path(file).name)
-        print(cnt, '. ', str(this_file), sep='')
-        cnt += 1
+    print('\n'.join(str(cnt) + '. ' + arcname.replace('/', os.sep)
+                    for cnt, (file, arcname, st) in enumerate(scanned, 1)))
 
     # ==================================================
     # GET FROM USER THE FILES TO ADD TO THE ARCHIVE
@@ -394,54 +580,24 @@ def addFiles(full_filename):
         print('No files selected.')
         return full_filename
 
+    # a sharded archive stays sharded; otherwise shard only on request
+    try:
+        num_shards = int(switches.get('shards', 0))
+    except ValueError:
+        print('Number of shards must be a number.')
+        return full_filename
+
     # ==================================================
     # ADD THE FILES:
     #   files ALWAYS go into named folders
     # ==================================================
 
-    # get a list of all the files that are in the archive
-    with zipfile.ZipFile(full_filename, 'r') as f:
-        zip_files = f.namelist()
-        zip_files = sorted(zip_files, reverse=True)
-
-    # namelist() formats paths as: foo/bar/bar.txt
-    # need to change"/" into "\\""
-    zip_files_temp_ = zip_files.copy()
-
-    for ndx, file in enumerate(zip_files_temp_):
-        file = file.replace('/', '\\')
-        zip_files[ndx] = file
-
-    # add files in selected_files to the archive
-    # we want files in archive to appear in folders relative to the
-    # current working directory. To do this, write the file as:
-    #   path/filename
-    # but, using "arcname", "rename" the file using a relative path
-    with zipfile.ZipFile(full_filename, 'a', compression=zipfile.ZIP_DEFLATED) as f:
-
-        for file in selected_files:
-
-            # get the folder name relative to the cwd
-            rel_path = os.path.relpath(Path(file).parent, Path(cwd).parent)
-
-            # add the current file name to the relative path
-            this_file = Path(rel_path, Path(file).name)
-
-            # if the current file is not the archive file, itself,
-            # add it to the archive
-            if Path(file).name.upper() != file_name.upper():
-
-                # if the current file is already in zip file, skip adding it
-                if str(this_file) not in zip_files:
-
-                    # archive will store the file not as the original
-                    # file name, but as arcname
-                    f.write(str(file), arcname=this_file)
+    add_to_archive(full_filename, selected_files, cwd, scanned, num_shards)
 
     return full_filename
 
 
-def extractFiles(full_filename):
+def extractFiles(full_filename, switch=''):
     """
     Extract one or more files from an archive.
 
@@ -450,8 +606,11 @@ def extractFiles(full_filename):
         (2) Provide various ways for user to select files to extract
         (3) Extract the files to a subdirectory with the same name as the archive
 
+    With the switch "/durability=none|batch|file", the durability setting in katz.config is overridden for this extraction.
+
     Arguments:
         full_filename {str} -- full qualified path to the opened archive file
+        switch {str} -- optional switches, e.g., "/durability=file"
 
     Returns:
         full_filename
@@ -462,19 +621,18 @@ def extractFiles(full_filename):
         return full_filename
 
     file_name, full_path, full_filename = parse_full_filename(full_filename)
+    durability = durability_mode(parse_switches(switch))
 
     # ==============================================
     # GET A LIST FILES IN THE ARCHIVE AND PRINT IT
     # ==============================================
 
-    full_filename = listFiles(full_filename)
+    # file_list contains relative paths of files in archive, in the
+    # order that listFiles() numbers them
+    file_list = ArchiveIndex(full_filename)
+    num_files = len(file_list)
 
-    # generate a [list] of files in the archive
-    with zipfile.ZipFile(full_filename, 'r') as f:
-        # file_list contains relative paths of files in archive
-        file_list = f.namelist()
-        file_list = sorted(file_list, reverse=True)
-        num_files = len(file_list)
+    full_filename = listFiles(full_filename, file_list)
 
     # ==============================================
     # LET USER CHOOSE WHICH FILE(S) TO EXTRACT
@@ -482,7 +640,7 @@ def extractFiles(full_filename):
 
     # sample user input: 1, 3-5, 28, 52-68, 70
     print(
-        '\nEnter a comma-separated combination of:\n  -- the number of the file(s) to extract\n  -- a hyphenated list of sequential numbers\n  -- a folder name\n  -- or enter "all" to extract all files\n')
+        '\nEnter a comma-separated combination of:\n  -- the number of the file(s) to extract\n  -- a hyphenated list of sequential numbers\n  -- a folder name\n  -- "found" for the files of the last find\n  -- or enter "all" to extract all files\n')
     user_selection = input("File number(s) to extract: ")
 
     # ==============================================
@@ -502,7 +660,7 @@ def extractFiles(full_filename):
     # depending on the function. For extractFiles(), get_chosen_files
     # will get a list of files from the archive, so set
     # source_list = file_list
-    source_list = file_list.copy()
+    source_list = file_list
 
     # designate that extractFiles() can reference folders
     folder_fxn = True
@@ -532,37 +690,67 @@ def extractFiles(full_filename):
     #       PRINT FILE NAMES ON SCREEN
     # ==============================================
 
-    with zipfile.ZipFile(full_filename, 'r') as f:
-        print('\nExtracting...')
-        extract_location = str(Path(full_path, file_name[:-4]))
+    extract_location = str(Path(full_path, file_name[:-4]))
+
+    # work out the whole extraction before extracting anything
+    plan = ExtractionPlan(file_list, selected_files, extract_location)
+
+    # if an earlier extraction was interrupted, don't extract again
+    # the files it finished
+    journal = Journal(journal_path(full_filename, 'extract'))
+    num_done = plan.resume(journal)
+    if num_done:
+        print('\n', num_done, ' file(s) were extracted before the last extraction stopped.', sep='')
+
+    # prevent an unintentional file overwrite of files in the
+    # directory where files will be extracted: one choice covers them all
+    if plan.conflicts:
+        print('\n', len(plan.conflicts), ' file(s) already exist on disk.', sep='')
+        policy = input(
+            '<S>kip, <O>verwrite, overwrite if <N>ewer, overwrite if <D>ifferent, or <R>ename? ').strip().upper()
+        policies = {'S': 'skip', 'O': 'overwrite', 'N': 'newer', 'D': 'crc', 'R': 'rename'}
+        if policy not in policies:
+            file_list.close()
+            journal.close()
+            return full_filename
+        num_skipped = plan.resolve(policies[policy])
+        print(num_skipped, 'file(s) skipped.')
+
+    # make sure the files will fit on the disk
+    free_space = plan.free_space()
+    if free_space < plan.total_size:
+        msg = '\nNot enough disk space: ' + str(plan.total_size) + \
+            ' bytes needed, ' + str(free_space) + ' bytes free.\n'
+        print('='*52, msg, '='*52, sep='')
+        file_list.close()
+        journal.close()
+        return full_filename
 
-        for file in selected_files:
-            # prevent an unintentional file overwrite of this_file
-            # in the directory where files will be extracted
-            if Path(extract_location, file).is_file():
-                ok = input(
-                    'Overwrite file on disk? (Y/N): ').strip().upper()
-                if ok == 'N':
-                    print('Skipping', file)
-                    continue
-            print(file)
-            # extract the file to extract_location
-            f.extract(file, path=extract_location)
+    # extract the files to extract_location; the shards of a sharded
+    # archive are extracted concurrently. The journal lets an interrupted
+    # extraction resume; it is deleted once everything is extracted.
+    print('\nExtracting...')
+    plan.make_dirs()
+    plan.run(journal, durability)
+    journal.finish()
+    file_list.close()
 
     return full_filename
 
 
-def removeFiles(full_filename):
+def removeFiles(full_filename, switch=''):
     """
     Removes files/folders from the archive.
 
     Technical info: To remove a file, this function first create a temporary archive that holds all the original files except the one(s) targeted for removal. Then:
             (1) the temporary archive is tested for integrity
-            (2) the original archive is deleted
-            (3) the temporary archive is renamed as the original
+            (2) the temporary archive replaces the original in a single step (os.replace)
+
+    Unless durability is "none" (see durability_modes), the temporary archive is flushed to disk before it replaces the original, and the folder afterwards, so a power loss leaves either the old or the new archive. The switch "/durability=none|batch|file" overrides the setting in katz.config.
 
     Arguments:
         full_filename {str} -- fully qualified path to the opened archive file
+        switch {str} -- optional switches, e.g., "/durability=file"
 
     Returns:
         full_filename
@@ -573,6 +761,7 @@ def removeFiles(full_filename):
         return full_filename
 
     file_name, full_path, full_filename = parse_full_filename(full_filename)
+    durability = durability_mode(parse_switches(switch))
 
     # store the user's current working directory so it can be restored later
     cwd = os.getcwd()
@@ -602,17 +791,16 @@ def removeFiles(full_filename):
     # ===================================================
 
     # get a list of files in the archive and their total number
-    with zipfile.ZipFile(full_filename, 'r') as f:
-        file_list = f.namelist()
-        file_list = sorted(file_list, reverse=True)
-        num_files = len(file_list)
+    file_list = ArchiveIndex(full_filename)
+    num_files = len(file_list)
 
     # for the user, print a list of files and folders in the archive
-    listFiles(full_filename)
+    listFiles(full_filename, file_list)
 
     # get from the user the file or folder that should be removed
     print("\nEnter file number(s) or range(s) to")
-    print('remove or, to remove a whole folder,')
+    print('remove, "found" for the files of the last')
+    print('find or, to remove a whole folder,')
     user_selection = input("type the name of the folder: ").strip()
 
     # if no file name is entered, return to menu
@@ -628,7 +816,7 @@ def removeFiles(full_filename):
     # will get a list of files from the archive, so set
     # source_list = file_list and set remove=True so get_chosen_files knows
     # that removeFiles() is calling it
-    source_list = file_list.copy()
+    source_list = file_list
 
     # designate that removeFiles() can reference folders
     folder_fnx = True
@@ -659,62 +847,15 @@ def removeFiles(full_filename):
         # create the directory that will hold files temporarily
         os.mkdir(temporary_path)
 
-        # extract all files in archive EXCEPT those in selected_files
-        with zipfile.ZipFile(full_filename, 'r') as f:
-            for file in file_list:
-                if file not in selected_files:
-                    f.extract(file, path=temporary_path)
-
-        # Make the temporary directory current
-        os.chdir(temp_dir)
-
-        dir = str(Path(full_path, temporary_path))
         temp_zip_file = str(Path(temp_dir, '_temp_zipfile_.zip'))
-        dir_list = sorted(list(Path(temp_dir).glob('**/*.*')))
-
-        # dir_list contains all the files in the archive EXCEPT
-        # those that the user wants to remove; so add them all back
-        with zipfile.ZipFile(temp_zip_file, 'w', compression=zipfile.ZIP_DEFLATED) as f:
-            for file in dir_list:
-                # this code finds the relative folder name
-                file_parts = Path(file).parts
-                for ndx, i in enumerate(file_parts):
-                    if i not in Path(temp_dir).parent.parts:
-                        loc = ndx
-                        break
-                # rel_folder is the relative path to the current file (in selected_files)
-                rel_folder = '\\'.join(file_parts[loc+1:-1])
-                rel_folder = Path(rel_folder, Path(file).name)
-
-                # katz won't add the zip to itself
-                if Path(file).name.upper() != file_name.upper():
-                    f.write(file, arcname=rel_folder)
-
-        # ===============================================
-        # CLEAN UP TEMPORARY FILES AND DIRECTORY
-        # ===============================================
-        os.chdir(full_path)
-
-        # test the temporary archive before deleting the original one
-        if not zipfile.is_zipfile(temp_zip_file):
-            msg = '\nUnknown error. Aborting removal of file.\n'
-            print('='*52, msg, '='*52, sep='')
 
-        # open and test temporary archive;
-        # if successful, delete original and rename temporary zip
-        try:
-            with zipfile.ZipFile(temp_zip_file, 'r') as f:
-                if f.testzip():
-                    raise Exception
-            # delete file_name
-            os.remove(full_filename)
-            # copy _temp_zipfile_.zip to file_name
-            shutil.copyfile(temp_zip_file, full_filename)
-        except:
+        # rebuild the archive (only the shards of a sharded archive that
+        # hold files being removed) without the selected files
+        for part in remove_members(file_list, selected_files, temp_zip_file, durability):
             msg = '\nUnknown error. Aborting removal of file.\n'
             print('='*52, msg, '='*52, sep='')
 
-        # delete "temporary" file even if exception was raised in previous line
+        # delete "temporary" file even if the removal failed
         if os.path.isfile(temp_zip_file):
             try:
                 os.remove(temp_zip_file)
@@ -735,6 +876,8 @@ def removeFiles(full_filename):
                     temporary_path + ' is being used by another process.\n'
                 print('='*52, msg, '='*52, sep='')
 
+    file_list.close()
+
     # return user to original working directory
     os.chdir(cwd)
 
@@ -748,6 +891,7 @@ def get_chosen_files(user_selection, full_filename, source_list, folder_fxn='Fal
         -- 1, 3-5, 28, 52-68, 70
         -- *.t?t
         -- a folder name
+        -- 'found', the files found by the last findFiles() in this archive
 
     This function must meet the needs of addFiles(), extractFiles(), and removeFiles(), where in addFiles(), we look in a list of files on disk to find selected files, and in extractFiles() and removeFiles() we look in a list of files in the archive to find selected files.
 
@@ -755,7 +899,7 @@ def get_chosen_files(user_selection, full_filename, source_list, folder_fxn='Fal
         user_selection {[str]} -- [user-selected files... see above]
         source_list {[list]}
             - if coming from addFiles(), list of files in the cwd and subfolders (dir_list)
-            - if coming from extractFiles() or removeFiles(), list of path/filenames of all files in archive (file_list)
+            - if coming from extractFiles() or removeFiles(), the ArchiveIndex of all files in archive (file_list)
         full_filename {[str]} -- [path+filename of archive file]
         folder_fxn {[boolean]} -- if True, this function will allow selected_files to be populated with relative paths, otherwise, selected_folders will be returned empty
 
@@ -777,19 +921,17 @@ def get_chosen_files(user_selection, full_filename, source_list, folder_fxn='Fal
     # extractFiles() and removeFiles() get its files from the archive content
     # look for folders there; addFiles() will also execute this code, but the
     # result is not used since addFiles() does not use folders
-    with zipfile.ZipFile(full_filename, 'r') as f:
-
-        file_list = f.namelist()
+    if isinstance(source_list, ArchiveIndex):
+        file_list = source_list
+    else:
+        file_list = ArchiveIndex(full_filename)
 
-        # cycle through all the folder names in the archive
-        # if user's selection is a folder, we might as well record the files
-        # that meet the criterion, for use in "elif folder:" below
-        tentative_selected_files = []
-        for file in file_list:
-            this_path = Path(file).parent
-            if str(this_path).upper() == user_selection.upper():
-                tentative_selected_files.append(file)
-                folder_name = True
+    # if user's selection is a folder, we might as well record the files
+    # that meet the criterion, for use in "elif folder:" below; the
+    # ArchiveIndex finds them without looking at every file in the archive
+    tentative_selected_files = [file_list[n] for n in file_list.folder_files(user_selection)]
+    if tentative_selected_files:
+        folder_name = True
 
     # user_selection='ALL', selected_files contains all files in cwd
     if user_selection.upper() == 'ALL':
@@ -797,6 +939,13 @@ def get_chosen_files(user_selection, full_filename, source_list, folder_fxn='Fal
         for file_number in which_files:
             selected_files.append(str(source_list[int(file_number)-1]))
 
+    # the files found by the last <FIND>, if they are still in the archive
+    elif user_selection.strip().upper() == 'FOUND' and isinstance(source_list, ArchiveIndex):
+        archive, index, positions = found_files
+        if archive == os.path.abspath(full_filename):
+            selected_files = [index[n] for n in sorted(positions)
+                              if source_list.find(index[n]) is not None]
+
     # if user_selection has wildcards, then filter the list of files
     # see https://pymotw.com/2/glob/
     elif '*' in user_selection or '?' in user_selection:
@@ -875,11 +1024,9 @@ def testFiles(full_filename):
         print('\nNot a valid zip file.')
         return full_filename
 
-    # open the archive and test it using testzip()
+    # test every member of the archive (and of its shards, if it has any)
     try:
-        with zipfile.ZipFile(full_filename, 'r') as f:
-            tested_files = f.testzip()
-            num_files = len(f.infolist())
+        num_files, tested_files = test_archive(full_filename)
     except:
         # if the file can't even be opened, then set tested_file to True
         # which is the same result as if testzip() found bad files in the archive
@@ -894,219 +1041,3966 @@ def testFiles(full_filename):
     return full_filename
 
 
-def about():
-    """
-    Provide a very little history behing the name "katz".
+def mergeFiles(full_filename, switch=''):
     """
-    about = '''"katz" is a command-line zip file utility named after Phil Katz, the founder of PKWARE in 1989, the company that originated the ZIP file format that is still widely used today.'''
-
-    print('\n', dsh*52, '\n', slsh*52, '\n', dsh*52, sep='')
-    print(fold(about, '', 52), '\n')
+    Merge the files from one or more other archives into the open archive. Compressed data is copied verbatim by copy_member(), so nothing is decompressed or compressed again. When a file name occurs more than once, the user's choice of policy decides which file is kept:
+        -- N: keep the newest file
+        -- F: keep the first file found (the open archive comes first)
+        -- R: keep all files, renaming later ones, e.g., "notes (1).txt"
 
-    return
+    If no file in the open archive has to be replaced, the new files are simply appended to it; otherwise a new archive is built alongside the open archive and then replaces it. Either way, the result has a single central directory, and it is flushed to disk unless the durability setting in katz.config is "none".
 
+    Arguments:
+        full_filename {str} -- fully qualified path to the opened archive file
+        switch {str} -- comma-separated list of archives to merge (default: ask the user)
 
-def fold(txt, ndnt='     ', w=52):
-    """
-    Textwraps 'txt'; used by katzHelp() to wrap help text at column 52.
+    Returns:
+        full_filename
     """
-    return textwrap.fill(txt, subsequent_indent=ndnt, width=w)
+    # prevent user from merging into an archive when one isn't open
+    if not full_filename:
+        print("No archive file is open.")
+        return full_filename
 
+    file_name, full_path, full_filename = parse_full_filename(full_filename)
 
-def katzHelp():
-    """
-    Provide basic information about shell commands used in "katz".
-    """
-    msg = '/'*23 + ' HELP ' + '/'*23
-    print('\n', dsh*52, '\n', msg, '\n', dsh*52, sep='')
-    print('For help: cmd /? (example:  d /?)')
-    print('\n', 'AVAILABLE SHELL COMMANDS:', sep='')
-    for k, v in shell_cmds.items():
-        if k == 'O' or k == 'N' or k == 'M':
-            pass
-        else:
-            if k in ['QUIT', 'Q']:
-                pass
-            else:
-                if k == 'EXIT':
-                    print('EXIT, QUIT, Q')
-                else:
-                    print(k)
+    # ==================================================
+    # GET FROM USER THE ARCHIVES TO MERGE
+    # ==================================================
 
-    print('\nAll commands are case insensitive. Most can use one\nletter (e.g., "o" instead of "open")')
-    print(dsh*52, '\n', '/'*52, '\n', dsh*52, sep='')
-    print()
+    if not switch:
+        switch = input('\nArchive(s) to merge: ').strip()
 
+    # if nothing is entered, return to menu
+    if not switch:
+        return full_filename
 
-def shell_help(command):
-    if command in ['EXIT', 'QUIT', 'Q']:
-        command = 'EXIT'
-    print(shell_cmds[command])
+    # each entry may be a [path/]filename or a wildcard pattern
+    source_archives = []
+    for entry in switch.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if Path(entry).suffix == '':
+            entry += '.zip'
+        for archive in sorted(glob.glob(entry)) or [entry]:
+            archive = str(Path(archive).absolute())
+            if archive.upper() == full_filename.upper() or archive in source_archives:
+                continue
+            if not valid_path(archive):
+                print(archive, 'is not a zip file and will be skipped.')
+                continue
+            source_archives.append(archive)
 
+    if not source_archives:
+        print('No archives selected.')
+        return full_filename
 
-def get_revision_number():
-    """
-    Returns the revision number, which is the number of days since the initial coding of "katz" began on November 12, 2019.
-    """
-    start_date = datetime(2019, 12, 10)
-    tday = datetime.today()
-    rd = datetime.today() - start_date
-    r_delta = rd.total_seconds() / 60 / 60
-    revision_delta = int(r_delta)
+    for archive in source_archives:
+        print(archive)
 
-    return revision_delta
+    policy = input('\nIf file names collide, keep <N>ewest, <F>irst, or <R>ename? (N/F/R) ').strip().upper()
+    if policy not in ['N', 'F', 'R']:
+        print('No files merged.')
+        return full_filename
 
+    # ==================================================
+    # MERGE THE ARCHIVES
+    # ==================================================
 
-def dir(switch=''):
-    """
-    Perform an OS dir command for the current path or the path designated by "switch". "switch" may be an absolute path, a relative path. or ".."
+    print('\nMerging...')
+    try:
+        num_merged, num_collisions = merge_archives(full_filename, source_archives, policy,
+                                                    durability_mode())
+    except TimeoutError as error:
+        print(error)
+        return full_filename
+    except Exception as e:
+        msg = '\nCannot merge archives: ' + str(e) + '\n'
+        print('='*52, msg, '='*52, sep='')
+        return full_filename
 
-    dir can also be issued with wildcard characters, such as:
-        dir *.txt
-        dir c:\mydata\*.xl?
+    print('Merged ', num_merged, ' files from ', len(source_archives), ' archive(s); ',
+          num_collisions, ' name collision(s).', sep='')
 
-    Arguments:
-        switch {str} -- an OS path (default: '')
+    return full_filename
 
-    Returns: None
+
+def merge_archives(full_filename, source_archives, policy, durability='none'):
     """
-    # preserve the user's current directory
-    cwd = os.getcwd()
+    Merge other archives into an archive without asking the user anything; mergeFiles() uses this. The other archives are locked for reading while they are copied (see ArchiveFileLock); the caller must hold the archive's own exclusive lock. If the merge fails, the archive is left as it was: a new archive is simply deleted, and an archive appended to in place gets its own central directory back, written where it was, with the appended members cut off.
 
-    # make sure "switch" is an absolute path, especially if
-    # user entered ".."  or a subfolder
-    file_name, full_path, full_filename = parse_full_filename(switch)
+    Arguments:
+        full_filename {str} -- fully qualified path to the archive to merge into
+        source_archives {list} -- fully qualified paths of the archives to merge
+        policy {str} -- which file is kept when names collide: 'N' (newest), 'F' (first) or 'R' (all, renamed)
+        durability {str} -- see durability_modes
 
-    try:
-        # user might use wildcards to filter dir
-        if '*' in switch or '?' in switch:
-            os.chdir(full_path)
-            d = 'dir ' + switch
-            output = str(check_output(d, shell=True))
+    Returns:
+        num_merged {int} -- number of files merged from the other archives
+        num_collisions {int} -- number of file names that collided
+    """
+    temp_zip_file = str(Path(Path(full_filename).parent, '_temp_merge_' + Path(full_filename).name))
+
+    with contextlib.ExitStack() as stack:
+        # the other archives are only read, so other programs may go on
+        # reading them, but not change them
+        for archive in source_archives:
+            stack.enter_context(ArchiveFileLock(archive))
+
+        # ==================================================
+        # DECIDE WHICH MEMBER OF WHICH ARCHIVE WINS EACH NAME
+        # ==================================================
+
+        # sources[0] is the open archive; "chosen" maps each member name in
+        # the result to (index into sources, Member)
+        sources = []
+        for archive in [full_filename] + source_archives:
+            sources.append(stack.enter_context(MappedArchive(archive)))
+        chosen = {}
+        num_collisions = 0
+        for ndx, f in enumerate(sources):
+            for info in f.infolist():
+                name = info.filename
+                if name in chosen:
+                    num_collisions += 1
+                    if policy == 'N' and info.date_time > chosen[name][1].date_time:
+                        chosen[name] = (ndx, info)
+                    elif policy == 'R':
+                        chosen[unique_name(name, chosen)] = (ndx, info)
+                else:
+                    chosen[name] = (ndx, info)
 
-        # if user entered a path, change the cwd to path
-        else:
-            os.chdir(full_filename)
-            output = str(check_output('dir', shell=True))
-        out = output.split('\\r\\n')
-        # print the output
-        print()
-        for ndx, i in enumerate(out[:-1]):
-            if ndx == 0:
-                print(i[2:])
-            else:
-                print(i)
+        # if every member of the open archive survived, append to it in
+        # place; then nothing is read from it, so it need not stay mapped
+        in_place = all(chosen[info.filename][0] == 0 for info in sources[0].infolist())
+        if in_place:
+            sources[0].close()
 
-        # restore the user's current directory
-        os.chdir(cwd)
+        # ==================================================
+        # COPY THE MEMBERS
+        # ==================================================
 
-    # if the path in "switch" can't be found, issue an error message
-    except:
-        print('The system cannot find the path specified: ', full_filename)
-    print()
+        target = full_filename if in_place else temp_zip_file
+        num_merged = 0
+        try:
+            new_zip = zipfile.ZipFile(target, 'a' if in_place else 'w',
+                                      compression=zipfile.ZIP_DEFLATED)
+            try:
+                # if a copy fails, the ZipAppender drops every member copied,
+                # so closing the archive writes the original central
+                # directory back where it was and cuts off everything after it
+                with ZipAppender(new_zip):
+                    for name, (ndx, info) in chosen.items():
+                        # when appending, members of the open archive are already there
+                        if in_place and ndx == 0:
+                            continue
+                        copy_member(sources[ndx], info, new_zip, arcname=name)
+                        if ndx != 0:
+                            num_merged += 1
+            finally:
+                new_zip.close()
+
+            # the open archive can be replaced only once it is closed
+            for src in sources:
+                src.close()
+            if durability != 'none':
+                fsync_path(target)
+            if not in_place:
+                os.replace(temp_zip_file, full_filename)
+                if durability != 'none':
+                    sync_folders([full_filename])
+
+        finally:
+            if os.path.isfile(temp_zip_file):
+                os.remove(temp_zip_file)
 
-    return file_name, full_path, full_filename
+    return num_merged, num_collisions
 
 
-def cd(switch=''):
+def serveFiles(full_filename, switch=''):
     """
-    Run an OS cd (change directory) command using the path denoted by "switch". The path will be validated since the user may have entered a path considered invalid by the OS. The path may be an absolute path, a relative path, or '..'.
+    Share the open archive over HTTP, read-only, until the user presses Ctrl+C. Each file in the archive is at its own URL, e.g., http://127.0.0.1:8080/folder/file.txt, and the archive's root URL lists its files as JSON. Nothing is extracted to disk: see MemberRequestHandler in katz_http.py.
 
     Arguments:
-        switch {str} -- an OS path (default: {''})
+        full_filename {str} -- fully qualified path to the opened archive file
+        switch {str} -- optional switches "/host=..." and "/port=..." (default: serve_host and serve_port)
 
-    Returns: None
+    Returns:
+        full_filename
     """
-    # if user didn't enter a valid cmd or path, there's nothing to do
-    if switch == '':
-        return None
+    # prevent user from serving an archive when one isn't open
+    if not full_filename:
+        print("No archive file is open.")
+        return full_filename
 
+    file_name, full_path, full_filename = parse_full_filename(full_filename)
+    switches = parse_switches(switch)
+    host = switches.get('host', serve_host)
     try:
-        # cd .. --> go "up" one directory level
-        if switch == '..':
-            p = Path(os.getcwd())
-            os.chdir(p.parent)
+        port = int(switches.get('port', serve_port))
+    except ValueError:
+        print('Port must be a number.')
+        return full_filename
 
-        # else a path was entered: go wherever "switch" directs;
-        else:
-            # change the directory as directed
-            try:
-                p = Path(switch).absolute()
-                os.chdir(p)
-            # if "switch" is not a real path, or contains a file name,
-            # print an error message
-            except:
-                print('The system cannot find the path specified.')
+    # the server lives in katz_http.py, which imports this module
+    from katz_daemon import ArchiveSession
+    from katz_http import MemberRequestHandler, PooledHTTPServer
 
-    except:
-        print('The system cannot find the path specified.')
-    print()
+    # requests are answered by a pool of threads; the archive stays open
+    # (and is read again only if it changes) for as long as it is served
+    workers = default_workers or max(8, 4 * (os.cpu_count() or 1))
+    try:
+        server = PooledHTTPServer((host, port), MemberRequestHandler, workers)
+    except OSError as error:
+        print('Cannot serve on ', host, ':', port, ': ', error.strerror, sep='')
+        return full_filename
+    server.session = ArchiveSession(full_filename)
 
-    return None
+    print('\nServing ', file_name, ' at http://', host, ':', port, '/  (Ctrl+C to stop)', sep='')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.session.invalidate()
+    print('Stopped serving', file_name)
+
+    return full_filename
 
 
-def clear():
+def grepFiles(full_filename, switch=''):
     """
-    Run a cls or clear command to clear the terminal.
+    Search the files in the archive for lines that match a pattern, and print each of them as member:line number:line. Members are decompressed in memory, several at a time (see grep_member()); nothing is extracted to disk. Name filters are applied before anything is decompressed, and binary members are skipped.
 
-    Arguments: none
+    Arguments:
+        full_filename {str} -- fully qualified path to the opened archive file
+        switch {str} -- the pattern, with optional switches:
+            /i -- ignore case
+            /f -- the pattern is fixed text, not a regular expression
+            /name=... -- search only members whose names match these wildcards
+            -- -- whatever follows is the pattern, even if it looks like a switch
 
-    Returns: None
+    Returns:
+        full_filename
     """
-    os.system('cls' if os.name == 'nt' else 'clear')
-
-    return None
+    # prevent user from searching an archive when one isn't open
+    if not full_filename:
+        print("No archive file is open.")
+        return full_filename
 
+    pattern, switches = split_switches(switch, cmd_switches['GREP'])
+    if not pattern:
+        print('Enter a pattern to search for, e.g., grep TODO')
+        return full_filename
 
-def parse_input(entry, full_filename):
-    """
-    Takes two arguments:
-        "full_filename" is the fully qualified path for a zip file
+    # the members are searched as bytes, so the pattern is, too
+    pattern = pattern.encode('utf-8')
+    if switches.get('f'):
+        pattern = re.escape(pattern)
+    try:
+        matcher = re.compile(pattern, re.IGNORECASE if switches.get('i') else 0)
+    except re.error as error:
+        print('Invalid pattern:', error)
+        return full_filename
 
-        "entry"is whatever the user entered at the command line and the expected format is:
+    # name filters first: only the members that pass are decompressed;
+    # files that are already compressed are binary, so they are skipped
+    wildcards = switches.get('name')
+    name_filter = None
+    if wildcards and wildcards is not True:
+        name_filter = re.compile(fnmatch.translate(wildcards), re.IGNORECASE).match
+
+    num_skipped = 0
+    with ArchiveIndex(full_filename) as index:
+        # within each part, members are searched in the order of the archive
+        items = []
+        for f in index.archives:
+            members = []
+            for member in f.infolist():
+                name = member.filename
+                if member.is_dir():
+                    continue
+                if name_filter and not name_filter(name if '/' in wildcards else name.rpartition('/')[2]):
+                    continue
+                if Path(name).suffix.lower() in stored_extensions:
+                    num_skipped += 1
+                    continue
+                members.append(member)
+            members.sort(key=lambda member: member.header_offset)
+            items.extend((f, member) for member in members)
+
+        controller = ConcurrencyController(os.path.dirname(full_filename))
+        results = controller.map(lambda item: grep_member(item[0], item[1], matcher), items,
+                                 [member.compress_size for f, member in items])
+        controller.finish()
+
+        num_lines, num_files = 0, 0
+        for (f, member), (matches, binary) in zip(items, results):
+            if binary:
+                num_skipped += 1
+            if matches:
+                num_files += 1
+                num_lines += len(matches)
+                print('\n'.join(member.filename + ':' + str(line_number) + ':' +
+                                line.decode('utf-8', 'replace').rstrip('\r')
+                                for line_number, line in matches))
+
+    print('\n', num_lines, ' matching line(s) in ', num_files, ' file(s); ',
+          num_skipped, ' binary file(s) skipped.', sep='')
 
-            cmd [switch]
+    return full_filename
 
-    where:
-        "cmd" is a recognized command (listed in [translation])
-        "switch" is whatever follows cmd. "switch" is expected to be one of:
-            (1) path
-            (2) [path]/filename
-            (3) /?  -- a request for help
 
-    Invalid cmd and unrecognized switch are rejected. Once a zip file is opened, or a new zip file is created, submenu commands (zip file commands) become available.
+def findFiles(full_filename, switch=''):
+    """
+    Find the files in the archive whose names (with their folders) contain some text, match wildcards or, with "/fuzzy", roughly match some text; print the best of them, numbered as <L>ist numbers them. The names are searched with a NameIndex, which is built the first time and then kept in cache_location, so searches take milliseconds even in very large archives. The files found can then be selected by entering "found" when <E>xtracting or <R>emoving.
 
     Arguments:
-        entry {str} -- whatever the user types; must be parsed for sanity
-        full_filename {str} -- fully qualified path for a zip file
+        full_filename {str} -- fully qualified path to the opened archive file
+        switch {str} -- the text or wildcards, with optional switches:
+            /fuzzy -- also find names that only roughly match the text
+            /max=n -- print at most n files (default: find_results)
+            -- -- whatever follows is the text, even if it looks like a switch
 
     Returns:
-        cmd {str} -- a shell command, even if invalid
         full_filename
     """
-    # ===============================================
-    # PROCESS THE USER'S ENTRY, WHICH WILL BE EITHER:
-    #   1. CMD [/?]
-    #   2. CMD [PATH][FILE]
-    #   3. AN UNRECOGNIZABLE ENTRY
-    # ===============================================
+    global found_files
 
-    # command only
-    if entry.find(' ') == -1:
-        cmd, switch = entry.upper(), ''
+    # prevent user from searching an archive when one isn't open
+    if not full_filename:
+        print("No archive file is open.")
+        return full_filename
 
-    # command + space + switch
-    else:
-        space_ndx = entry.find(' ')
-        cmd, switch = entry[:space_ndx].upper(), entry[space_ndx+1:]
-        # remove quotes from switch, if present; not required by katz
-        switch = switch.replace('"', '')
-        switch = switch.replace("'", '')
+    text, switches = split_switches(switch, cmd_switches['FIND'])
+    if not text:
+        print('Enter the text to look for, e.g., find report')
+        return full_filename
 
-    # if a cmd was entered, and it's not recognized, generate error msg
-    if cmd and cmd not in translate.keys():
-        msg = cmd + ' is not recognized as a valid command.\n'
-        print(msg)
+    try:
+        limit = int(switches.get('max', find_results))
+    except ValueError:
+        print('Invalid number:', switches['max'])
+        return full_filename
+
+    start = time.perf_counter()
+    index = name_index(full_filename)
+    start_search = time.perf_counter()
+
+    # rank the names: a closer match first, then a match in the file name
+    # rather than in its folders, then shorter names; only the names that
+    # are printed need to be put in order
+    if switches.get('fuzzy'):
+        scored = index.fuzzy(text)
+    elif '*' in text or '?' in text:
+        scored = [(1.0, n) for n in index.glob(text)]
+    else:
+        scored = [(1.0, n) for n in index.substring(text)]
+
+    text_lower = text.lower().encode('utf-8')
+
+    def rank(item):
+        score, n = item
+        name = index.lower[index.starts[n]:index.starts[n + 1] - 1]
+        base = name.rstrip(b'/').rpartition(b'/')[2]
+        return (-score, not base.startswith(text_lower), text_lower not in base, len(name), name)
+
+    best = heapq.nsmallest(limit, scored, key=rank)
+    elapsed = time.perf_counter() - start_search
+
+    # ==============================================
+    # PRINT THE FILES FOUND, NUMBERED AS IN <L>IST
+    # ==============================================
+
+    for score, n in best:
+        print('{:>9}. {}'.format(n + 1, index[n]))
+    if len(scored) > limit:
+        print('      ... and {:,} more (use /max=n to see more)'.format(len(scored) - limit))
+
+    print('\n{:,} file(s) found in {:.3f} s'.format(len(scored), elapsed), end='')
+    if start_search - start > 0.5:
+        print(' (indexing the names took {:.1f} s)'.format(start_search - start), end='')
+    print('.')
+
+    found_files = (os.path.abspath(full_filename), index, [n for score, n in scored])
+    if scored:
+        print('Enter "found" when <E>xtracting or <R>emoving to select these files.')
+
+    return full_filename
+
+
+def verifyFiles(full_filename, switch=''):
+    """
+    Check that the archive holds a folder on disk as it is now, e.g., after a nightly <A>dd: print the files that are missing from the archive, those in the archive that are no longer on disk, and those that differ. Files are compared by name, size and modification time, or, with "/crc", by name, size and CRC (see verify_tree()).
+
+    Arguments:
+        full_filename {str} -- fully qualified path to the opened archive file
+        switch {str} -- the folder (default: the current directory), with optional switches:
+            /crc -- compare the contents of files, not their modification times
+            -- -- whatever follows is the folder, even if it looks like a switch
+
+    Returns:
+        full_filename
+    """
+    # prevent user from verifying an archive when one isn't open
+    if not full_filename:
+        print("No archive file is open.")
+        return full_filename
+
+    folder, switches = split_switches(switch, cmd_switches['VERIFY'])
+    folder = os.path.abspath(folder or os.getcwd())
+    if not os.path.isdir(folder):
+        print('The folder', folder, 'does not exist.')
+        return full_filename
+
+    start = time.perf_counter()
+    with ArchiveIndex(full_filename) as index:
+        report = verify_tree(index, folder, bool(switches.get('crc')))
+
+    for name in report['missing']:
+        print('missing   ', name)
+    for name in report['extra']:
+        print('extra     ', name)
+    for name, reason in report['different']:
+        print('different ', name, '(' + reason + ')')
+
+    print('\nVerified ', folder, ' in ', '{:.1f}'.format(time.perf_counter() - start), ' s:  ',
+          report['matched'], ' OK.  ', len(report['missing']), ' missing from the archive.  ',
+          len(report['extra']), ' extra in the archive.  ', len(report['different']),
+          ' different.', sep='')
+
+    return full_filename
+
+
+def unique_name(name, taken):
+    """
+    Find a name for an archive member that is not in "taken" by adding a number to the file name, e.g., "foo/notes.txt" becomes "foo/notes (1).txt".
+
+    Arguments:
+        name {str} -- member name that is already taken
+        taken {dict or set} -- member names that are in use
+
+    Returns:
+        new_name {str} -- a member name not in "taken"
+    """
+    folder, _, base = name.rpartition('/')
+    stem, dot, suffix = base.rpartition('.')
+    if not stem:
+        stem, dot, suffix = base, '', ''
+
+    n = 1
+    while True:
+        new_name = stem + ' (' + str(n) + ')' + dot + suffix
+        if folder:
+            new_name = folder + '/' + new_name
+        if new_name not in taken:
+            return new_name
+        n += 1
+
+
+def parse_switches(switch):
+    """
+    Collect the switches that follow a command, e.g., "/shards=16 /i", into a dict. Anything that does not start with "/" is ignored.
+
+    Arguments:
+        switch {str} -- whatever followed the command
+
+    Returns:
+        switches {dict} -- {'shards': '16', 'i': True}
+    """
+    switches = {}
+    for token in switch.split():
+        if token.startswith('/') and len(token) > 1:
+            key, _, value = token[1:].partition('=')
+            switches[key.lower()] = value if value else True
+
+    return switches
+
+
+def split_switches(switch, known):
+    """
+    Separate the switches a command knows from the rest of what follows the command, e.g., a pattern or a path. Patterns and paths (on Unix) may start with "/", too, so only the switches in "known" count as switches; "--" ends the switches, and everything after it is taken as it is.
+
+    Arguments:
+        switch {str} -- whatever followed the command, e.g., "/usr/lib /i"
+        known {tuple} -- names of the switches the command knows, e.g., ('i', 'f')
+
+    Returns:
+        text {str} -- everything else, e.g., "/usr/lib"
+        switches {dict} -- the known switches, as parse_switches() collects them
+    """
+    words, switch_words = [], []
+    tokens = switch.split()
+    for ndx, token in enumerate(tokens):
+        if token == '--':
+            words.extend(tokens[ndx + 1:])
+            break
+        if token.startswith('/') and token[1:].partition('=')[0].lower() in known:
+            switch_words.append(token)
+        else:
+            words.append(token)
+
+    return ' '.join(words), parse_switches(' '.join(switch_words))
+
+
+def parallel_map(fxn, items, workers=None):
+    """
+    Run fxn(item) for every item using a pool of threads and return the results in the order of "items". Compression, CRC and kernel copies release the GIL, so threads really do work in parallel here.
+
+    Arguments:
+        fxn {function} -- function of one argument
+        items {iterable} -- arguments for fxn
+        workers {int} -- maximum number of threads (default: the "workers" setting, or the number of CPUs)
+
+    Returns:
+        results {list} -- fxn(item) for each item
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [fxn(item) for item in items]
+
+    workers = min(len(items), workers or default_workers or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fxn, items))
+
+
+def durability_mode(switches=None):
+    """
+    Get the durability mode for a job (see durability_modes): from the switch "/durability=..." if given, otherwise from katz.config.
+
+    Arguments:
+        switches {dict} -- switches from parse_switches()
+
+    Returns:
+        mode {str} -- "none", "batch" or "file"
+    """
+    mode = (switches or {}).get('durability') or get_setting('durability', 'none')
+    mode = mode.strip().lower()
+    if mode not in durability_modes:
+        print('Unknown durability "' + mode + '"; using "none".')
+        mode = 'none'
+
+    return mode
+
+
+def fsync_path(path):
+    """
+    Flush a file (or, where the OS allows it, a folder) to disk.
+    """
+    fd = os.open(path, os.O_RDONLY if os.name == 'posix' else os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    return None
+
+
+def sync_folders(paths):
+    """
+    Flush to disk the folders holding the given files, so that the files' names, not just their contents, survive a power loss. Only possible on POSIX systems; Windows flushes folders with the files in them.
+    """
+    if os.name == 'posix':
+        parallel_map(fsync_path, {os.path.dirname(os.path.abspath(path)) for path in paths})
+
+    return None
+
+
+def sync_paths(paths):
+    """
+    Flush many files, then their folders, to disk. The files are flushed concurrently, so the file system can combine the work; this is far cheaper than flushing each file as it is written.
+    """
+    paths = list(paths)
+    parallel_map(fsync_path, paths)
+    sync_folders(paths)
+
+    return None
+
+
+def manifest_path(full_filename):
+    """
+    The manifest of a sharded archive sits next to it: data.zip --> data.manifest
+    """
+    return str(Path(full_filename).with_suffix('.manifest'))
+
+
+def journal_path(full_filename, operation):
+    """
+    The journal of an add or extraction sits next to the archive: data.zip --> data.add.journal
+    """
+    return str(Path(full_filename).with_suffix('.' + operation + '.journal'))
+
+
+def directory_path(full_filename):
+    """
+    While files are added to an archive (or shard), a copy of its central directory sits next to it (see Journal.save_directory()): data.zip --> data.directory
+    """
+    return str(Path(full_filename).with_suffix('.directory'))
+
+
+def lock_path(full_filename):
+    """
+    The lock file of an archive (see ArchiveFileLock) sits next to it: data.zip --> data.lock
+    """
+    return str(Path(full_filename).with_suffix('.lock'))
+
+
+def with_lock(fxn, full_filename, exclusive, *args):
+    """
+    Run a command on the open archive while holding its ArchiveFileLock: shared for commands that only read the archive, exclusive for those that change it. If another program keeps the archive too long, the command isn't run.
+
+    Arguments:
+        fxn {function} -- the command, e.g., addFiles
+        full_filename {str} -- fully qualified path to the opened archive file
+        exclusive {bool} -- True if the command changes the archive
+        args -- more arguments for fxn
+
+    Returns:
+        full_filename
+    """
+    if not full_filename:
+        return fxn(full_filename, *args)
+
+    lock = ArchiveFileLock(full_filename, exclusive)
+    try:
+        lock.acquire()
+    except TimeoutError as error:
+        print(error)
+        return full_filename
+
+    try:
+        return fxn(full_filename, *args)
+    finally:
+        lock.release()
+
+
+def archive_key(full_filename):
+    """
+    Path, size and modification time of each file that makes up the archive (its shards and manifest, too). While the key stays the same, the archive hasn't changed.
+    """
+    key = []
+    for path in shard_parts(full_filename) + [manifest_path(full_filename)]:
+        try:
+            st = os.stat(path)
+            key.append((path, st.st_size, st.st_mtime_ns))
+        except OSError:
+            key.append((path, None, None))
+
+    return tuple(key)
+
+
+def shard_parts(full_filename):
+    """
+    List the archives that together make up the open archive: the archive itself, followed by its shards, if it has any.
+
+    Arguments:
+        full_filename {str} -- fully qualified path to the opened archive file
+
+    Returns:
+        parts {list} -- fully qualified paths of the archive and its shards
+    """
+    parts = [full_filename]
+
+    manifest = read_manifest(full_filename)
+    if manifest is None:
+        return parts
+
+    folder = Path(full_filename).parent
+    for shard in manifest.get('shards', []):
+        if Path(folder, shard).is_file():
+            parts.append(str(Path(folder, shard)))
+
+    return parts
+
+
+def read_manifest(full_filename):
+    """
+    The manifest of a sharded archive, {'shards': [names of the shards], 'members': {name: shard number}}, or None if the archive has no manifest or it can't be read.
+    """
+    try:
+        with open(manifest_path(full_filename), 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    return manifest if isinstance(manifest, dict) else None
+
+
+def shard_members(full_filename, shards, rescan=False):
+    """
+    The shard that holds each file of a sharded archive, so that adds and removes can tell without opening every shard. The map comes from the manifest; it is read from the shards' central directories instead if the manifest has no map for these shards, or if "rescan" (e.g., after an interrupted add, when the manifest is out of date).
+
+    Arguments:
+        full_filename {str} -- fully qualified path to the opened archive file
+        shards {list} -- fully qualified paths of the shards, in order
+        rescan {bool} -- ignore the manifest's map
+
+    Returns:
+        members {dict} -- {name in the archive: number of its shard, counting from 0}
+    """
+    manifest = read_manifest(full_filename) or {}
+    members = manifest.get('members')
+    if not rescan and isinstance(members, dict) and \
+            manifest.get('shards') == [Path(shard).name for shard in shards]:
+        return members
+
+    members = {}
+    for ndx, shard in enumerate(shards):
+        if os.path.isfile(shard):
+            with MappedArchive(shard) as f:
+                for info in f.infolist():
+                    members[info.filename] = ndx
+
+    return members
+
+
+def write_manifest(full_filename, shards, members):
+    """
+    Write the manifest of a sharded archive: the names of its shards, in order, and the shard that holds each file (see shard_members()).
+
+    Arguments:
+        full_filename {str} -- fully qualified path to the opened archive file
+        shards {list} -- fully qualified paths of the shards
+        members {dict} -- {name in the archive: number of its shard}
+
+    Returns: None
+    """
+    manifest = {'shards': [Path(shard).name for shard in shards], 'members': members}
+    with open(manifest_path(full_filename), 'w') as file:
+        json.dump(manifest, file)
+
+    return None
+
+
+def scan_tree(folder):
+    """
+    Find the files in a folder and all of its subfolders, the same ones that glob('**/*.*') finds (hidden files and folders are left out), in a single pass of os.scandir(). The stat() of each file comes from the scan (on Windows, it costs nothing extra), so it never has to be taken again.
+
+    Arguments:
+        folder {str} -- the folder to scan
+
+    Returns:
+        files {list} -- (path on disk, name in archive, os.stat_result) of each file, sorted by path; names in the archive are relative to the folder's parent and use "/"
+    """
+    files = []
+    top = os.path.basename(folder)
+    folders = [(folder, (top,) if top else ())]
+    while folders:
+        path, parts = folders.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir():
+                        folders.append((entry.path, parts + (entry.name,)))
+                    elif '.' in entry.name and entry.is_file():
+                        files.append((parts + (entry.name,), entry.path, entry.stat()))
+                except OSError:
+                    continue
+
+    # sort the way pathlib sorts paths: part by part
+    files.sort(key=lambda item: item[0])
+
+    return [(path, '/'.join(parts), st) for parts, path, st in files]
+
+
+def add_to_archive(full_filename, selected_files, folder, scanned=None, num_shards=0):
+    """
+    Add files to an archive without asking the user anything; addFiles() and the daemon both use this. Files keep their path relative to the parent of "folder", so "folder" itself is the top folder in the archive. Files that are already in the archive, and the archive's own files (shards, manifest, journals), are left out.
+
+    Arguments:
+        full_filename {str} -- fully qualified path to an archive file
+        selected_files {list} -- paths of the files to add
+        folder {str} -- the folder the files were chosen from
+        scanned {list} -- (path, arcname, os.stat_result) of files in "folder", from scan_tree(), if the caller has them
+        num_shards {int} -- for an archive that isn't sharded yet, the number of shards to write (0 or 1: none)
+
+    Returns:
+        num_added {int} -- number of files added
+    """
+    # if an earlier add was interrupted, repair the archive first
+    recover_add(full_filename)
+
+    # get the files that are in the archive; a sharded archive's manifest
+    # says which files its shards hold, so the shards aren't opened.
+    # Names in the archive always use "/"
+    parts = shard_parts(full_filename)
+    archive = MappedArchive(full_filename)
+    in_shards = shard_members(full_filename, parts[1:]) if len(parts) > 1 else {}
+
+    # katz won't add the archive, its shards, its manifest, its lock file,
+    # its journals or its saved central directories to itself
+    archive_parts = {Path(part).name.upper() for part in parts}
+    archive_parts.add(Path(manifest_path(full_filename)).name.upper())
+    archive_parts.add(Path(lock_path(full_filename)).name.upper())
+    archive_parts.update(Path(directory_path(part)).name.upper() for part in parts)
+    archive_parts.update(Path(journal_path(full_filename, operation)).name.upper()
+                         for operation in ('add', 'extract'))
+
+    # we want files in archive to appear in folders relative to
+    # "folder". To do this, write the file as:
+    #   path/filename
+    # but, using "arcname", "rename" the file using a relative path,
+    # which scan_tree() has already worked out
+    scanned = {file: (arcname, st) for file, arcname, st in scanned or []}
+    files_to_add = []
+    for file in selected_files:
+        file = str(file)
+
+        if file in scanned:
+            this_file, st = scanned[file]
+        else:
+            # e.g., a file found by a wildcard
+            rel_path = os.path.relpath(os.path.dirname(file), os.path.dirname(folder))
+            this_file = Path(rel_path, os.path.basename(file)).as_posix()
+            st = os.stat(file)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+        # if the current file is not the archive file, itself,
+        # add it to the archive
+        if os.path.basename(file).upper() not in archive_parts:
+
+            # if the current file is already in zip file, skip adding it
+            if this_file not in in_shards and archive.members.find(this_file) < 0:
+                files_to_add.append((file, this_file, st))
+
+    archive.close()
+
+    # a sharded archive stays sharded
+    num_shards = len(parts) - 1 or num_shards
+
+    # the journal records each file as it is finished, so that an
+    # interrupted add can be recovered; it is deleted once all files are in.
+    # It must be on disk before the first byte is written: appending
+    # overwrites the archive's central directory
+    journal = Journal(journal_path(full_filename, 'add'))
+    journal.start()
+    if num_shards > 1:
+        add_to_shards(full_filename, files_to_add, num_shards, journal)
+    else:
+        journal.save_directory(full_filename)
+        with zipfile.ZipFile(full_filename, 'a', compression=compression_methods[compression_method],
+                             compresslevel=compression_level) as f:
+            add_files(f, files_to_add, journal)
+    journal.finish()
+
+    return len(files_to_add)
+
+
+def recover_add(full_filename):
+    """
+    If an add to the archive was interrupted (its journal is still there), rebuild the archive and its shards from the files that were completely added (see recover_archive()), then delete the journal. This must run before anything reads the archive, since an interrupted add may have left it without a central directory. The caller must hold the archive's exclusive lock: an add still running in another process also has a journal.
+
+    Arguments:
+        full_filename {str} -- fully qualified path to an archive file
+
+    Returns:
+        recovered {bool} -- True if the archive or one of its shards was rebuilt
+    """
+    journal = Journal(journal_path(full_filename, 'add'))
+    if not journal.exists():
+        return False
+
+    stem = glob.escape(str(Path(full_filename).with_suffix('')))
+    shards = []
+    for shard in sorted(glob.glob(stem + '.[0-9][0-9][0-9].zip')):
+        # a shard that got no further than being created is dropped
+        if os.path.getsize(shard):
+            shards.append(shard)
+        else:
+            os.remove(shard)
+
+    recovered = False
+    for part in [full_filename] + shards:
+        if recover_archive(part, journal):
+            print('Recovered', Path(part).name, 'after an interrupted add.')
+            recovered = True
+    if shards:
+        write_manifest(full_filename, shards, shard_members(full_filename, shards, rescan=True))
+
+    journal.finish()
+
+    return recovered
+
+
+def remove_members(file_list, selected_files, temp_zip_file, durability='none'):
+    """
+    Remove files from an archive without asking the user anything; removeFiles() and the daemon both use this. Each part of the archive that holds selected files (the archive itself, or some of its shards) is rebuilt in temp_zip_file without them, tested, and then replaces the part in a single step (os.replace). The parts that are rebuilt are closed in file_list. The manifest of a sharded archive is kept up to date.
+
+    Arguments:
+        file_list {ArchiveIndex} -- the archive's files
+        selected_files {list} -- names of the files to remove
+        temp_zip_file {str} -- path of the temporary archive, on the same disk as the archive
+        durability {str} -- one of durability_modes
+
+    Returns:
+        failed {list} -- paths of the parts that could not be rebuilt; these are left as they were
+    """
+    # a sharded archive is rebuilt one shard at a time, and only the
+    # shards that hold files being removed are rebuilt
+    remove_these, removed_names = {}, {}
+    for file in selected_files:
+        part, ndx = file_list.find(file)
+        remove_these.setdefault(part, set()).add(ndx)
+        removed_names.setdefault(part, []).append(file)
+
+    failed = []
+    for part_number in sorted(remove_these):
+        part = file_list.parts[part_number]
+
+        # copy all files in the archive EXCEPT those in selected_files
+        # into a new archive; copy_member() copies the compressed data
+        # as-is, so nothing is extracted or compressed again
+        src = file_list.archives[part_number]
+        with zipfile.ZipFile(temp_zip_file, 'w', compression=zipfile.ZIP_DEFLATED) as new_zip:
+            for info in src.infolist():
+                if info.index not in remove_these[part_number]:
+                    copy_member(src, info, new_zip)
+        src.close()
+
+        # open and test temporary archive;
+        # if successful, it replaces the original
+        try:
+            with MappedArchive(temp_zip_file) as f:
+                if f.testzip():
+                    raise zipfile.BadZipFile
+            if durability != 'none':
+                fsync_path(temp_zip_file)
+            # the temporary file is next to the archive, on the same disk
+            os.replace(temp_zip_file, part)
+            if durability != 'none':
+                sync_folders([part])
+        except (zipfile.BadZipFile, OSError):
+            failed.append(part)
+
+    # keep the manifest of a sharded archive up to date: the files are gone
+    # from the shards that were rebuilt (the archive itself is part 0)
+    if len(file_list.parts) > 1:
+        shards = file_list.parts[1:]
+        members = shard_members(file_list.parts[0], shards)
+        for part_number, names in removed_names.items():
+            if part_number and file_list.parts[part_number] not in failed:
+                for name in names:
+                    members.pop(name, None)
+        write_manifest(file_list.parts[0], shards, members)
+
+    return failed
+
+
+def test_archive(full_filename, archives=None):
+    """
+    Test every member of an archive (and of its shards, if it has any) without printing anything; testFiles() and the daemon both use this. Members are tested several at a time; a ConcurrencyController finds the best number of threads for the disk holding the archive.
+
+    Arguments:
+        full_filename {str} -- fully qualified path to an archive file
+        archives {list} -- the archive's MappedArchives, if the caller already has them open; they are left open
+
+    Returns:
+        num_files {int} -- number of members tested
+        bad_file {str} -- name of the first bad member, or None
+    """
+    def test_member(item):
+        f, member = item
+        try:
+            for chunk in f.read_chunks(member):
+                pass
+        except (zipfile.BadZipFile, zlib.error, EOFError, OSError, struct.error):
+            return member.filename
+        return None
+
+    opened = parallel_map(MappedArchive, shard_parts(full_filename)) if archives is None else []
+    try:
+        items = [(f, member) for f in archives or opened for member in f.infolist()]
+        controller = ConcurrencyController(os.path.dirname(full_filename))
+        results = controller.map(test_member, items,
+                                 [member.compress_size for f, member in items])
+        controller.finish()
+    finally:
+        for f in opened:
+            f.close()
+
+    return len(items), next((bad for bad in results if bad), None)
+
+
+def grep_member(f, member, matcher):
+    """
+    Search one member for lines that match, decompressing it chunk by chunk. Each chunk is searched as a whole first, so a chunk without a match costs one regular-expression search; only the lines around a match are looked at one by one. A member with a NUL byte near its start is treated as binary and skipped.
+
+    Arguments:
+        f {MappedArchive} -- the archive that holds the member
+        member {Member} -- the member to search
+        matcher {re.Pattern} -- a compiled bytes pattern
+
+    Returns:
+        matches {list} -- (line number, line {bytes}) for each matching line
+        binary {bool} -- True if the member was skipped as binary
+    """
+    matches = []
+
+    def search(block, line_number):
+        # line_number is the number of the first line in block
+        counted, next_line = 0, 0
+        for match in matcher.finditer(block):
+            if match.start() < next_line:
+                continue
+            start = block.rfind(b'\n', 0, match.start()) + 1
+            end = block.find(b'\n', match.end())
+            end = len(block) if end < 0 else end
+            line_number += block.count(b'\n', counted, start)
+            counted, next_line = start, end + 1
+            matches.append((line_number, bytes(block[start:end])))
+
+    line_number, carry, first = 1, b'', True
+    try:
+        for chunk in f.read_chunks(member):
+            if first:
+                # stored members come as memoryviews, which "in" can't search
+                if b'\0' in bytes(chunk[:8192]):
+                    return [], True
+                first = False
+
+            # search whole lines only; the rest waits for the next chunk
+            block = carry + chunk
+            cut = block.rfind(b'\n') + 1
+            block, carry = block[:cut], block[cut:]
+            search(block, line_number)
+            line_number += block.count(b'\n')
+        search(carry, line_number)
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        matches.append((0, b'*** bad data: the file is damaged ***'))
+
+    return matches, False
+
+
+def list_members(index):
+    """
+    Describe the files of an archive, in the order <L>ist numbers them, for the daemon and for "serve".
+
+    Arguments:
+        index {ArchiveIndex} -- the archive's files
+
+    Returns:
+        files {list} -- a {dict} for each file: name, size, compressed (size) and crc
+    """
+    files = []
+    for n in range(len(index)):
+        part, ndx = index.locate(n)
+        members = index.archives[part].members
+        files.append({'name': members.name(ndx), 'size': members.file_size[ndx],
+                      'compressed': members.compress_size[ndx], 'crc': members.crc[ndx]})
+
+    return files
+
+
+def select_members(index, files=None):
+    """
+    Find the files that a list of file and folder names selects, for the daemon and AsyncArchive. A folder name selects the files in that folder, as in <E>xtract and <R>emove.
+
+    Arguments:
+        index {ArchiveIndex} -- the archive's files
+        files {list} -- names of files or folders in the archive (default: all files)
+
+    Returns:
+        selected_files {list} -- names of the selected files
+    """
+    if files is None:
+        return list(index)
+
+    selected_files = []
+    for name in files:
+        if index.find(name) is not None:
+            selected_files.append(name)
+            continue
+        positions = index.folder_files(name)
+        if not positions:
+            raise ValueError('Not in the archive: ' + name)
+        selected_files.extend(index[n] for n in positions)
+
+    return selected_files
+
+
+def add_files(f, files_to_add, journal=None):
+    """
+    Add files on disk to an open archive. Small files (up to small_file_size) are added in batches by add_small_files(); larger ones are added one at a time by add_file().
+
+    Arguments:
+        f {ZipFile} -- archive opened with mode 'w' or 'a'
+        files_to_add {list} -- (path on disk, name in archive, os.stat_result) of each file
+        journal {Journal} -- records each file once it is completely in the archive
+
+    Returns: None
+    """
+    # add_small_files() compresses with zlib; bzip2 and lzma go through zipfile
+    small_limit = small_file_size if compression_method in ('auto', 'deflate', 'store') else -1
+
+    # one controller for all batches, so what it learns carries over
+    controller = ConcurrencyController(os.path.dirname(f.filename or '.'))
+
+    batch, batch_size = [], 0
+    for item in files_to_add:
+        size = item[2].st_size
+        if size > small_limit:
+            add_file(f, item[0], item[1], journal)
+            continue
+
+        batch.append(item)
+        batch_size += size
+        if batch_size >= small_batch_size:
+            add_small_files(f, batch, journal, controller)
+            batch, batch_size = [], 0
+
+    if batch:
+        add_small_files(f, batch, journal, controller)
+    controller.finish()
+
+    return None
+
+
+def add_small_files(f, files_to_add, journal=None, controller=None):
+    """
+    Add a batch of small files to an open archive. For a small file, opening it, stat()ing it and writing its header cost more than compressing it, so instead of ZipFile.write():
+        -- the stat() from scan_tree() is reused
+        -- the files are read and compressed concurrently (zlib releases the GIL), each with a single read(), on as many threads as the controller finds best
+        -- the local headers and data of the whole batch are collected in one buffer and written to the archive with a single write()
+
+    Arguments:
+        f {ZipFile} -- archive opened with mode 'w' or 'a'
+        files_to_add {list} -- (path on disk, name in archive, os.stat_result) of each file
+        journal {Journal} -- records each file once it is completely in the archive
+        controller {ConcurrencyController} -- runs the reading and compressing (default: a new one)
+
+    Returns: None
+    """
+    level = zlib.Z_DEFAULT_COMPRESSION if compression_level is None else compression_level
+
+    def pack(item):
+        file, arcname, st = item
+        with open(file, 'rb') as src:
+            data = src.read()
+
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+        zinfo.file_size = len(data)
+        zinfo.CRC = zlib.crc32(data)
+
+        # like add_file(), store files that are already compressed
+        if store_file(file):
+            zinfo.compress_type = zipfile.ZIP_STORED
+        else:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            data = compressor.compress(data) + compressor.flush()
+        zinfo.compress_size = len(data)
+
+        return zinfo, data
+
+    # slices of about 64 KB: a task per file would cost more than the file
+    slices, sizes = [[]], [0]
+    for item in files_to_add:
+        if sizes[-1] >= 64 * 1024:
+            slices.append([])
+            sizes.append(0)
+        slices[-1].append(item)
+        sizes[-1] += item[2].st_size
+
+    own_controller = controller is None
+    if own_controller:
+        controller = ConcurrencyController(os.path.dirname(f.filename or '.'))
+    throttle(sum(sizes))
+    packed = [packed_file for packed_slice in
+              controller.map(lambda items: [pack(item) for item in items], slices, sizes)
+              for packed_file in packed_slice]
+    if own_controller:
+        controller.finish()
+
+    with ZipAppender(f) as appender:
+        out = bytearray()
+        offset = appender.offset
+        for zinfo, data in packed:
+            zinfo.header_offset = offset
+            appender.check(zinfo)
+            header = zinfo.FileHeader()
+            out += header
+            out += data
+            offset += len(header) + len(data)
+            appender.add(zinfo)
+        appender.fp.write(out)
+
+    if journal:
+        for zinfo, data in packed:
+            journal.record(zinfo.filename, zinfo.file_size, zinfo.CRC, zinfo.external_attr)
+
+    return None
+
+
+def store_file(file):
+    """
+    True if a file should be stored without compression: always, if compression_method is "store"; for files that are already compressed (see stored_extensions), if it is "auto".
+    """
+    if compression_method == 'store':
+        return True
+
+    return compression_method == 'auto' and os.path.splitext(file)[1].lower() in stored_extensions
+
+
+def add_file(f, file, arcname, journal=None):
+    """
+    Add one file on disk to an open archive. Files that are not to be compressed (see store_file()) are stored as they are by write_stored_member(); everything else is compressed by zipfile.
+
+    Arguments:
+        f {ZipFile} -- archive opened with mode 'w' or 'a'
+        file {str} -- path of the file on disk
+        arcname {str} -- name of the file in the archive
+        journal {Journal} -- records the file once it is completely in the archive
+
+    Returns: None
+    """
+    if store_file(file):
+        write_stored_member(f, file, arcname)
+    else:
+        f.write(file, arcname=arcname)
+        # kernel_copy() keeps to the rate limit for stored files; for
+        # compressed files, wait afterwards
+        throttle(f.infolist()[-1].file_size)
+
+    if journal:
+        # the member must be in the file before the journal says it is
+        f.fp.flush()
+        zinfo = f.infolist()[-1]
+        journal.record(zinfo.filename, zinfo.file_size, zinfo.CRC, zinfo.external_attr)
+
+    return None
+
+
+def add_to_shards(full_filename, files_to_add, num_shards, journal=None):
+    """
+    Add files to a sharded archive. Files are spread across the shards so that the shards stay about the same size (largest files first, each into the currently smallest shard), then all shards are written concurrently.
+
+    Arguments:
+        full_filename {str} -- fully qualified path to the opened archive file
+        files_to_add {list} -- (path on disk, name in archive, os.stat_result) of each file
+        num_shards {int} -- number of shards to create if the archive is not sharded yet
+        journal {Journal} -- records each file once it is completely in its shard
+
+    Returns: None
+    """
+    shards = shard_parts(full_filename)[1:]
+    if not shards:
+        stem = str(Path(full_filename).with_suffix(''))
+        shards = [stem + '.' + str(n+1).zfill(3) + '.zip' for n in range(num_shards)]
+    members = shard_members(full_filename, shards)
+
+    # balance the shards by size, starting from their current sizes
+    bins = [(os.path.getsize(shard) if os.path.isfile(shard) else 0, ndx)
+            for ndx, shard in enumerate(shards)]
+    heapq.heapify(bins)
+    files_by_shard = [[] for shard in shards]
+    for item in sorted(files_to_add, key=lambda item: item[2].st_size, reverse=True):
+        shard_size, ndx = heapq.heappop(bins)
+        files_by_shard[ndx].append(item)
+        heapq.heappush(bins, (shard_size + item[2].st_size, ndx))
+
+    def write_shard(ndx):
+        if journal and files_by_shard[ndx]:
+            journal.save_directory(shards[ndx])
+        with zipfile.ZipFile(shards[ndx], 'a', compression=compression_methods[compression_method],
+                             compresslevel=compression_level) as f:
+            add_files(f, files_by_shard[ndx], journal)
+
+    parallel_map(write_shard, range(len(shards)))
+
+    # the manifest learns where the new files went
+    for ndx, items in enumerate(files_by_shard):
+        for file, arcname, st in items:
+            members[arcname] = ndx
+    write_manifest(full_filename, shards, members)
+
+    return None
+
+
+def verify_tree(index, folder, use_crc=False):
+    """
+    Compare a folder on disk with an archive; verifyFiles() and the daemon both use this. The files in the folder and its subfolders (the ones <A>dd would add, see scan_tree()) are compared with the archive's files under the folder's name, by name and size, and then by modification time or, with use_crc, by CRC. CRCs of files on disk are computed several at a time and kept in a HashCache, so files that haven't changed since the last run are not read again.
+
+    Arguments:
+        index {ArchiveIndex} -- the archive's files
+        folder {str} -- the folder, which is the top folder in the archive
+        use_crc {bool} -- compare contents rather than modification times
+
+    Returns:
+        report {dict} -- 'matched': number of files that match; 'missing': names of files on disk that aren't in the archive; 'extra': names of files in the archive that aren't on disk; 'different': (name, reason) of files that differ, where reason is 'size', 'time', 'crc' or 'unreadable'
+    """
+    folder = os.path.abspath(folder)
+
+    # the archive's files under the folder, by name
+    archived = {}
+    for n in index.folder_files(os.path.basename(folder), recursive=True):
+        part, ndx = index.locate(n)
+        members = index.archives[part].members
+        name = members.name(ndx)
+        if not name.endswith('/'):
+            archived[name] = (members, ndx)
+
+    missing, different, to_hash = [], [], []
+    num_compared = 0
+    for path, name, st in scan_tree(folder):
+        entry = archived.pop(name, None)
+        if entry is None:
+            missing.append(name)
+            continue
+
+        num_compared += 1
+        members, ndx = entry
+        if st.st_size != members.file_size[ndx]:
+            different.append((name, 'size'))
+        elif use_crc:
+            to_hash.append((path, name, st, members.crc[ndx]))
+        # zip files store times in 2-second steps
+        elif abs(st.st_mtime - member_timestamp(members[ndx])) >= 2:
+            different.append((name, 'time'))
+
+    if to_hash:
+        cache = HashCache(folder)
+        crcs = cache.crcs([(path, st) for path, name, st, crc in to_hash])
+        cache.save()
+        for (path, name, st, crc), disk_crc in zip(to_hash, crcs):
+            if disk_crc is None:
+                different.append((name, 'unreadable'))
+            elif disk_crc != crc:
+                different.append((name, 'crc'))
+
+    different.sort()
+
+    return {'matched': num_compared - len(different), 'missing': missing,
+            'extra': sorted(archived), 'different': different}
+
+
+def crc_of_file(path):
+    """
+    CRC32 of a file on disk, or None if it can't be read.
+    """
+    try:
+        with open(path, 'rb') as file:
+            return crc_of_range(file.fileno(), 0, os.fstat(file.fileno()).st_size)
+    except (OSError, ValueError):
+        return None
+
+
+def member_target_path(extract_location, member_name):
+    """
+    Build the path on disk where an archive member will be extracted. The rules are the same ones that zipfile's extract() uses: drive letters, "." and ".." are dropped so a member can never land outside of extract_location.
+
+    Arguments:
+        extract_location {str} -- folder that receives extracted files
+        member_name {str} -- name of the member as stored in the archive
+
+    Returns:
+        target_path {str} -- fully qualified path of the extracted file
+    """
+    arcname = member_name.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+
+    # remove drive letters, UNC paths, redundant separators, "." and ".."
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep)
+                               if x not in invalid_path_parts)
+    if os.path.sep == '\\':
+        # filter characters that are illegal in Windows file names
+        arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)
+
+    return os.path.normpath(os.path.join(extract_location, arcname))
+
+
+def throttle(count):
+    """
+    Keep to the job's rate limit, if it has one: wait until "count" more bytes may be read or written.
+    """
+    if io_limiter:
+        io_limiter.consume(count)
+
+    return None
+
+
+def start_job(switches=None):
+    """
+    Set up a job's rate limit and priority. The rate limit comes from the switch "/rate=..." (e.g., "/rate=20M" for 20 MB per second) or else the io_rate setting; the switch "/low", or the low_priority setting, lowers katz's CPU and disk priority.
+
+    Arguments:
+        switches {dict} -- switches from parse_switches()
+
+    Returns: None
+    """
+    global io_limiter
+
+    switches = switches or {}
+    rate = switches.get('rate') or get_setting('io_rate')
+    io_limiter = None
+    if rate and rate is not True:
+        try:
+            if parse_size(rate) > 0:
+                io_limiter = TokenBucket(parse_size(rate))
+        except ValueError:
+            print('Invalid rate ', rate, '; no rate limit.', sep='')
+
+    if switches.get('low') or get_setting('low_priority').upper() == 'TRUE':
+        lower_priority()
+
+    return None
+
+
+def lower_priority():
+    """
+    Run katz at a lower CPU priority (nice) and, where ionice is available (Linux), a lower disk priority, so that other programs come first. An unprivileged program can't raise its priority again, so this lasts for the rest of the session.
+    """
+    global low_priority
+
+    if low_priority:
+        return None
+    low_priority = True
+
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    else:
+        print('Lowering the priority of katz is not supported on this system.')
+
+    # lowest priority of the "best effort" class: still guaranteed some
+    # disk time, unlike the "idle" class
+    ionice = shutil.which('ionice')
+    if ionice:
+        try:
+            check_output([ionice, '-c', '2', '-n', '7', '-p', str(os.getpid())], stderr=DEVNULL)
+        except (CalledProcessError, OSError):
+            pass
+
+    print('katz is running at low priority.')
+
+    return None
+
+
+def release_pages(mm, start, end):
+    """
+    Pages of a memory map that have been read count towards the memory katz uses (its RSS) until the OS needs them back. When katz has a memory budget (max_memory), the pages it has finished with are given back right away. The data stays in the OS's file cache, so nothing is lost if it is needed again.
+
+    Arguments:
+        mm {mmap} -- the memory map
+        start, end {int} -- range of bytes that are no longer needed
+
+    Returns: None
+    """
+    if not hasattr(mmap, 'MADV_DONTNEED'):
+        return None
+
+    start -= start % mmap.PAGESIZE
+    end = min(end, len(mm))
+    if end > start:
+        mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    return None
+
+
+def release_step():
+    """
+    Number of bytes read from a memory map between calls to release_pages(): a fraction of the memory available to each worker.
+    """
+    return max(buffer_size, memory_available // (4 * (default_workers or os.cpu_count() or 1)))
+
+
+def current_rss():
+    """
+    Memory in use by katz right now (its resident set size) in bytes, or 0 if the OS won't say.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss():
+    """
+    The most memory katz has used at any one time (its peak resident set size) in bytes, or 0 if the OS won't say.
+    """
+    if resource is None:
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def govern_memory():
+    """
+    Fit katz's memory use to the max_memory setting. What the interpreter already uses is set aside; in what remains, every worker needs room for a chunk being read, the chunks waiting between pipeline stages, the chunk being written, and zlib's own state. Until that fits, first the queues (pipeline_depth) get shorter, then the buffers (buffer_size) smaller, then there are fewer workers. Jobs therefore run with less parallelism rather than use more memory than allowed. The batches of add_small_files() and the folder index of ArchiveIndex are limited too.
+
+    Arguments: none
+
+    Returns: None
+    """
+    global buffer_size, default_workers, pipeline_depth, small_batch_size
+    global memory_available, memory_workers
+
+    if not max_memory:
+        memory_available = memory_workers = 0
+        return None
+
+    # keep a reserve for the interpreter, member tables, file names, etc.
+    baseline = current_rss() or peak_rss()
+    memory_available = max(4 * 1024 * 1024, (max_memory - baseline) * 3 // 4)
+
+    workers = default_workers or os.cpu_count() or 1
+
+    def needed(workers, depth, size):
+        return workers * ((2 * depth + 4) * size + 512 * 1024)
+
+    while needed(workers, pipeline_depth, buffer_size) > memory_available:
+        if pipeline_depth > 2:
+            pipeline_depth -= 1
+        elif buffer_size > 64 * 1024:
+            buffer_size //= 2
+        elif workers > 1:
+            workers -= 1
+        else:
+            break
+
+    if workers < (default_workers or os.cpu_count() or 1):
+        default_workers = workers
+    # a ConcurrencyController may not go beyond this many threads
+    memory_workers = workers
+
+    # a batch is held three times: as read, as compressed, and as written
+    small_batch_size = max(buffer_size, min(small_batch_size, memory_available // (3 * workers)))
+
+    return None
+
+
+def report_memory():
+    """
+    After a job, show how the most memory katz used compares with max_memory.
+    """
+    peak = peak_rss()
+    if max_memory and peak:
+        status = 'within' if peak <= max_memory else 'OVER'
+        print('Peak memory: ', round(peak / 1024 / 1024, 1), ' MB, ', status, ' the budget of ',
+              round(max_memory / 1024 / 1024, 1), ' MB.', sep='')
+
+    return None
+
+
+def kernel_copy(src_fd, src_offset, dst_fd, dst_offset, count):
+    """
+    Copy "count" bytes between two open files without passing them through python. os.copy_file_range() is used where the OS has it (Linux), then os.sendfile(); if neither is available, or the file system refuses, fall back to an ordinary read/write loop.
+
+    Arguments:
+        src_fd {int} -- file descriptor to copy from
+        src_offset {int} -- where to start reading in src_fd
+        dst_fd {int} -- file descriptor to copy to
+        dst_offset {int} -- where to start writing in dst_fd
+        count {int} -- number of bytes to copy
+
+    Returns: None
+    """
+    # with a rate limit, copy a chunk at a time, each when its turn comes
+    if io_limiter and count > buffer_size:
+        for start in range(0, count, buffer_size):
+            kernel_copy(src_fd, src_offset + start, dst_fd, dst_offset + start,
+                        min(buffer_size, count - start))
+        return None
+    throttle(count)
+
+    # copy_file_range() can copy without the data ever leaving the kernel
+    # (on some file systems, without even reading it)
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, count,
+                                            src_offset, dst_offset)
+                if copied == 0:
+                    break
+                src_offset, dst_offset = src_offset + copied, dst_offset + copied
+                count -= copied
+        except OSError:
+            # e.g., copying between file systems on older kernels
+            pass
+    if count <= 0:
+        return None
+
+    # sendfile() writes at the current position of dst_fd
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        try:
+            os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+            while count > 0:
+                copied = os.sendfile(dst_fd, src_fd, src_offset, count)
+                if copied == 0:
+                    break
+                src_offset, dst_offset = src_offset + copied, dst_offset + copied
+                count -= copied
+        except OSError:
+            pass
+    if count <= 0:
+        return None
+
+    # last resort: copy through a buffer
+    os.lseek(src_fd, src_offset, os.SEEK_SET)
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    while count > 0:
+        chunk = os.read(src_fd, min(count, buffer_size))
+        if not chunk:
+            raise zipfile.BadZipFile('Truncated file data')
+        os.write(dst_fd, chunk)
+        count -= len(chunk)
+
+    return None
+
+
+def crc_of_buffer(view, offset, count, release=None):
+    """
+    Compute the CRC32 of a range of bytes in a buffer (e.g., a memory map) without copying them. zlib releases the GIL while it works, so this can run in a thread alongside a copy.
+
+    Arguments:
+        view {memoryview} -- the buffer
+        offset {int} -- first byte to include
+        count {int} -- number of bytes to include
+        release {function} -- release(start, end) is called for the bytes already read, so a memory map need not keep them in memory (see release_pages())
+
+    Returns:
+        crc {int} -- CRC32 of the range
+    """
+    crc = 0
+    start, end = offset, offset + count
+    while offset < end:
+        step = min(end - offset, buffer_size)
+        crc = zlib.crc32(view[offset:offset + step], crc)
+        offset += step
+        if release and offset - start >= release_step():
+            release(start, offset)
+            start = offset
+    if release:
+        release(start, end)
+
+    return crc
+
+
+def crc_of_range(fd, offset, count):
+    """
+    Compute the CRC32 of a range of bytes in an open file from a single pass over a memory map of the file.
+
+    Arguments:
+        fd {int} -- file descriptor
+        offset {int} -- first byte to include
+        count {int} -- number of bytes to include
+
+    Returns:
+        crc {int} -- CRC32 of the range
+    """
+    if count == 0:
+        return 0
+
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            release = (lambda start, end: release_pages(mm, start, end)) if max_memory else None
+            return crc_of_buffer(view, offset, count, release)
+
+
+def inflate_chunks(view, offset, info, release=None):
+    """
+    Generate the decompressed contents of a member, chunk by chunk, fed from slices of a buffer (e.g., a memory map of the archive). The CRC and size are checked once the member has been read completely.
+
+    Arguments:
+        view {memoryview} -- the archive's bytes
+        offset {int} -- where the member's (compressed) data begins
+        info {Member or ZipInfo} -- the member
+        release {function} -- release(start, end) is called for the bytes already decompressed (see crc_of_buffer())
+
+    Yields:
+        chunk {bytes or memoryview} -- the next piece of the member
+    """
+    end = offset + info.compress_size
+    if end > len(view):
+        raise zipfile.BadZipFile('Truncated file data for %r' % info.filename)
+
+    released = offset
+    crc, size = 0, 0
+    if info.compress_type == zipfile.ZIP_STORED:
+        while offset < end:
+            chunk = view[offset:min(end, offset + buffer_size)]
+            offset += len(chunk)
+            throttle(len(chunk))
+            crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+            yield chunk
+            if release and offset - released >= release_step():
+                release(released, offset)
+                released = offset
+
+    elif info.compress_type == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+        while offset < end or decompressor.unconsumed_tail:
+            if decompressor.unconsumed_tail:
+                data = decompressor.unconsumed_tail
+            else:
+                data = view[offset:min(end, offset + buffer_size)]
+                offset += len(data)
+                throttle(len(data))
+            # limit the output, since a small input can inflate enormously
+            chunk = decompressor.decompress(data, buffer_size)
+            crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+            yield chunk
+            if release and offset - released >= release_step():
+                release(released, offset)
+                released = offset
+        chunk = decompressor.flush()
+        if chunk:
+            crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+            yield chunk
+
+    else:
+        # bzip2 and lzma; zipfile's LZMADecompressor reads the properties
+        # that zip files put in front of lzma data
+        if info.compress_type == zipfile.ZIP_BZIP2 and bz2:
+            decompressor = bz2.BZ2Decompressor()
+        elif info.compress_type == zipfile.ZIP_LZMA and lzma:
+            decompressor = zipfile.LZMADecompressor()
+        else:
+            raise NotImplementedError('That compression method is not supported')
+        while offset < end:
+            data = view[offset:min(end, offset + buffer_size)]
+            offset += len(data)
+            throttle(len(data))
+            chunk = decompressor.decompress(data)
+            crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+            yield chunk
+            if release and offset - released >= release_step():
+                release(released, offset)
+                released = offset
+
+    if release:
+        release(released, end)
+
+    # a compressed stream that stops short is damaged, even if its CRC matches
+    if info.compress_type != zipfile.ZIP_STORED and not decompressor.eof:
+        raise zipfile.BadZipFile('Truncated file data for %r' % info.filename)
+
+    if crc != info.CRC or size != info.file_size:
+        raise zipfile.BadZipFile('Bad CRC-32 for file %r' % info.filename)
+
+
+def pipelined_inflate(view, offset, info, target, release=None):
+    """
+    Decompress a large deflated member into an open file with three stages running at once: a reader thread pulls compressed chunks off the disk (by copying them out of the memory map), the calling thread inflates them, and a writer thread writes the results. The stages are connected by queues holding at most pipeline_depth chunks, so memory use stays bounded. zlib and file I/O release the GIL, so the stages really do overlap and extraction runs at about the speed of the slowest of disk and CPU rather than their sum.
+
+    Arguments:
+        view {memoryview} -- the archive's bytes
+        offset {int} -- where the member's (compressed) data begins
+        info {Member} -- a ZIP_DEFLATED member
+        target {file} -- file opened for writing in binary mode
+        release {function} -- release(start, end) is called for the bytes already read (see crc_of_buffer())
+
+    Returns: None
+    """
+    end = offset + info.compress_size
+    if end > len(view):
+        raise zipfile.BadZipFile('Truncated file data for %r' % info.filename)
+
+    compressed = queue.Queue(maxsize=pipeline_depth)
+    inflated = queue.Queue(maxsize=pipeline_depth)
+    stop = threading.Event()
+    write_errors = []
+
+    def reader():
+        pos = released = offset
+        try:
+            while pos < end and not stop.is_set():
+                # copying the slice reads it from disk here, rather than
+                # in the middle of decompressing it
+                data = bytes(view[pos:min(end, pos + buffer_size)])
+                pos += len(data)
+                throttle(len(data))
+                if release and pos - released >= release_step():
+                    release(released, pos)
+                    released = pos
+                compressed.put(data)
+            if release:
+                release(released, pos)
+        finally:
+            compressed.put(None)
+
+    def writer():
+        while True:
+            chunk = inflated.get()
+            if chunk is None:
+                return
+            # after a failure, keep emptying the queue so nothing blocks
+            if not write_errors:
+                try:
+                    target.write(chunk)
+                except OSError as error:
+                    write_errors.append(error)
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+
+    read_all = False
+    try:
+        decompressor = zlib.decompressobj(-15)
+        crc, size = 0, 0
+        while True:
+            data = compressed.get()
+            if data is None:
+                read_all = True
+                break
+            while data:
+                # limit the output, since a small input can inflate enormously
+                chunk = decompressor.decompress(data, buffer_size)
+                data = decompressor.unconsumed_tail
+                crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+                inflated.put(chunk)
+            if write_errors:
+                raise write_errors[0]
+
+        chunk = decompressor.flush()
+        crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+        inflated.put(chunk)
+
+        if not decompressor.eof:
+            raise zipfile.BadZipFile('Truncated file data for %r' % info.filename)
+        if crc != info.CRC or size != info.file_size:
+            raise zipfile.BadZipFile('Bad CRC-32 for file %r' % info.filename)
+
+    finally:
+        # wind down the reader and writer, even if decompression failed
+        stop.set()
+        if not read_all:
+            while compressed.get() is not None:
+                pass
+        inflated.put(None)
+        reader_thread.join()
+        writer_thread.join()
+
+    if write_errors:
+        raise write_errors[0]
+
+    return None
+
+
+def extract_stored_member(archive, info, target_path):
+    """
+    Extract a member that was stored without compression. The bytes are copied by the kernel straight from the archive into the new file, while a second thread computes the CRC from the archive's memory map. A file that fails the CRC check, or whose copy fails, is deleted.
+
+    Arguments:
+        archive {MappedArchive} -- the open archive
+        info {Member} -- a ZIP_STORED member
+        target_path {str} -- path of the file to create; its folder must exist
+
+    Returns:
+        target_path {str} -- path of the extracted file
+    """
+    offset = archive.data_offset(info)
+    try:
+        with open(target_path, 'wb') as dst:
+
+            # compute the CRC in a second thread while the copy runs
+            crc = []
+            crc_thread = threading.Thread(
+                target=lambda: crc.append(crc_of_buffer(archive.view, offset, info.file_size,
+                                                        archive.release if max_memory else None)))
+            crc_thread.start()
+            try:
+                kernel_copy(archive.fileno(), offset, dst.fileno(), 0, info.file_size)
+            finally:
+                crc_thread.join()
+
+        if not crc or crc[0] != info.CRC:
+            raise zipfile.BadZipFile('Bad CRC-32 for file %r' % info.filename)
+
+    # a partial file must not pass for an extracted one
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(target_path)
+        raise
+
+    return target_path
+
+
+def extract_member(archive, info, extract_location, target_path=None):
+    """
+    Extract one member of an open archive. Members stored without compression (typically media files) are copied by extract_stored_member(); everything else is decompressed straight from the archive's memory map by MappedArchive.extract(). The file is written under a temporary name and takes its own name only once it is complete, so a failed extraction never leaves a partial file under the member's name, nor destroys the file it was to overwrite.
+
+    Arguments:
+        archive {MappedArchive} -- the open archive
+        info {Member} -- the member to extract
+        extract_location {str} -- folder that receives extracted files
+        target_path {str} -- where the member goes, if already worked out (and its folder created) by an ExtractionPlan
+
+    Returns:
+        target_path {str} -- path of the extracted file or folder
+    """
+    if target_path is None:
+        target_path = member_target_path(extract_location, info.filename)
+        upper_dirs = os.path.dirname(target_path)
+        if upper_dirs:
+            os.makedirs(upper_dirs, exist_ok=True)
+
+    if info.is_dir():
+        os.makedirs(target_path, exist_ok=True)
+        return target_path
+
+    partial_path = target_path + '.katz_partial'
+    try:
+        if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            extract_stored_member(archive, info, partial_path)
+        else:
+            archive.extract(info, partial_path)
+
+        # give the file the modification time it had when it was archived
+        timestamp = member_timestamp(info)
+        os.utime(partial_path, (timestamp, timestamp))
+        os.replace(partial_path, target_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial_path)
+        raise
+
+    return target_path
+
+
+def member_timestamp(info):
+    """
+    Convert the (local) date and time stored for an archive member into a timestamp, as used by os.stat() and os.utime().
+
+    Arguments:
+        info {Member} -- a member of an archive
+
+    Returns:
+        timestamp {float} -- seconds since the epoch
+    """
+    try:
+        return time.mktime(info.date_time + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return time.time()
+
+
+def check_zipfile():
+    """
+    Make sure that zipfile.ZipFile has the internals that ZipAppender and set_zip_members() use (see zipfile_internals). They aren't a public API, so on a python version outside zipfile_versions they are looked for once, and NotImplementedError is raised if any is missing, rather than writing a damaged archive.
+    """
+    global zipfile_checked
+
+    if zipfile_checked:
+        return None
+
+    missing = []
+    if not zipfile_versions[0] <= sys.version_info[:2] <= zipfile_versions[1]:
+        with zipfile.ZipFile(io.BytesIO(), 'w') as zf:
+            missing = [name for name in zipfile_internals if not hasattr(zf, name)]
+    if missing:
+        raise NotImplementedError('katz cannot write zip files with python ' + sys.version.split()[0] +
+                                  ': zipfile.ZipFile has no ' + ', '.join(missing))
+    zipfile_checked = True
+
+    return None
+
+
+class ZipAppender:
+    """
+    Append members whose local headers and data katz writes itself (e.g., data copied by the kernel, or a batch of small files in one write) to a zipfile.ZipFile opened with mode 'w' or 'a'. This class and set_zip_members() are the only code that touches ZipFile internals (see check_zipfile()).
+
+    As a context manager, it holds the ZipFile's lock: write each member's header and data to "fp", starting at "offset", and add() it. If anything fails, the members added are dropped again, so closing the ZipFile writes the central directory it had before and cuts off what was written after it. ZipAppenders can be nested; a failure in the outer one drops what the inner ones added, too.
+    """
+
+    def __init__(self, zf):
+        check_zipfile()
+        self.zf = zf
+        self.fp = zf.fp
+        self._count, self._start_dir = None, None
+
+    def __enter__(self):
+        self.zf._lock.acquire()
+        if self.zf._writing:
+            self.zf._lock.release()
+            raise ValueError("Can't write to the ZIP file while there is another write handle open on it.")
+        self._count, self._start_dir = len(self.zf.filelist), self.zf.start_dir
+        self.zf._didModify = True
+        self.fp.seek(self.zf.start_dir)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.fp.flush()
+                self.zf.start_dir = self.fp.tell()
+            else:
+                del self.zf.filelist[self._count:]
+                self.zf.NameToInfo = {zinfo.filename: zinfo for zinfo in self.zf.filelist}
+                self.zf.start_dir = self._start_dir
+        finally:
+            self.zf._lock.release()
+
+    @property
+    def offset(self):
+        """Where the next header goes."""
+        return self.fp.tell()
+
+    def check(self, zinfo):
+        """Raise the error ZipFile.write() would if zinfo can't be added, e.g., a member too large without ZIP64."""
+        self.zf._writecheck(zinfo)
+
+    def add(self, zinfo):
+        """List a member whose header and data have been written."""
+        self.zf.filelist.append(zinfo)
+        self.zf.NameToInfo[zinfo.filename] = zinfo
+
+
+def set_zip_members(zf, members, start_dir):
+    """
+    Make a zipfile.ZipFile opened with mode 'a' list exactly "members", and write its central directory at start_dir when it is closed, cutting off everything after that. Used to rebuild the central directory of a damaged archive.
+
+    Arguments:
+        zf {ZipFile} -- archive opened with mode 'a'
+        members {list} -- ZipInfo of each member, with header_offset set
+        start_dir {int} -- offset just after the last member's data
+
+    Returns: None
+    """
+    check_zipfile()
+    with zf._lock:
+        zf.filelist = list(members)
+        zf.NameToInfo = {zinfo.filename: zinfo for zinfo in members}
+        zf.start_dir = start_dir
+        zf._didModify = True
+
+    return None
+
+
+def strip_extra(extra, ids):
+    """
+    Remove the fields with these header ids (e.g., 1, ZIP64) from a member's extra field. zipfile adds its own ZIP64 field when one is needed.
+    """
+    stripped, pos = bytearray(), 0
+    while pos + 4 <= len(extra):
+        field_id, size = struct.unpack_from('<HH', extra, pos)
+        if field_id not in ids:
+            stripped += extra[pos:pos + 4 + size]
+        pos += 4 + size
+
+    return bytes(stripped)
+
+
+def append_raw_member(zf, zinfo, src_fd, src_offset):
+    """
+    Write a member into an archive whose data already exists, byte for byte, in another file. The local header is written by zipfile; the data is copied by kernel_copy(). zinfo must already hold the CRC and both sizes.
+
+    Arguments:
+        zf {ZipFile} -- archive opened with mode 'w' or 'a'
+        zinfo {ZipInfo} -- description of the new member
+        src_fd {int} -- file descriptor holding the member's data
+        src_offset {int} -- where the member's data begins in src_fd
+
+    Returns: None
+    """
+    # sizes and CRC are known up front, so no data descriptor is needed;
+    # but an encrypted member's password check byte depends on whether it
+    # has one (it's from the time, not the CRC), so it keeps its descriptor
+    descriptor = zinfo.flag_bits & 0x08 and zinfo.flag_bits & 0x1
+    if not descriptor:
+        zinfo.flag_bits &= ~0x08
+
+    with ZipAppender(zf) as appender:
+        zinfo.header_offset = appender.offset
+        appender.check(zinfo)
+        appender.fp.write(zinfo.FileHeader())
+        appender.fp.flush()
+
+        data_offset = appender.offset
+        kernel_copy(src_fd, src_offset, appender.fp.fileno(), data_offset, zinfo.compress_size)
+        appender.fp.seek(data_offset + zinfo.compress_size)
+        if descriptor:
+            large = max(zinfo.file_size, zinfo.compress_size) > zipfile.ZIP64_LIMIT
+            appender.fp.write(struct.pack('<4sLQQ' if large else '<4sLLL', b'PK\x07\x08',
+                                          zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        appender.add(zinfo)
+
+    return None
+
+
+def write_stored_member(zf, file, arcname):
+    """
+    Add a file on disk to an archive without compressing it. Used for files that are already compressed (see stored_extensions). The CRC is computed in a single pass over a memory map of the file and the bytes are then copied by the kernel, so adding large media files is not CPU-bound.
+
+    Arguments:
+        zf {ZipFile} -- archive opened with mode 'w' or 'a'
+        file {str} -- path of the file on disk
+        arcname {str} -- name of the file in the archive
+
+    Returns: None
+    """
+    zinfo = zipfile.ZipInfo.from_file(file, arcname)
+    zinfo.compress_type = zipfile.ZIP_STORED
+
+    with open(file, 'rb') as src:
+        zinfo.file_size = zinfo.compress_size = os.fstat(src.fileno()).st_size
+        zinfo.CRC = crc_of_range(src.fileno(), 0, zinfo.file_size)
+        append_raw_member(zf, zinfo, src.fileno(), 0)
+
+    return None
+
+
+def copy_member(src, member, dst_zf, arcname=None):
+    """
+    Copy a member from one archive to another without decompressing it. The compressed data is copied verbatim by the kernel, whatever compression method the member uses.
+
+    Arguments:
+        src {MappedArchive} -- the source archive
+        member {Member} -- the member, as found in the source archive
+        dst_zf {ZipFile} -- archive opened with mode 'w' or 'a'
+        arcname {str} -- new name for the member (default: keep its name)
+
+    Returns:
+        zinfo {ZipInfo} -- the member, as written to dst_zf
+    """
+    info = src.zipinfo(member)
+    zinfo = zipfile.ZipInfo(arcname or info.filename, info.date_time)
+    for attr in ('compress_type', 'comment', 'create_system', 'create_version',
+                 'extract_version', 'flag_bits', 'internal_attr',
+                 'external_attr', 'CRC', 'compress_size', 'file_size'):
+        setattr(zinfo, attr, getattr(info, attr))
+
+    # FileHeader() adds its own ZIP64 field when one is needed
+    zinfo.extra = strip_extra(info.extra, (1,))
+
+    append_raw_member(dst_zf, zinfo, src.fileno(), src.data_offset(member))
+
+    return zinfo
+
+
+def member_data_ok(view, offset, info):
+    """
+    Check that a member's data decompresses to the size and CRC recorded for it.
+
+    Arguments:
+        view {memoryview} -- the archive's bytes
+        offset {int} -- where the member's (compressed) data begins
+        info {ZipInfo} -- the member
+
+    Returns:
+        ok {bool} -- True if the data is sound
+    """
+    try:
+        for chunk in inflate_chunks(view, offset, info):
+            pass
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError, NotImplementedError):
+        return False
+
+    return True
+
+
+def dos_date_time(d, t):
+    """The date_time tuple of a ZipInfo, from the DOS date and time in a zip header."""
+    return (d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F, t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2
+
+
+def saved_members(filename, concat):
+    """
+    Read the members of an archive from a copy of its central directory that Journal.save_directory() saved.
+
+    Arguments:
+        filename {str} -- fully qualified path to the copy (see directory_path())
+        concat {int} -- the number of bytes in front of the archive, which shift its offsets
+
+    Returns:
+        members {list} -- a ZipInfo per member, as zipfile would have read it
+    """
+    with open(filename, 'rb') as file:
+        data = file.read()
+
+    members, pos = [], 0
+    while data[pos:pos + 4] == zipfile.stringCentralDir:
+        (signature, create_version, create_system, extract_version, reserved,
+         flags, method, t, d, crc, compress_size, file_size, name_length,
+         extra_length, comment_length, disk, internal_attr, external_attr,
+         header_offset) = struct.unpack(zipfile.structCentralDir,
+                                        data[pos:pos + zipfile.sizeCentralDir])
+        pos += zipfile.sizeCentralDir
+        name = data[pos:pos + name_length].decode('utf-8' if flags & 0x800 else 'cp437')
+        pos += name_length
+        extra = data[pos:pos + extra_length]
+        pos += extra_length
+        comment = data[pos:pos + comment_length]
+        pos += comment_length
+        if len(comment) < comment_length:
+            raise zipfile.BadZipFile('Truncated central directory')
+
+        zinfo = zipfile.ZipInfo(name, dos_date_time(d, t))
+        zinfo.file_size, zinfo.compress_size, header_offset = zip64_values(
+            extra, file_size, compress_size, header_offset)
+        zinfo.header_offset = header_offset + concat
+        zinfo.extra = strip_extra(extra, (1,))
+        zinfo.comment = comment
+        (zinfo.create_version, zinfo.create_system, zinfo.extract_version, zinfo.reserved,
+         zinfo.flag_bits, zinfo.compress_type, zinfo.CRC) = (
+            create_version, create_system, extract_version, reserved, flags, method, crc)
+        zinfo.volume, zinfo.internal_attr, zinfo.external_attr = disk, internal_attr, external_attr
+        members.append(zinfo)
+
+    return members
+
+
+def recover_archive(filename, journal):
+    """
+    Rebuild the central directory of an archive that was cut short, e.g., because katz was killed while adding files to it. The members that were there before the add are kept as they were, from the copy of the central directory that the journal saved (see Journal.save_directory()). After them, the local header in front of each member is read in turn. A member that the journal lists with the same size and CRC is kept as it is; any other member is kept only if its data decompresses to the size and CRC in its header. Everything after the last good member is discarded.
+
+    Arguments:
+        filename {str} -- fully qualified path to the archive (or shard)
+        journal {Journal} -- the journal of the interrupted add
+
+    Returns:
+        recovered {bool} -- True if the archive had to be rebuilt
+    """
+    if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+        return False
+
+    # an archive that can be read needs no help
+    try:
+        MappedArchive(filename).close()
+        return False
+    except (zipfile.BadZipFile, struct.error, ValueError):
+        pass
+
+    # the add wrote its first member where the central directory was
+    members, offset = [], None
+    if Path(filename).name in journal.directories:
+        start, concat = journal.directories[Path(filename).name]
+        try:
+            members = saved_members(directory_path(filename), concat)
+            offset = start
+        except (OSError, zipfile.BadZipFile, struct.error, UnicodeDecodeError):
+            members = []
+
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+
+            # without a saved central directory, every member is looked at;
+            # anything in front of the first (e.g., a self-extractor) is kept
+            if offset is None or offset > len(view):
+                members, offset = [], mm.find(zipfile.stringFileHeader)
+            if offset < 0:
+                offset = len(view)
+
+            while view[offset:offset + 4] == zipfile.stringFileHeader:
+                (signature, extract_version, reserved, flags, method, t, d, crc,
+                 compress_size, file_size, name_length, extra_length) = struct.unpack(
+                    zipfile.structFileHeader, view[offset:offset + zipfile.sizeFileHeader])
+                name_start = offset + zipfile.sizeFileHeader
+                name_end = name_start + name_length
+                data_start = name_end + extra_length
+                extra = bytes(view[name_end:data_start])
+                file_size, compress_size, header_offset = zip64_values(
+                    extra, file_size, compress_size, 0)
+
+                # without sizes in the header, the end of the data can't be found
+                if flags & 0x08 or data_start + compress_size > len(view):
+                    break
+
+                zinfo = zipfile.ZipInfo(
+                    bytes(view[name_start:name_end]).decode('utf-8' if flags & 0x800 else 'cp437'),
+                    dos_date_time(d, t))
+                zinfo.compress_type = method
+                zinfo.flag_bits = flags
+                zinfo.CRC = crc
+                zinfo.file_size, zinfo.compress_size = file_size, compress_size
+                zinfo.header_offset = offset
+                zinfo.extract_version = extract_version
+                zinfo.create_version = max(zinfo.create_version, zinfo.extract_version)
+                zinfo.extra = strip_extra(extra, (1,))
+                # the mode of a member the add journaled is known; a
+                # member that isn't in the journal gets the default mode
+                if zinfo.filename in journal.attrs:
+                    zinfo.external_attr = journal.attrs[zinfo.filename]
+                elif zinfo.is_dir():
+                    zinfo.external_attr = 0o40775 << 16 | 0x10
+                else:
+                    zinfo.external_attr = 0o644 << 16
+
+                if not (journal.done(zinfo.filename, file_size, zinfo.CRC)
+                        or flags & 0x1 or member_data_ok(view, data_start, zinfo)):
+                    break
+
+                members.append(zinfo)
+                offset = data_start + compress_size
+
+            view.release()
+
+    # opened for appending, a damaged archive is treated as a plain file;
+    # closing it writes the new central directory right after the last
+    # good member and cuts off the rest
+    with zipfile.ZipFile(filename, 'a') as zf:
+        set_zip_members(zf, members, offset)
+
+    return True
+
+
+class MemberTable:
+    """
+    Compact table of the members of an archive. Instead of one ZipInfo object per member, all names are kept (as UTF-8) in one bytes blob with an array of offsets into it, and sizes, CRCs, offsets, dates and compression methods are kept in typed arrays. A member costs about 60 bytes plus its name, rather than the 500 or more bytes of a ZipInfo.
+
+    Members are looked at through Member views, which are created on demand. The full central directory record of a member is still in the archive (cd_offset), so MappedArchive.zipinfo() can build a ZipInfo when one is really needed.
+    """
+
+    def __init__(self):
+        self.names = b''
+        self.name_ends = array('Q')
+        self.file_size = array('Q')
+        self.compress_size = array('Q')
+        self.header_offset = array('Q')
+        self.cd_offset = array('Q')
+        self.crc = array('I')
+        # (dos date << 16) | dos time
+        self.date_time = array('I')
+        # (compression method << 16) | flag bits
+        self.method_flags = array('I')
+        self._order = None
+
+    def __len__(self):
+        return len(self.name_ends)
+
+    def __getitem__(self, ndx):
+        if ndx < 0:
+            ndx += len(self)
+        if not 0 <= ndx < len(self):
+            raise IndexError('member index out of range')
+        return Member(self, ndx)
+
+    def __iter__(self):
+        for ndx in range(len(self)):
+            yield Member(self, ndx)
+
+    def name_bytes(self, ndx):
+        start = self.name_ends[ndx - 1] if ndx else 0
+        return self.names[start:self.name_ends[ndx]]
+
+    def name(self, ndx):
+        return self.name_bytes(ndx).decode('utf-8')
+
+    def order(self):
+        """
+        Indexes of the members, sorted by name. Sorting UTF-8 bytes gives the same order as sorting the names themselves. The order is computed once, then kept.
+        """
+        if self._order is None:
+            self._order = array('I', sorted(range(len(self)), key=self.name_bytes))
+        return self._order
+
+    def find(self, name):
+        """
+        Binary search for a member by name; returns its index or -1.
+        """
+        key = name.encode('utf-8')
+        order = self.order()
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name_bytes(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self.name_bytes(order[lo]) == key:
+            return order[lo]
+        return -1
+
+
+class Member:
+    """
+    A lightweight view of one member of a MemberTable, with the ZipInfo attributes that katz uses.
+    """
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def filename(self):
+        return self.table.name(self.index)
+
+    @property
+    def file_size(self):
+        return self.table.file_size[self.index]
+
+    @property
+    def compress_size(self):
+        return self.table.compress_size[self.index]
+
+    @property
+    def header_offset(self):
+        return self.table.header_offset[self.index]
+
+    @property
+    def CRC(self):
+        return self.table.crc[self.index]
+
+    @property
+    def compress_type(self):
+        return self.table.method_flags[self.index] >> 16
+
+    @property
+    def flag_bits(self):
+        return self.table.method_flags[self.index] & 0xFFFF
+
+    @property
+    def date_time(self):
+        d, t = self.table.date_time[self.index] >> 16, self.table.date_time[self.index] & 0xFFFF
+        return ((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F,
+                t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2)
+
+    def is_dir(self):
+        return self.table.name_bytes(self.index).endswith(b'/')
+
+
+class MappedArchive:
+    """
+    Read-only access to a zip archive through a memory map of the whole file. The central directory and local headers are parsed straight from the map into a MemberTable, and members are decompressed from memoryview slices of the map, so reading a member needs no seek() or read() calls and no intermediate copies. The method names follow zipfile.ZipFile so that the two can be used the same way.
+
+    Encrypted members are handed to zipfile.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+        self._mmap = None
+        self._zipfile = None
+        self._file = open(filename, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size == 0:
+                raise zipfile.BadZipFile('File is not a zip file')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self._mmap)
+            self.members = self._read_central_directory()
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        """Close the map and the file in case the caller forgot."""
+        self.close()
+
+    def close(self):
+        if self._zipfile:
+            self._zipfile.close()
+            self._zipfile = None
+        if self._mmap is not None:
+            self.view.release()
+            try:
+                self._mmap.close()
+            except BufferError:
+                # a slice is still in use somewhere; the map closes once it is freed
+                pass
+            self._mmap = None
+        if self._file:
+            self._file.close()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def release(self, start, end):
+        """
+        Let go of the pages of the map between start and end, which were already read. See release_pages().
+        """
+        if self._mmap is not None:
+            release_pages(self._mmap, start, end)
+
+    def _read_central_directory(self):
+        """
+        Parse the central directory into a MemberTable, including ZIP64 archives and archives with data prepended to them (e.g., self-extracting archives).
+        """
+        view = self.view
+
+        # the end of central directory record is in the last 64 KB or so
+        start = max(0, len(view) - zipfile.sizeEndCentDir - 0xFFFF)
+        pos = self._mmap.rfind(zipfile.stringEndArchive, start)
+        if pos < 0:
+            raise zipfile.BadZipFile('File is not a zip file')
+        (signature, disk, cd_disk, disk_entries, entries, cd_size, cd_offset,
+         comment_length) = struct.unpack(zipfile.structEndArchive,
+                                         view[pos:pos + zipfile.sizeEndCentDir])
+        end_of_cd = pos
+
+        # a ZIP64 archive has another end record just before this one
+        locator = pos - zipfile.sizeEndCentDir64Locator
+        if locator >= 0 and view[locator:locator + 4] == zipfile.stringEndArchive64Locator:
+            # like zipfile, expect the ZIP64 record right before its locator
+            rec_offset = locator - zipfile.sizeEndCentDir64
+            (signature, record_size, create_version, extract_version, disk, cd_disk,
+             disk_entries, entries, cd_size, cd_offset) = struct.unpack(
+                zipfile.structEndArchive64, view[rec_offset:locator])
+            if signature != zipfile.stringEndArchive64:
+                raise zipfile.BadZipFile('Corrupt ZIP64 end of central directory record')
+            end_of_cd = rec_offset
+
+        # bytes in front of the archive shift every offset in it
+        self.concat = concat = end_of_cd - cd_size - cd_offset
+        if concat < 0:
+            raise zipfile.BadZipFile('Bad offset for central directory')
+        self.cd_start = cd_offset + concat
+
+        table = MemberTable()
+        names = bytearray()
+        unpack = struct.Struct(zipfile.structCentralDir).unpack_from
+        pos, end = cd_offset + concat, cd_offset + concat + cd_size
+        while pos < end:
+            (signature, create_version, create_system, extract_version, reserved,
+             flags, method, t, d, crc, compress_size, file_size, name_length,
+             extra_length, comment_length, disk, internal_attr, external_attr,
+             header_offset) = unpack(self._mmap, pos)
+            if signature != zipfile.stringCentralDir:
+                raise zipfile.BadZipFile('Bad magic number for central directory')
+
+            name_start = pos + zipfile.sizeCentralDir
+            name = self._mmap[name_start:name_start + name_length]
+            if not (name.isascii() or flags & 0x800) or b'\x00' in name or os.sep != '/':
+                # decode exactly as zipfile.ZipInfo does
+                name = zipfile.ZipInfo(name.decode('utf-8' if flags & 0x800 else 'cp437')).filename
+                name = name.encode('utf-8')
+
+            if 0xFFFFFFFF in (file_size, compress_size, header_offset):
+                extra_start = name_start + name_length
+                file_size, compress_size, header_offset = zip64_values(
+                    self._mmap[extra_start:extra_start + extra_length],
+                    file_size, compress_size, header_offset)
+
+            names += name
+            table.name_ends.append(len(names))
+            table.file_size.append(file_size)
+            table.compress_size.append(compress_size)
+            table.header_offset.append(header_offset + concat)
+            table.cd_offset.append(pos)
+            table.crc.append(crc)
+            table.date_time.append(d << 16 | t)
+            table.method_flags.append(method << 16 | flags)
+
+            pos = name_start + name_length + extra_length + comment_length
+
+        table.names = bytes(names)
+
+        return table
+
+    def zipinfo(self, member):
+        """
+        Build a complete ZipInfo for a member from its central directory record, e.g., to copy the member to another archive.
+        """
+        pos = self.members.cd_offset[member.index]
+        centdir = struct.unpack(zipfile.structCentralDir,
+                                self.view[pos:pos + zipfile.sizeCentralDir])
+        name_length, extra_length, comment_length = centdir[12:15]
+        pos += zipfile.sizeCentralDir + name_length
+
+        info = zipfile.ZipInfo(member.filename, member.date_time)
+        info.extra = bytes(self.view[pos:pos + extra_length])
+        pos += extra_length
+        info.comment = bytes(self.view[pos:pos + comment_length])
+
+        (info.create_version, info.create_system, info.extract_version,
+         info.reserved, info.flag_bits, info.compress_type) = centdir[1:7]
+        info.volume, info.internal_attr, info.external_attr = centdir[15:18]
+        info.CRC, info.file_size = member.CRC, member.file_size
+        info.compress_size, info.header_offset = member.compress_size, member.header_offset
+
+        return info
+
+    def infolist(self):
+        return self.members
+
+    def namelist(self):
+        return [self.members.name(ndx) for ndx in range(len(self.members))]
+
+    def getinfo(self, name):
+        ndx = self.members.find(name)
+        if ndx < 0:
+            raise KeyError('There is no item named %r in the archive' % name)
+        return self.members[ndx]
+
+    def data_offset(self, info):
+        """
+        Find where the (compressed) data of a member begins. The central directory only records the offset of the member's local header, whose length depends on the file name and "extra" fields stored in it.
+        """
+        offset = info.header_offset
+        if self.view[offset:offset + 4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile('Bad magic number for file header')
+        name_length, extra_length = struct.unpack('<HH', self.view[offset + 26:offset + 30])
+
+        return offset + zipfile.sizeFileHeader + name_length + extra_length
+
+    def read_chunks(self, info):
+        """
+        Generate the decompressed contents of a member, chunk by chunk, fed from slices of the memory map by inflate_chunks().
+        """
+        if info.flag_bits & 0x1:
+            # encrypted members are left to zipfile
+            if not self._zipfile:
+                self._zipfile = zipfile.ZipFile(self.filename, 'r')
+            with self._zipfile.open(info.filename) as source:
+                while True:
+                    chunk = source.read(buffer_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        yield from inflate_chunks(self.view, self.data_offset(info), info,
+                                  self.release if max_memory else None)
+
+    def extract(self, info, target_path):
+        """
+        Decompress a member into the file target_path, whose folder must already exist. A file that fails the CRC check is deleted.
+        """
+        try:
+            with open(target_path, 'wb') as target:
+                if (info.compress_type == zipfile.ZIP_DEFLATED and not info.flag_bits & 0x1
+                        and info.compress_size >= pipeline_threshold):
+                    pipelined_inflate(self.view, self.data_offset(info), info, target,
+                                      self.release if max_memory else None)
+                else:
+                    for chunk in self.read_chunks(info):
+                        target.write(chunk)
+        except (zipfile.BadZipFile, zlib.error):
+            os.remove(target_path)
+            raise
+
+        return target_path
+
+    def testzip(self):
+        """
+        Read every member and check its CRC. Returns the name of the first bad member or None, just like ZipFile.testzip().
+        """
+        for info in self.members:
+            try:
+                for chunk in self.read_chunks(info):
+                    pass
+            except (zipfile.BadZipFile, zlib.error, EOFError, OSError, struct.error):
+                return info.filename
+
+        return None
+
+
+class ArchiveIndex:
+    """
+    The files of the open archive as katz lists them: sorted by name, in reverse order, and numbered from 1. For a sharded archive, the member tables of all shards are merged into one list. Each entry is stored in an array as (part number << 40 | member index), so the list costs 8 bytes per file. Indexing the ArchiveIndex returns file names, so it can be used wherever a list of names is expected.
+    """
+
+    def __init__(self, full_filename):
+        self.parts = shard_parts(full_filename)
+        self.archives = []
+        try:
+            self.archives = parallel_map(MappedArchive, self.parts)
+        except:
+            self.close()
+            raise
+
+        # merge the (ascending) orders of all parts, then reverse the result
+        tables = [archive.members for archive in self.archives]
+        if len(tables) == 1:
+            entries = tables[0].order()
+        else:
+            entries = heapq.merge(*(self._keyed(part, table) for part, table in enumerate(tables)))
+            entries = (entry for name, entry in entries)
+        self.entries = array('Q', entries)
+        self.entries.reverse()
+
+        # built on first use by folder_files()
+        self._folders = None
+        self._subfolders = None
+
+    @staticmethod
+    def _keyed(part, table):
+        """
+        (name, entry) of each member of one part, sorted by name, for merging the parts. A function of its own, so that each generator keeps its own part and table.
+        """
+        return ((table.name_bytes(ndx), part << 40 | ndx) for ndx in table.order())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for archive in self.archives:
+            archive.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, n):
+        part, ndx = self.locate(n)
+        return self.archives[part].members.name(ndx)
+
+    def __iter__(self):
+        for n in range(len(self.entries)):
+            yield self[n]
+
+    def locate(self, n):
+        """
+        Part number and member index of the n-th file (counting from 0).
+        """
+        entry = self.entries[n]
+        return entry >> 40, entry & 0xFFFFFFFFFF
+
+    def find(self, name):
+        """
+        Part number and member index of the file "name", or None.
+        """
+        for part, archive in enumerate(self.archives):
+            ndx = archive.members.find(name)
+            if ndx >= 0:
+                return part, ndx
+        return None
+
+    def folder_files(self, folder, recursive=False):
+        """
+        Find the files in a folder of the archive. Folder names are not case sensitive and may use "/" or "\\"; "." is the archive's root folder. The answer takes time proportional to the number of files found.
+
+        Arguments:
+            folder {str} -- folder name, e.g., "proj\\docs"
+            recursive {bool} -- include files in subfolders
+
+        Returns:
+            positions {list} -- positions (counting from 0) of the files, in listing order
+        """
+        folder = folder.replace('\\', '/').strip('/').upper() or '.'
+
+        # with a memory budget, a big archive's folder index may not fit:
+        # look through the file names instead
+        if self._folders is None and memory_available and \
+                len(self.entries) * 64 > memory_available // 4:
+            return self._scan_folder(folder, recursive)
+
+        if self._folders is None:
+            self._build_folders()
+
+        if folder not in self._folders and folder not in self._subfolders:
+            return []
+        if not recursive:
+            return list(self._folders.get(folder, []))
+
+        positions, folders = [], [folder]
+        while folders:
+            folder = folders.pop()
+            positions.extend(self._folders.get(folder, []))
+            folders.extend(self._subfolders.get(folder, []))
+
+        return sorted(positions)
+
+    def _scan_folder(self, folder, recursive):
+        """
+        folder_files() without the folder index: look at every file name.
+        """
+        positions = []
+        for n in range(len(self.entries)):
+            part, ndx = self.locate(n)
+            name = self.archives[part].members.name_bytes(ndx).rstrip(b'/')
+            parent = name.rpartition(b'/')[0].decode('utf-8').upper() or '.'
+            if parent == folder or (recursive and (folder == '.' or parent.startswith(folder + '/'))):
+                positions.append(n)
+
+        return positions
+
+    def _build_folders(self):
+        """
+        Build a tree of the archive's folders: for each folder (upper case, "/"-separated), the positions of its files and the names of its subfolders.
+        """
+        self._folders, self._subfolders = {}, {}
+        last_folder, key = None, None
+        for n in range(len(self.entries)):
+            part, ndx = self.locate(n)
+            name = self.archives[part].members.name_bytes(ndx)
+
+            # same rule as Path(name).parent; a folder entry ("a/b/") is in "a"
+            folder = name.rstrip(b'/').rpartition(b'/')[0]
+            if folder != last_folder:
+                last_folder, key = folder, folder.decode('utf-8').upper() or '.'
+            if key not in self._folders:
+                self._folders[key] = array('Q')
+
+                # link the folder, and any new parent folders, into the tree
+                child = key
+                while child != '.':
+                    parent = child.rpartition('/')[0] or '.'
+                    known = parent in self._subfolders
+                    self._subfolders.setdefault(parent, set()).add(child)
+                    if known:
+                        break
+                    child = parent
+            self._folders[key].append(n)
+
+
+class NameIndex:
+    """
+    A search index of the file names in an archive, for <FIND>. The names are kept in listing order in one block of bytes (plus a lower-case copy to search), with an array of the offsets where each name starts. The names are grouped in blocks of name_index_block names, and for each trigram (three consecutive bytes) the index keeps the numbers of the blocks whose names contain it. A search looks only at the blocks that contain every trigram of the text it is looking for, so it takes time proportional to the number of candidates, not to the size of the archive. The index is saved in cache_location and used again for as long as the archive doesn't change (see archive_key()).
+    """
+
+    def __init__(self, names, starts, trigrams, key):
+        self.names = names
+        self.lower = names.lower()
+        self.starts = starts
+        self.trigrams = trigrams
+        self.key = key
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, n):
+        return self.names[self.starts[n]:self.starts[n + 1] - 1].decode('utf-8')
+
+    @classmethod
+    def build(cls, full_filename, key):
+        """
+        Index the names of an archive, in the order in which <L>ist numbers them.
+        """
+        with ArchiveIndex(full_filename) as index:
+            names = []
+            for n in range(len(index)):
+                part, ndx = index.locate(n)
+                names.append(index.archives[part].members.name_bytes(ndx))
+
+        # every name ends with a newline, so no match runs into the next name
+        starts = array('Q', [0])
+        for name in names:
+            starts.append(starts[-1] + len(name) + 1)
+        names = b'\n'.join(names) + b'\n' if names else b''
+
+        self = cls(names, starts, {}, key)
+        for block in range(0, len(self), name_index_block):
+            start, end = self._span(block // name_index_block)
+            text = self.lower[start:end]
+            for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                postings = self.trigrams.get(gram)
+                if postings is None:
+                    postings = self.trigrams[gram] = array('I')
+                postings.append(block // name_index_block)
+
+        return self
+
+    @classmethod
+    def load(cls, full_filename, key):
+        """
+        The saved index of an archive, or None if there is none or the archive has changed since it was saved.
+        """
+        try:
+            with open(cls.cache_path(full_filename), 'rb') as file:
+                header = json.loads(file.readline())
+                if header['key'] != json.loads(json.dumps(key)):
+                    return None
+
+                names = file.read(header['names'])
+                starts = array('Q')
+                starts.frombytes(file.read(header['starts'] * starts.itemsize))
+                grams = file.read(header['trigrams'] * 3)
+                offsets = array('Q')
+                offsets.frombytes(file.read((header['trigrams'] + 1) * offsets.itemsize))
+                postings = array('I')
+                postings.frombytes(file.read(offsets[-1] * postings.itemsize))
+        except (OSError, ValueError, KeyError, IndexError):
+            return None
+
+        trigrams = {grams[3 * i:3 * i + 3]: postings[offsets[i]:offsets[i + 1]]
+                    for i in range(header['trigrams'])}
+        return cls(names, starts, trigrams, key)
+
+    def save(self, full_filename):
+        """
+        Save the index in cache_location. A cache that can't be written is no reason to fail: the index is just built again next time.
+        """
+        grams = sorted(self.trigrams)
+        offsets, postings = array('Q', [0]), array('I')
+        for gram in grams:
+            postings.extend(self.trigrams[gram])
+            offsets.append(len(postings))
+        header = {'key': self.key, 'names': len(self.names), 'starts': len(self.starts),
+                  'trigrams': len(grams)}
+
+        path = self.cache_path(full_filename)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(json.dumps(header).encode('utf-8') + b'\n')
+                file.write(self.names)
+                self.starts.tofile(file)
+                file.write(b''.join(grams))
+                offsets.tofile(file)
+                postings.tofile(file)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def cache_path(full_filename):
+        """One index file per archive, named after the archive and a CRC of its path."""
+        path = os.path.abspath(full_filename)
+        return os.path.join(cache_location, 'find', '{}-{:08x}.idx'.format(
+            Path(path).stem, zlib.crc32(path.encode('utf-8'))))
+
+    def _span(self, block):
+        """Offsets of the first and (one past) the last byte of a block of names."""
+        first = block * name_index_block
+        return self.starts[first], self.starts[min(first + name_index_block, len(self))]
+
+    def _candidates(self, fragments):
+        """
+        Spans of the blocks that may hold names containing all of the fragments (lower-case bytes): those whose names have every trigram of the fragments. Fragments shorter than three bytes don't narrow the search.
+        """
+        grams = {fragment[i:i + 3] for fragment in fragments for i in range(len(fragment) - 2)}
+        if not grams:
+            return [(0, len(self.names))]
+
+        # intersect the shortest lists first; once only a few blocks are
+        # left, searching them costs less than intersecting further
+        lists = sorted((self.trigrams.get(gram, ()) for gram in grams), key=len)
+        blocks = set(lists[0])
+        for postings in lists[1:]:
+            if len(blocks) <= 8:
+                break
+            blocks.intersection_update(postings)
+
+        return [self._span(block) for block in sorted(blocks)]
+
+    def _position(self, offset):
+        """Position (counting from 0) of the name holding the byte at "offset"."""
+        return bisect.bisect_right(self.starts, offset) - 1
+
+    def substring(self, text):
+        """
+        Positions of the names that contain "text", ignoring case.
+        """
+        text = text.lower().encode('utf-8')
+        positions = []
+        for start, end in self._candidates([text]):
+            i = self.lower.find(text, start, end)
+            while i >= 0:
+                n = self._position(i)
+                positions.append(n)
+                i = self.lower.find(text, self.starts[n + 1], end)
+
+        return positions
+
+    def glob(self, pattern):
+        """
+        Positions of the names that match wildcards (*, ?), ignoring case. Wildcards without a "/" are matched against the file name alone, as in grep's "/name=...".
+        """
+        pattern = pattern.lower().encode('utf-8')
+        pieces = re.split(rb'([*?])', pattern)
+        regex = b''.join(b'[^\n]*' if piece == b'*' else b'[^\n]' if piece == b'?'
+                         else re.escape(piece) for piece in pieces)
+        if b'/' not in pattern:
+            regex = b'(?:[^\n]*/)?' + regex
+        regex = re.compile(b'(?m)^' + regex + b'$')
+
+        positions = []
+        for start, end in self._candidates(pieces[::2]):
+            positions.extend(self._position(match.start())
+                             for match in regex.finditer(self.lower, start, end))
+
+        return positions
+
+    def fuzzy(self, text):
+        """
+        Names that share most of the trigrams of "text", ignoring case, so that typing errors and missing letters still find them. Short words have few trigrams, and two swapped letters spoil most of them: if nothing is found, the text is tried again with each pair of neighbouring letters swapped.
+
+        Returns:
+            scored {list} -- (share of the trigrams of "text" in the name, position) for each name found
+        """
+        text = text.lower().encode('utf-8')
+        if len(text) < 3:
+            return [(1.0, n) for n in self.substring(text.decode('utf-8'))]
+
+        scores = self._similar(text)
+        if not scores:
+            for i in range(len(text) - 1):
+                swapped = text[:i] + text[i + 1:i + 2] + text[i:i + 1] + text[i + 2:]
+                for n, score in self._similar(swapped).items():
+                    scores[n] = max(scores.get(n, 0), score * 0.9)
+
+        return [(score, n) for n, score in scores.items()]
+
+    def _similar(self, text):
+        """
+        Positions of the names that have at least half of the trigrams of "text" (lower-case bytes), with the share they have.
+        """
+        grams = {text[i:i + 3] for i in range(len(text) - 2)}
+
+        # count, per block, the trigrams it shares with the text; only the
+        # fuzzy_blocks blocks sharing the most are searched
+        counts = {}
+        for gram in grams:
+            for block in self.trigrams.get(gram, ()):
+                counts[block] = counts.get(block, 0) + 1
+        needed = (len(grams) + 1) // 2
+        blocks = sorted((block for block, count in counts.items() if count >= needed),
+                        key=counts.get, reverse=True)[:fuzzy_blocks]
+
+        scores = {}
+        for block in blocks:
+            first = block * name_index_block
+            for n in range(first, min(first + name_index_block, len(self))):
+                name = self.lower[self.starts[n]:self.starts[n + 1] - 1]
+                shared = sum(1 for gram in grams if gram in name)
+                if shared >= needed:
+                    scores[n] = shared / len(grams)
+
+        return scores
+
+
+def name_index(full_filename):
+    """
+    The NameIndex of an archive: kept in memory, loaded from cache_location or, failing that, built and saved.
+    """
+    global name_index_cache
+
+    key = archive_key(full_filename)
+    if name_index_cache is None or name_index_cache.key != key:
+        name_index_cache = NameIndex.load(full_filename, key)
+        if name_index_cache is None:
+            name_index_cache = NameIndex.build(full_filename, key)
+            name_index_cache.save(full_filename)
+
+    return name_index_cache
+
+
+class ExtractionPlan:
+    """
+    Everything extractFiles() needs to know before it extracts the first file: where each selected member goes, which files already exist on disk, the folders to create, and the total number of bytes to be written. Within each archive (or shard), members are extracted in the order of their local headers, so the archive is read from front to back instead of jumping around in it.
+    """
+
+    def __init__(self, file_list, selected_files, extract_location):
+        self.file_list = file_list
+        self.extract_location = extract_location
+
+        # {part number: [(header offset, member index, target path), ...]}
+        self.parts = {}
+        # (part number, member index, target path, os.stat_result) of
+        # files already on disk
+        self.conflicts = []
+
+        for file in selected_files:
+            part, ndx = file_list.find(file)
+            member = file_list.archives[part].members[ndx]
+            target_path = member_target_path(extract_location, member.filename)
+            self.parts.setdefault(part, []).append((member.header_offset, ndx, target_path))
+
+            # one stat() per file tells whether it would be overwritten;
+            # resolve() decides what to do about it without another stat()
+            if not member.is_dir():
+                try:
+                    st = os.stat(target_path)
+                    if stat.S_ISREG(st.st_mode):
+                        self.conflicts.append((part, ndx, target_path, st))
+                except OSError:
+                    pass
+
+        for items in self.parts.values():
+            items.sort()
+
+    @property
+    def total_size(self):
+        """Number of bytes that the planned extraction will write."""
+        return sum(self.file_list.archives[part].members.file_size[ndx]
+                   for part, items in self.parts.items() for offset, ndx, target_path in items)
+
+    def skip(self, skip_these):
+        """Drop the (part number, member index) pairs in skip_these from the plan."""
+        for part in self.parts:
+            self.parts[part] = [item for item in self.parts[part]
+                                if (part, item[1]) not in skip_these]
+        self.conflicts = [conflict for conflict in self.conflicts
+                          if conflict[:2] not in skip_these]
+
+    def resolve(self, policy):
+        """
+        Decide, for every file that already exists on disk, whether to extract it:
+            -- 'skip': never overwrite
+            -- 'overwrite': always overwrite
+            -- 'newer': overwrite if the archived file is newer
+            -- 'crc': overwrite if the size or CRC of the file on disk differs
+            -- 'rename': extract beside the existing file, e.g., "notes (1).txt"
+
+        Returns:
+            num_skipped {int} -- number of files that will not be extracted
+        """
+        skip_these, renamed = set(), {}
+
+        if policy == 'skip':
+            skip_these = {(part, ndx) for part, ndx, target_path, st in self.conflicts}
+
+        elif policy == 'newer':
+            for part, ndx, target_path, st in self.conflicts:
+                member = self.file_list.archives[part].members[ndx]
+                # zip files store times in 2-second steps
+                if member_timestamp(member) < st.st_mtime + 2:
+                    skip_these.add((part, ndx))
+
+        elif policy == 'crc':
+            # the CRCs of files on disk are computed concurrently
+            for conflict, different in zip(self.conflicts, parallel_map(self._differs, self.conflicts)):
+                if not different:
+                    skip_these.add(conflict[:2])
+
+        elif policy == 'rename':
+            for part, ndx, target_path, st in self.conflicts:
+                folder, name = os.path.split(target_path)
+                taken = set()
+                new_name = name
+                while os.path.exists(os.path.join(folder, new_name)):
+                    taken.add(new_name)
+                    new_name = unique_name(name, taken)
+                renamed[(part, ndx)] = os.path.join(folder, new_name)
+
+        self.skip(skip_these)
+        for part in self.parts:
+            self.parts[part] = [(offset, ndx, renamed.get((part, ndx), target_path))
+                                for offset, ndx, target_path in self.parts[part]]
+        self.conflicts = []
+
+        return len(skip_these)
+
+    def _differs(self, conflict):
+        """True if the size or CRC of a file on disk differs from the archived file's."""
+        part, ndx, target_path, st = conflict
+        members = self.file_list.archives[part].members
+        if st.st_size != members.file_size[ndx]:
+            return True
+        with open(target_path, 'rb') as file:
+            return crc_of_range(file.fileno(), 0, st.st_size) != members.crc[ndx]
+
+    def resume(self, journal):
+        """
+        Leave out the files that an interrupted extraction already finished: those listed in its journal whose size and CRC on disk still match the archive.
+
+        Returns:
+            num_done {int} -- number of files that are already extracted
+        """
+        finished = []
+        for conflict in self.conflicts:
+            part, ndx, target_path, st = conflict
+            members = self.file_list.archives[part].members
+            if journal.done(target_path, members.file_size[ndx], members.crc[ndx]):
+                finished.append(conflict)
+
+        done_these = {conflict[:2] for conflict, different in
+                      zip(finished, parallel_map(self._differs, finished)) if not different}
+        self.skip(done_these)
+
+        return len(done_these)
+
+    def free_space(self):
+        """Free bytes on the disk that receives the extracted files."""
+        path = Path(self.extract_location)
+        while not path.exists() and path.parent != path:
+            path = path.parent
+
+        return shutil.disk_usage(str(path)).free
+
+    def make_dirs(self):
+        """Create every folder the extracted files need, before any file is extracted."""
+        folders = set()
+        for part, items in self.parts.items():
+            members = self.file_list.archives[part].members
+            for offset, ndx, target_path in items:
+                folders.add(target_path if members[ndx].is_dir() else os.path.dirname(target_path))
+
+        # only the deepest folders need os.makedirs(); it creates their parents
+        folders = sorted(folders, reverse=True)
+        for ndx, folder in enumerate(folders):
+            if ndx and folders[ndx - 1].startswith(folder + os.sep):
+                continue
+            os.makedirs(folder, exist_ok=True)
+
+    def items(self):
+        """
+        The planned extractions as (part number, header offset, member index, target path), in the order run() extracts them: within a part, the files stay in the order of the archive, and the parts take turns.
+        """
+        return [item for items in itertools.zip_longest(
+                    *[[(part,) + item for item in self.parts[part]] for part in sorted(self.parts)])
+                for item in items if item]
+
+    def extract_item(self, item, journal=None, durability='none', verbose=True):
+        """
+        Extract one of items(). Stored members are copied straight from the archive by extract_member(). With durability "file", the file is flushed to disk before it is recorded in journal.
+
+        Returns:
+            target_path {str} -- the extracted file, or None for a folder
+        """
+        part, offset, ndx, target_path = item
+        f = self.file_list.archives[part]
+        member = f.members[ndx]
+        if verbose:
+            print(member.filename)
+        extract_member(f, member, self.extract_location, target_path)
+        if member.is_dir():
+            return None
+        if durability == 'file':
+            fsync_path(target_path)
+        if journal:
+            journal.record(target_path, member.file_size, member.CRC)
+
+        return target_path
+
+    def run(self, journal=None, durability='none', verbose=True):
+        """
+        Extract the planned files, several at a time; a ConcurrencyController finds the best number of threads for the disk being written to. The parts of a sharded archive take turns, so they are read concurrently. Each finished file is recorded in journal, if there is one. With durability "file", each file is flushed to disk before it is recorded; with "batch", all files are flushed once extraction is done (see durability_modes).
+        """
+        items = self.items()
+        sizes = [self.file_list.archives[part].members.compress_size[ndx]
+                 for part, offset, ndx, target_path in items]
+
+        controller = ConcurrencyController(self.extract_location)
+        extracted = [path for path in controller.map(
+                         lambda item: self.extract_item(item, journal, durability, verbose), items, sizes)
+                     if path]
+        controller.finish()
+
+        self.finish(extracted, durability)
+
+    def finish(self, extracted, durability='none'):
+        """With durability "batch", flush the extracted files to disk; with "file", their folders."""
+        if durability == 'batch':
+            sync_paths(extracted)
+        elif durability == 'file':
+            sync_folders(extracted)
+
+
+class Journal:
+    """
+    A record of the files that an add or extraction has finished, so that an interrupted add or extraction can pick up where it stopped. Each line holds one file, as a JSON list: [name, size, CRC], and for an add, the member's external attributes (its mode), too. Lines are written as files are finished; a line cut short by a crash is ignored.
+
+    Before an add appends to the archive or a shard, a JSON object is written for it: where its central directory began, and the shift of its offsets (see save_directory()).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.attrs = {}
+        # part name --> (start of its central directory, concat)
+        self.directories = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        if isinstance(entry, dict):
+                            self.directories[entry['part']] = (entry['start'], entry['concat'])
+                            continue
+                        name, size, crc = entry[:3]
+                    except (ValueError, TypeError, KeyError):
+                        continue
+                    self.entries[name] = (size, crc)
+                    if len(entry) > 3:
+                        self.attrs[name] = entry[3]
+        except OSError:
+            pass
+
+    def exists(self):
+        """True if an earlier add or extraction left this journal behind."""
+        return os.path.isfile(self.path)
+
+    def done(self, name, size, crc):
+        """True if the journal lists the file with this size and CRC."""
+        return self.entries.get(name) == (size, crc)
+
+    def start(self):
+        """
+        Create the journal, and flush it and its folder to disk, before the operation changes anything; otherwise an add killed while writing its first file would leave neither a readable archive nor a journal to recover it with.
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            os.fsync(self._file.fileno())
+        sync_folders([self.path])
+
+    def save_directory(self, part):
+        """
+        Appending to an archive overwrites its central directory, so before an add appends to the archive or one of its shards, its central directory is copied next to it (see directory_path()) and the journal notes where it began. recover_archive() then takes the members that were already there from the copy, as they were. Safe to call from several threads.
+
+        Arguments:
+            part {str} -- fully qualified path to the archive or shard
+        """
+        try:
+            with MappedArchive(part) as archive:
+                with open(directory_path(part), 'wb') as copy:
+                    copy.write(archive.view[archive.cd_start:])
+                    os.fsync(copy.fileno())
+                entry = {'part': Path(part).name, 'start': archive.cd_start,
+                         'concat': archive.concat}
+        except (OSError, zipfile.BadZipFile, struct.error, ValueError):
+            # a new or unreadable part has nothing to keep
+            return
+
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.directories[entry['part']] = (entry['start'], entry['concat'])
+
+    def record(self, name, size, crc, attr=None):
+        """Add a finished file (and, for an add, its external attributes) to the journal. Safe to call from several threads."""
+        entry = [name, size, crc] if attr is None else [name, size, crc, attr]
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            self.entries[name] = (size, crc)
+            if attr is not None:
+                self.attrs[name] = attr
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """The operation is complete: the journal, and the central directories it saved, are no longer needed."""
+        self.close()
+        for part in self.directories:
+            copy = directory_path(str(Path(self.path).with_name(part)))
+            if os.path.isfile(copy):
+                os.remove(copy)
+        if self.exists():
+            os.remove(self.path)
+
+
+class HashCache:
+    """
+    CRCs of the files in a folder on disk, remembered between runs in cache_location (one file per folder), so that verifying a folder again reads only the files that changed. A CRC is used again only while its file keeps the same device, inode (on Windows, where scan_tree() gets no inodes: path), size and modification time in nanoseconds. Only the files looked up in a run are saved, so files that are gone drop out of the cache.
+    """
+
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.path = os.path.join(cache_location, 'hashes', '{}-{:08x}.json'.format(
+            Path(self.folder).name, zlib.crc32(self.folder.encode('utf-8'))))
+        try:
+            with open(self.path, 'r') as file:
+                self.known = json.load(file)
+        except (OSError, ValueError):
+            self.known = {}
+        self.seen = {}
+
+    @staticmethod
+    def key(path, st):
+        return '{}:{}'.format(st.st_dev, st.st_ino) if st.st_ino else path
+
+    def crcs(self, files):
+        """
+        The CRC of each (path, os.stat_result) in files (None for a file that can't be read). Those that aren't in the cache are computed several at a time; a ConcurrencyController finds the best number of threads for the folder's disk.
+        """
+        results, to_compute = [], []
+        for path, st in files:
+            known = self.known.get(self.key(path, st))
+            if known and known[:2] == [st.st_size, st.st_mtime_ns]:
+                results.append(known[2])
+            else:
+                results.append(None)
+                to_compute.append(len(results) - 1)
+
+        controller = ConcurrencyController(self.folder)
+        computed = controller.map(lambda i: crc_of_file(files[i][0]), to_compute,
+                                  [files[i][1].st_size for i in to_compute])
+        controller.finish()
+        for i, crc in zip(to_compute, computed):
+            results[i] = crc
+
+        for (path, st), crc in zip(files, results):
+            if crc is not None:
+                self.seen[self.key(path, st)] = [st.st_size, st.st_mtime_ns, crc]
+
+        return results
+
+    def save(self):
+        """
+        Save the CRCs looked up in this run. A cache that can't be written is no reason to fail: the files are just read again next time.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump(self.seen, file)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError:
+            pass
+
+
+class TokenBucket:
+    """
+    Limit the rate at which a job reads and writes. Every chunk takes as many tokens from the bucket as it has bytes; the bucket refills at "rate" tokens per second, up to "burst" tokens. A thread that takes more tokens than the bucket holds goes into debt and waits until the debt is paid off, so later threads wait their turn behind it. One bucket is shared by all threads of a job, so the job as a whole keeps to the rate, and a job of n bytes takes about n / rate seconds.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(buffer_size, rate // 10)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        """Take count tokens, waiting as long as it takes for them to be available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            wait = -self.tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ConcurrencyController:
+    """
+    Run a job's tasks on a number of threads that tunes itself. No fixed number of threads suits every disk: a fast SSD wants many, a spinning disk or a network drive may slow down with more than a few. While the tasks run, the controller measures throughput (bytes per second) every "window" seconds and climbs towards the best number of threads: while adding threads pays, it adds more; when throughput drops, it turns back. The best number found is remembered per storage location (in concurrency.json in cache_location), and the next job there starts from it.
+
+    If the workers setting fixes the number of threads (see apply_settings() and govern_memory()), the controller keeps to that number.
+
+    The threads belong to the controller and live until finish(), so a job that calls map() once per small batch doesn't start new threads every time.
+    """
+
+    window = 0.5
+
+    def __init__(self, storage):
+        self.storage = os.path.abspath(storage)
+        cpus = os.cpu_count() or 1
+        self.adaptive = not default_workers
+        self.most = max(16, 4 * cpus) if self.adaptive else default_workers
+        if memory_workers:
+            # the memory budget has room for only so many
+            self.most = min(self.most, memory_workers)
+
+        remembered = self._load().get(self.storage) if self.adaptive else None
+        self.workers = min(self.most, remembered or default_workers or cpus)
+
+        self.direction = 1
+        self.rates = {}
+        self.last_rate = 0
+        self.done_bytes, self.busy = 0, 0.0
+        self._window_bytes, self._window_time = 0, 0.0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _cache_path(self):
+        return os.path.join(cache_location, 'concurrency.json')
+
+    def _load(self):
+        try:
+            with open(self._cache_path(), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def map(self, fxn, items, sizes):
+        """
+        Run fxn(item) for every item and return the results in the order of "items". sizes holds the number of bytes each item reads or writes, which is what throughput is measured in. No more than the current number of threads run tasks at once. May be called several times during a job; what was learned carries over.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        if not items:
+            return results
+
+        # the pool starts threads only as they are needed, up to self.most
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.most)
+
+        def run(ndx):
+            results[ndx] = fxn(items[ndx])
+            return ndx
+
+        # the calling thread hands out tasks, then measures and adjusts
+        # until the work is done; after an error, no new tasks are started
+        pending, next_ndx, error = set(), 0, None
+        started = time.monotonic()
+        while pending or (next_ndx < len(items) and error is None):
+            while error is None and next_ndx < len(items) and len(pending) < self.workers:
+                pending.add(self._pool.submit(run, next_ndx))
+                next_ndx += 1
+
+            done, pending = wait(pending, timeout=self.window, return_when=FIRST_COMPLETED)
+            with self._lock:
+                for future in done:
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        self._window_bytes += sizes[future.result()]
+
+            now = time.monotonic()
+            self._window_time += now - started
+            started = now
+            if self._window_time >= self.window:
+                self._adjust()
+
+        if error is not None:
+            raise error
+
+        return results
+
+    def _adjust(self):
+        """
+        Compare the throughput of the window that just ended with the one before it and move the number of threads accordingly.
+        """
+        with self._lock:
+            rate = self._window_bytes / self._window_time
+            self.done_bytes += self._window_bytes
+            self.busy += self._window_time
+            self._window_bytes, self._window_time = 0, 0.0
+
+            # smooth out the noise of short windows
+            previous = self.rates.get(self.workers)
+            self.rates[self.workers] = rate if previous is None else (previous + rate) / 2
+
+            if not self.adaptive:
+                return
+
+            if rate < self.last_rate * 0.95:
+                # worse than before: turn back (or, at the knee, try fewer)
+                self.direction = -self.direction or -1
+            elif rate <= self.last_rate * 1.05 and self.direction > 0:
+                # adding threads no longer pays: this is the knee
+                self.direction = 0
+            self.last_rate = rate
+
+            step = max(1, self.workers // 2) if self.direction > 0 else max(1, self.workers // 4)
+            self.workers = min(self.most, max(1, self.workers + self.direction * step))
+
+    def best(self):
+        """The number of threads that gave the highest throughput so far."""
+        if not self.rates:
+            return self.workers
+        return max(self.rates, key=self.rates.get)
+
+    def finish(self):
+        """
+        The job is done: stop the threads, and remember the best number of threads for its storage location, if enough was learned.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+        if not self.adaptive or len(self.rates) < 2:
+            return None
+
+        remembered = self._load()
+        remembered[self.storage] = self.best()
+        try:
+            os.makedirs(cache_location, exist_ok=True)
+            with open(self._cache_path(), 'w') as file:
+                json.dump(remembered, file)
+        except OSError:
+            pass
+
+        return None
+
+
+def zip64_values(extra, file_size, compress_size, header_offset):
+    """
+    Sizes and offsets too big for the central directory are stored there as 0xFFFFFFFF, with the real values in a ZIP64 "extra" field. Get the real values.
+
+    Arguments:
+        extra {bytes} -- the "extra" field of a central directory record
+        file_size, compress_size, header_offset {int} -- values from the record
+
+    Returns:
+        file_size, compress_size, header_offset -- the real values
+    """
+    while len(extra) >= 4:
+        tag, length = struct.unpack('<HH', extra[:4])
+        if tag == 1:
+            values = list(struct.unpack('<%dQ' % (length // 8), extra[4:4 + length - length % 8]))
+            if file_size == 0xFFFFFFFF and values:
+                file_size = values.pop(0)
+            if compress_size == 0xFFFFFFFF and values:
+                compress_size = values.pop(0)
+            if header_offset == 0xFFFFFFFF and values:
+                header_offset = values.pop(0)
+            break
+        extra = extra[4 + length:]
+
+    return file_size, compress_size, header_offset
+
+
+class ArchiveFileLock:
+    """
+    An advisory lock on an archive that works across processes, so that several copies of katz (the command line, the GUI, the daemon, ...) can share an archive: any number of them can read it at once, while one that changes it has it to itself. The lock is taken on a lock file next to the archive (see lock_path()) rather than on the archive, because changing an archive replaces the file.
+
+    On Unix, readers take a shared flock() and writers an exclusive one. Windows has no shared locks, so a reader locks one byte of the lock file (there are lock_slots of them) and a writer locks them all.
+
+    Waiting for the lock gives up after lock_timeout seconds with a TimeoutError.
+    """
+
+    def __init__(self, full_filename, exclusive=False, timeout=None):
+        self.full_filename = full_filename
+        self.exclusive = exclusive
+        self.timeout = lock_timeout if timeout is None else timeout
+        self._file = None
+        self._slot = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self):
+        self._file = open(lock_path(self.full_filename), 'a+b')
+        deadline = time.monotonic() + self.timeout
+        delay = 0.01
+        while not self._try_lock():
+            if time.monotonic() >= deadline:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(Path(self.full_filename).name + ' is in use by another program; gave up after ' +
+                                   str(self.timeout) + ' seconds.')
+            time.sleep(delay)
+            delay = min(2 * delay, 0.25)
+
+    def _try_lock(self):
+        if fcntl:
+            try:
+                fcntl.flock(self._file.fileno(), (fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                return False
+        if not msvcrt:
+            return True
+
+        # a writer locks every slot; a reader, the first free one from a
+        # starting point that differs between processes and threads
+        if self.exclusive:
+            slots, count = [0], lock_slots
+        else:
+            start = (os.getpid() + threading.get_ident()) % lock_slots
+            slots, count = [(start + n) % lock_slots for n in range(lock_slots)], 1
+        for slot in slots:
+            try:
+                self._file.seek(slot)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, count)
+                self._slot = slot
+                return True
+            except OSError:
+                pass
+
+        return False
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        elif msvcrt and self._slot is not None:
+            self._file.seek(self._slot)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, lock_slots if self.exclusive else 1)
+        self._file.close()
+        self._file, self._slot = None, None
+
+
+def about():
+    """
+    Provide a very little history behing the name "katz".
+    """
+    about = '''"katz" is a command-line zip file utility named after Phil Katz, the founder of PKWARE in 1989, the company that originated the ZIP file format that is still widely used today.'''
+
+    print('\n', dsh*52, '\n', slsh*52, '\n', dsh*52, sep='')
+    print(fold(about, '', 52), '\n')
+
+    return
+
+
+def fold(txt, ndnt='     ', w=52):
+    """
+    Textwraps 'txt'; used by katzHelp() to wrap help text at column 52.
+    """
+    return textwrap.fill(txt, subsequent_indent=ndnt, width=w)
+
+
+def katzHelp():
+    """
+    Provide basic information about shell commands used in "katz".
+    """
+    msg = '/'*23 + ' HELP ' + '/'*23
+    print('\n', dsh*52, '\n', msg, '\n', dsh*52, sep='')
+    print('For help: cmd /? (example:  d /?)')
+    print('\n', 'AVAILABLE SHELL COMMANDS:', sep='')
+    for k, v in shell_cmds.items():
+        if k == 'O' or k == 'N' or k == 'M':
+            pass
+        else:
+            if k in ['QUIT', 'Q']:
+                pass
+            else:
+                if k == 'EXIT':
+                    print('EXIT, QUIT, Q')
+                else:
+                    print(k)
+
+    print('\nAll commands are case insensitive. Most can use one\nletter (e.g., "o" instead of "open")')
+    print(dsh*52, '\n', '/'*52, '\n', dsh*52, sep='')
+    print()
+
+
+def shell_help(command):
+    if command in ['EXIT', 'QUIT', 'Q']:
+        command = 'EXIT'
+    print(shell_cmds[command])
+
+
+def get_revision_number():
+    """
+    Returns the revision number, which is the number of days since the initial coding of "katz" began on November 12, 2019.
+    """
+    start_date = datetime(2019, 12, 10)
+    tday = datetime.today()
+    rd = datetime.today() - start_date
+    r_delta = rd.total_seconds() / 60 / 60
+    revision_delta = int(r_delta)
+
+    return revision_delta
+
+
+def dir(switch=''):
+    """
+    List the files and subdirectories in the current path or the path designated by "switch". "switch" may be an absolute path, a relative path. or ".."
+
+    dir can also be issued with wildcard characters, such as:
+        dir *.txt
+        dir c:\mydata\*.xl?
+
+    and sorted with "/o:n" (name), "/o:s" (size), "/o:d" (date) or "/o:e" (extension); "/o:-s" reverses the order:
+        dir *.mp4 /o:-s
+
+    Without a sort order, lines are printed as the directory is read, so even folders with 100,000s of entries start printing at once.
+
+    Arguments:
+        switch {str} -- an OS path, optionally with wildcards and a sort order (default: '')
+
+    Returns: None
+    """
+    # separate a sort order, if any, from the path
+    sort_key, reverse = None, False
+    words = switch.split(' ')
+    for word in words[:]:
+        order = re.fullmatch(r'/o:?(-?)([nsde])', word, re.IGNORECASE)
+        if order:
+            sort_key, reverse = dir_sort_keys[order.group(2).upper()], bool(order.group(1))
+            words.remove(word)
+    switch = ' '.join(words).strip()
+
+    # make sure "switch" is an absolute path, especially if
+    # user entered ".."  or a subfolder
+    file_name, full_path, full_filename = parse_full_filename(switch)
+
+    # user might use wildcards to filter dir, or name a single file
+    if '*' in switch or '?' in switch:
+        folder = full_path
+        matches = re.compile(fnmatch.translate(file_name), re.IGNORECASE).match
+    elif Path(full_filename).is_file():
+        folder = full_path
+        matches = file_name.__eq__
+    else:
+        folder, matches = full_filename, None
+    folder = os.path.normpath(folder)
+
+    print()
+    try:
+        # read_directory() is lazy; find a bad path before printing anything
+        os.scandir(folder).close()
+        entries = read_directory(folder)
+        if matches:
+            entries = (e for e in entries if matches(e[0]))
+        if sort_key:
+            entries = sorted(entries, key=sort_key, reverse=reverse)
+
+        print(' Directory of', folder, end='\n\n')
+        num_files, num_dirs, total_size, lines = 0, 0, 0, []
+        for name, is_dir, size, mtime in entries:
+            if is_dir:
+                num_dirs += 1
+            else:
+                num_files += 1
+                total_size += size
+            lines.append('{}    {:<5}  {:>10}  {}'.format(
+                datetime.fromtimestamp(mtime).strftime('%Y-%m-%d  %H:%M'),
+                '<DIR>' if is_dir else '', '' if is_dir else human_size(size), name))
+            if len(lines) == dir_print_batch:
+                print('\n'.join(lines))
+                lines = []
+        if lines:
+            print('\n'.join(lines))
+
+        if num_files + num_dirs == 0:
+            print('File Not Found')
+        else:
+            print('{:>16} File(s) {:>14}'.format(num_files, human_size(total_size)))
+            print('{:>16} Dir(s)  {:>14} free'.format(num_dirs, human_size(shutil.disk_usage(folder).free)))
+
+    # if the path in "switch" can't be found, issue an error message
+    except OSError:
+        print('The system cannot find the path specified: ', full_filename)
+    print()
+
+    return file_name, full_path, full_filename
+
+
+def read_directory(folder):
+    """
+    Generate the entries of a folder as (name, is_dir, size, mtime), reading them with os.scandir() as they are needed. Folders are read afresh every time: a file changed in place doesn't change its folder's modification time, so a cached listing could show stale sizes and dates.
+
+    Arguments:
+        folder {str} -- absolute path of the folder
+
+    Yields:
+        {tuple} -- name {str}, is_dir {bool}, size {int}, modification time {float}
+    """
+    with os.scandir(folder) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except OSError:
+                # a broken symlink
+                st = entry.stat(follow_symlinks=False)
+            is_dir = stat.S_ISDIR(st.st_mode)
+            yield entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime
+
+
+def human_size(size):
+    """
+    Format a number of bytes for people, e.g., "512 bytes", "1.5 KB" or "2.3 GB".
+
+    Arguments:
+        size {int} -- number of bytes
+
+    Returns:
+        {str} -- the size, with a unit
+    """
+    if size < 1024:
+        return str(size) + ' bytes'
+    for unit in ('KB', 'MB', 'GB', 'TB'):
+        size /= 1024
+        if size < 1024 or unit == 'TB':
+            return '{:.1f} {}'.format(size, unit)
+
+
+def cd(switch=''):
+    """
+    Run an OS cd (change directory) command using the path denoted by "switch". The path will be validated since the user may have entered a path considered invalid by the OS. The path may be an absolute path, a relative path, or '..'.
+
+    Arguments:
+        switch {str} -- an OS path (default: {''})
+
+    Returns: None
+    """
+    # if user didn't enter a valid cmd or path, there's nothing to do
+    if switch == '':
+        return None
+
+    try:
+        # cd .. --> go "up" one directory level
+        if switch == '..':
+            p = Path(os.getcwd())
+            os.chdir(p.parent)
+
+        # else a path was entered: go wherever "switch" directs;
+        else:
+            # change the directory as directed
+            try:
+                p = Path(switch).absolute()
+                os.chdir(p)
+            # if "switch" is not a real path, or contains a file name,
+            # print an error message
+            except:
+                print('The system cannot find the path specified.')
+
+    except:
+        print('The system cannot find the path specified.')
+    print()
+
+    return None
+
+
+def clear():
+    """
+    Run a cls or clear command to clear the terminal.
+
+    Arguments: none
+
+    Returns: None
+    """
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+    return None
+
+
+def parse_input(entry, full_filename):
+    """
+    Takes two arguments:
+        "full_filename" is the fully qualified path for a zip file
+
+        "entry"is whatever the user entered at the command line and the expected format is:
+
+            cmd [switch]
+
+    where:
+        "cmd" is a recognized command (listed in [translation])
+        "switch" is whatever follows cmd. "switch" is expected to be one of:
+            (1) path
+            (2) [path]/filename
+            (3) /?  -- a request for help
+
+    Invalid cmd and unrecognized switch are rejected. Once a zip file is opened, or a new zip file is created, submenu commands (zip file commands) become available.
+
+    Arguments:
+        entry {str} -- whatever the user types; must be parsed for sanity
+        full_filename {str} -- fully qualified path for a zip file
+
+    Returns:
+        cmd {str} -- a shell command, even if invalid
+        full_filename
+    """
+    # ===============================================
+    # PROCESS THE USER'S ENTRY, WHICH WILL BE EITHER:
+    #   1. CMD [/?]
+    #   2. CMD [PATH][FILE]
+    #   3. AN UNRECOGNIZABLE ENTRY
+    # ===============================================
+
+    # command only
+    if entry.find(' ') == -1:
+        cmd, switch = entry.upper(), ''
+
+    # command + space + switch
+    else:
+        space_ndx = entry.find(' ')
+        cmd, switch = entry[:space_ndx].upper(), entry[space_ndx+1:]
+        # remove quotes from switch, if present; not required by katz
+        switch = switch.replace('"', '')
+        switch = switch.replace("'", '')
+
+    # if a cmd was entered, and it's not recognized, generate error msg
+    if cmd and cmd not in translate.keys():
+        msg = cmd + ' is not recognized as a valid command.\n'
+        print(msg)
 
     # Format of some commands varies depending on OS.
     # It's easier to process only one version...
@@ -1121,6 +5015,17 @@ def parse_input(entry, full_filename):
     # PROCESS THE USER'S COMMAND
     # ===============================================
 
+    # jobs that read or write archives may have a rate limit and a
+    # lower priority; merge's switch is a list of archives, and a pattern,
+    # text or folder may look like a switch
+    if cmd in job_cmds and switch != '/?':
+        if cmd == 'MERGE':
+            start_job({})
+        elif cmd in cmd_switches:
+            start_job(split_switches(switch, cmd_switches[cmd])[1])
+        else:
+            start_job(parse_switches(switch))
+
     if switch == '/?':
         try:
             help_text = shell_cmds[translate[cmd]]
@@ -1158,23 +5063,38 @@ def parse_input(entry, full_filename):
         full_filename = openFile(switch)
 
     elif cmd == 'L' or cmd == 'LIST':
-        full_filename = listFiles(full_filename)
+        full_filename = with_lock(listFiles, full_filename, False)
 
     elif cmd == 'A' or cmd == 'ADD':
-        full_filename = addFiles(full_filename)
+        full_filename = with_lock(addFiles, full_filename, True, switch)
 
     elif cmd == 'E' or cmd == 'EXTRACT':
-        full_filename = extractFiles(full_filename)
+        full_filename = with_lock(extractFiles, full_filename, False, switch)
 
     elif cmd == 'R' or cmd == 'REMOVE':
-        full_filename = removeFiles(full_filename)
+        full_filename = with_lock(removeFiles, full_filename, True, switch)
 
     elif cmd == 'T' or cmd == 'TEST':
-        full_filename = testFiles(full_filename)
+        full_filename = with_lock(testFiles, full_filename, False)
 
     elif cmd == 'S' or cmd == 'SETUP':
         setup()
 
+    elif cmd == 'MERGE':
+        full_filename = with_lock(mergeFiles, full_filename, True, switch)
+
+    elif cmd == 'SERVE':
+        full_filename = serveFiles(full_filename, switch)
+
+    elif cmd == 'GREP':
+        full_filename = with_lock(grepFiles, full_filename, False, switch)
+
+    elif cmd == 'FIND':
+        full_filename = with_lock(findFiles, full_filename, False, switch)
+
+    elif cmd == 'VERIFY':
+        full_filename = with_lock(verifyFiles, full_filename, False, switch)
+
     elif cmd == 'B':
         about()
 
@@ -1184,6 +5104,10 @@ def parse_input(entry, full_filename):
     elif not cmd:
         pass
 
+    # with a memory budget, confirm that jobs stayed within it
+    if max_memory and cmd in job_cmds:
+        report_memory()
+
     print()
 
     return cmd, full_filename
@@ -1194,7 +5118,7 @@ def showMenu():
     Display a formatted menu of available commands. Shown, by default, at startup of the program. Available on demand by typing: m or menu
     """
     print(
-        '\n<O>pen file   <N>ew file   <L>ist  <A>dd\n<E>xtract     <R>emove     <T>est\n<M>enu        <H>elp       a<B>out\n\n<DIR [path]>  <CD [path]>  <CLS>')
+        '\n<O>pen file   <N>ew file   <L>ist  <A>dd\n<E>xtract     <R>emove     <T>est\n<M>enu        <H>elp       a<B>out\n\n<DIR [path]>  <CD [path]>  <CLS>\n<MERGE>       <SERVE>      <GREP>\n<FIND>        <VERIFY>')
     print('')
     return None
 
@@ -1209,6 +5133,8 @@ def main_menu():
     """
     full_filename = ''
 
+    # settings (and the profile, if one is chosen) apply from the start
+    select_profile(sys.argv)
     get_start_dir()
 
     # ===============================================
@@ -1248,34 +5174,229 @@ def main_menu():
     save_last_location()
 
 
-def save_last_location():
-
-    # find the installation path for katz.py; use same location for katz.config
+def config_file_path():
+    """
+    katz.config sits in the installation folder, next to katz.py.
+    """
     install_path = Path(os.path.realpath(__file__)).parent
-    config_file_path = Path(install_path, 'katz.config')
+    return Path(install_path, 'katz.config')
+
+
+def read_config(reload=False):
+    """
+    Get the settings in katz.config as a dict. The file is parsed only once; later calls get the cached dict (until write_config() changes the file, or reload is True).
 
-    # get all non-empty lines in katz.config into a dict
-    with open(str(config_file_path), 'r') as file:
-        all_lines = file.readlines()
+    Lines have the form "setting=value". A profile is a set of settings whose names begin with the profile's name, e.g., "laptop.workers=2" and "server.workers=32"; see get_setting().
+
+    Arguments:
+        reload {bool} -- parse katz.config again, even if it was parsed before
+
+    Returns:
+        config_dict {dict} -- {setting: value}
+    """
+    global config_cache
+
+    if config_cache is not None and not reload:
+        return config_cache
+
+    # try:except in case there is no katz.config file
+    try:
+        with open(str(config_file_path()), 'r') as file:
+            all_lines = file.readlines()
+    except OSError:
+        all_lines = []
 
-    all_lines = [line.strip('\n') for line in all_lines if line.strip('\n')]
-    config_dict = {}
+    # skip junk entries, i.e., lines without "="
+    config_cache = {}
     for line in all_lines:
-        this_line = line.split('=')
-        # try:except required for skipping junk entries
-        try:
-            if this_line:
-                config_dict.update({this_line[0]: this_line[1]})
-        except:
-            pass
+        user_var, equals, user_value = line.strip('\n').partition('=')
+        if equals and user_var.strip():
+            config_cache[user_var.strip()] = user_value.strip()
+
+    return config_cache
+
 
-    # write back all lines, except changing last_location to cwd()
-    with open(str(config_file_path), 'w') as file:
+def write_config(config_dict):
+    """
+    Write all settings to katz.config, and make them the cached settings.
+
+    Arguments:
+        config_dict {dict} -- {setting: value}
+
+    Returns: None
+    """
+    global config_cache
+
+    with open(str(config_file_path()), 'w') as file:
         for user_var, user_value in config_dict.items():
-            if user_var == 'last_location':
-                user_value = os.getcwd()
-            line = user_var + '=' + user_value + '\n'
-            file.write(line)
+            file.write(user_var + '=' + str(user_value) + '\n')
+
+    config_cache = {user_var: str(user_value) for user_var, user_value in config_dict.items()}
+
+    return None
+
+
+def get_setting(name, default=''):
+    """
+    Get one setting. A setting of the active profile (e.g., "server.workers" when the profile is "server") takes precedence over the plain setting ("workers").
+
+    Arguments:
+        name {str} -- name of the setting, e.g., "durability"
+        default {str} -- value if katz.config does not have the setting
+
+    Returns:
+        value {str} -- the setting's value
+    """
+    config_dict = read_config()
+    if active_profile and active_profile + '.' + name in config_dict:
+        return config_dict[active_profile + '.' + name]
+
+    return config_dict.get(name, default)
+
+
+def parse_size(text):
+    """
+    Convert a size such as "512K", "64M", "2G" or "1048576" into bytes.
+
+    Arguments:
+        text {str} -- the size; K, M and G (optionally followed by B) mean KB, MB and GB
+
+    Returns:
+        size {int} -- number of bytes
+    """
+    text = text.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    multiplier = 1
+    if text and text[-1] in 'KMG':
+        multiplier = 1024 ** ('KMG'.index(text[-1]) + 1)
+        text = text[:-1]
+
+    return int(float(text) * multiplier)
+
+
+def select_profile(argv):
+    """
+    Choose the profile to use: "--profile name" on the command line, or else the "profile" setting in katz.config. Then apply the settings.
+
+    Arguments:
+        argv {list} -- the command line, e.g., sys.argv
+
+    Returns:
+        active_profile {str} -- name of the profile, or '' for none
+    """
+    global active_profile
+
+    active_profile = read_config().get('profile', '')
+    for ndx, arg in enumerate(argv):
+        if arg == '--profile' and ndx + 1 < len(argv):
+            active_profile = argv[ndx + 1]
+        elif arg.startswith('--profile='):
+            active_profile = arg[len('--profile='):]
+
+    apply_settings()
+
+    return active_profile
+
+
+def apply_settings():
+    """
+    Put the performance settings from katz.config (see read_config() and get_setting()) into effect. A setting that is missing or invalid keeps its default, with a message for the invalid ones:
+        -- workers: number of threads a job may use (0 = one per CPU)
+        -- buffer_size: size of the chunks that are read, written and decompressed, e.g., 1M
+        -- compression_level: 0 (none) to 9 (smallest) for deflate and bzip2
+        -- compression_method: auto, deflate, store, bzip2 or lzma
+        -- durability: none, batch or file (see durability_modes)
+        -- max_memory: the most memory a job may use, e.g., 512M (0 = no limit); see govern_memory()
+        -- cache_location: folder where katz keeps its caches
+        -- io_rate: the most a job may read and write per second, e.g., 20M (see start_job())
+        -- low_priority: True to run jobs at low CPU and disk priority
+        -- lock_timeout: seconds to wait for an archive that another program is using (see ArchiveFileLock)
+
+    Arguments: none
+
+    Returns: None
+    """
+    global default_workers, buffer_size, compression_level, compression_method
+    global max_memory, cache_location, lock_timeout, pipeline_depth, small_batch_size
+    global setting_defaults
+
+    # start from the defaults every time: a setting taken out of katz.config
+    # goes back to its default, and govern_memory() doesn't shrink buffers
+    # and workers it has already shrunk
+    if setting_defaults is None:
+        setting_defaults = (default_workers, buffer_size, compression_level, compression_method,
+                            max_memory, cache_location, lock_timeout, pipeline_depth,
+                            small_batch_size)
+    (default_workers, buffer_size, compression_level, compression_method, max_memory,
+     cache_location, lock_timeout, pipeline_depth, small_batch_size) = setting_defaults
+
+    def setting(name, convert):
+        value = get_setting(name)
+        if not value:
+            return None
+        try:
+            return convert(value)
+        except ValueError:
+            print('Invalid setting ', name, '=', value, '; using the default.', sep='')
+            return None
+
+    def method(value):
+        if value.lower() not in compression_methods:
+            raise ValueError(value)
+        return value.lower()
+
+    def level(value):
+        if not 0 <= int(value) <= 9:
+            raise ValueError(value)
+        return int(value)
+
+    def durability(value):
+        if value.lower() not in durability_modes:
+            raise ValueError(value)
+        return value.lower()
+
+    value = setting('workers', int)
+    if value is not None and value >= 0:
+        default_workers = value
+    value = setting('buffer_size', parse_size)
+    if value:
+        buffer_size = max(64 * 1024, value)
+    value = setting('compression_level', level)
+    if value is not None:
+        compression_level = value
+    value = setting('compression_method', method)
+    if value:
+        compression_method = value
+    setting('durability', durability)
+    value = setting('max_memory', parse_size)
+    if value is not None:
+        max_memory = max(0, value)
+    value = setting('cache_location', str)
+    if value:
+        cache_location = value
+    value = setting('lock_timeout', float)
+    if value is not None and value >= 0:
+        lock_timeout = value
+
+    # with a memory budget, buffers, queues and workers must fit in it
+    govern_memory()
+
+    return None
+
+
+def save_last_location():
+
+    # write back all settings, except changing last_location to cwd()
+    # katz.config may have been edited by hand since katz started; without
+    # a katz.config, or with last_location already right, leave it alone
+    if not config_file_path().is_file():
+        return
+    config_dict = dict(read_config(reload=True))
+    if config_dict.get('last_location', os.getcwd()) == os.getcwd():
+        return
+    config_dict['last_location'] = os.getcwd()
+    write_config(config_dict)
 
 
 def setup():
@@ -1283,6 +5404,8 @@ def setup():
     Configuration settings include:
             -- the installation directory (not configurable)
             -- user's choice of a startup directory
+            -- performance settings (see apply_settings()), optionally as part of a profile, e.g., "server.workers=32"
+            -- the profile to use when katz starts, e.g., "profile=server"
 
     It is valid to edit this file manually.
     """
@@ -1291,40 +5414,14 @@ def setup():
 
     # find the installation path for katz.py; use same location for katz.config
     install_path = Path(os.path.realpath(__file__)).parent
-    config_file_path = Path(install_path, 'katz.config')
-
-    # ============================================
-    # MAKE SURE KATZ.CONFIG EXISTS AND THAT IT IS
-    # POPULATED, AT LEAST, WITH STANDARD CONTENTS
-    # ============================================
-
-    # use open() to test if katz.config exists and is readable
-    # if it does not exist, create it
-    try:
-        with open(str(config_file_path), 'r') as file:
-            pass
-    except:
-        with open(str(config_file_path), 'w') as file:
-            pass
 
     # ===============================================
     # PUT THE CONTENTS OF KATZ.CONFIG INTO A DICT
     # ===============================================
 
-    # get all non-empty lines in katz.config into a dict
-    with open(str(config_file_path), 'r') as file:
-        all_lines = file.readlines()
-
-    all_lines = [line.strip('\n') for line in all_lines if line.strip('\n')]
-    config_dict = {}
-    for line in all_lines:
-        this_line = line.split('=')
-        # try:except required for skipping junk entries
-        try:
-            if this_line:
-                config_dict.update({this_line[0]: this_line[1]})
-        except:
-            pass
+    # read_config() copes with a missing katz.config; write_config(),
+    # below, creates it
+    config_dict = dict(read_config())
 
     for k, v in config_dict.items():
         print(k, '=', v, sep='')
@@ -1342,13 +5439,14 @@ def setup():
     if not 'last_location' in config_dict.keys():
         config_dict.update({'last_location': ''})
     if not 'use_last_location' in config_dict.keys():
-        config_dict.update({'use_last_location': False})
+        config_dict.update({'use_last_location': 'False'})
 
     # ============================================
     # PRINT THE CONTENTS OF CONFIG_DICT ON SCREEN
     # ============================================
 
     # this while: loop works only with config_dict, not katz.config
+    changed = False
     while True:
         # clear the screen, for readability
         clear()
@@ -1414,6 +5512,7 @@ def setup():
         # for either of the two essential user_var
         # Otherwise, delete the variable
         print()
+        changed = True
         if user_var in ['startup_directory', 'last_location', 'use_last_location']:
             # user can set use_last_location empty; this is replaced with False
             if user_var == 'use_last_location' and user_value.upper() not in ['TRUE', 'FALSE']:
@@ -1426,11 +5525,11 @@ def setup():
 
     os.chdir(cwd)
 
-    # before quitting, write config_list to katz.config
-    with open(str(config_file_path), 'w') as file:
-        for user_var, user_value in config_dict.items():
-            line = user_var + '=' + user_value + '\n'
-            file.write(line)
+    # before quitting, write config_dict to katz.config (unless there was
+    # none and nothing changed) and put the performance settings into effect
+    if changed or config_file_path().is_file():
+        write_config(config_dict)
+    select_profile(sys.argv)
 
     return
 
@@ -1442,43 +5541,12 @@ def get_start_dir():
     Returns:
         [str] -- starting path, obtained from katz.config
     """
-   # find the installation path for katz.config
-    install_path = Path(os.path.realpath(__file__)).parent
-    config_file_path = Path(install_path, 'katz.config')
-
-    # try:except in case there is no katz.config file
-    try:
-        # get all non-empty lines in katz.config into a dict
-        with open(str(config_file_path), 'r') as file:
-            all_lines = file.readlines()
-    except:
-        all_lines = []
-
-    all_lines = [line.strip('\n') for line in all_lines if line.strip('\n')]
-    config_dict = {}
-    for line in all_lines:
-        this_line = line.split('=')
-        # try:except required for skipping junk entries
-        try:
-            if this_line:
-                config_dict.update({this_line[0]: this_line[1]})
-        except:
-            pass
+    config_dict = read_config()
 
     # get the paths in startup_directory and last_location
-    try:
-        startup_directory = config_dict['startup_directory']
-    except:
-        startup_directory = ''
-    try:
-        last_location = config_dict['last_location']
-    except:
-        last_location = ''
-
-    try:
-        use_last_location = config_dict['use_last_location']
-    except:
-        use_last_location = False
+    startup_directory = config_dict.get('startup_directory', '')
+    last_location = config_dict.get('last_location', '')
+    use_last_location = config_dict.get('use_last_location', 'False')
 
     if use_last_location.upper() == 'TRUE':
         if last_location:
@@ -1494,4 +5562,11 @@ if __name__ == '__main__':
     # ===== For developer use =====
     # print(get_revision_number())
 
-    main_menu()
+    # "--daemon [--socket path]" runs katz as a daemon (see katz_daemon.py)
+    if '--daemon' in sys.argv:
+        from katz_daemon import run_daemon
+        select_profile(sys.argv)
+        socket_path = sys.argv[sys.argv.index('--socket') + 1] if '--socket' in sys.argv[:-1] else None
+        run_daemon(socket_path)
+    else:
+        main_menu()
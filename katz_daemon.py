@@ -0,0 +1,385 @@
+"""
+katz_daemon.py
+
+the katz daemon: keeps archives open between requests, which scripts send
+over a Unix socket (see run_daemon() and daemon_request()); ArchiveSession
+and ReadWriteLock are shared with katz_http.py and katz_async.py
+"""
+
+import contextlib
+import glob
+import json
+import os
+import socket
+import socketserver
+import threading
+import zipfile
+from pathlib import Path
+
+import katz_commandLine as katz
+
+# the daemon (see run_daemon()) listens on a Unix socket with this name in
+# cache_location, unless it is given another path, and answers these
+# requests (see Daemon)
+daemon_socket = 'katz.sock'
+daemon_ops = ('ping', 'list', 'add', 'extract', 'remove', 'test', 'verify')
+
+
+class ReadWriteLock:
+    """
+    A lock that many readers can hold at once, or one writer alone. A writer that is waiting holds back new readers, so a steady stream of readers cannot keep it waiting for ever.
+
+    Given an archive, the lock also holds the archive's ArchiveFileLock, so that other processes respect it too: shared while there are readers, exclusive while there is a writer. Acquiring it may then raise a TimeoutError.
+    """
+
+    def __init__(self, full_filename=None):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        # the first reader is still taking the archive's shared lock
+        self._reader_locking = False
+        self.full_filename = full_filename
+        self._file_lock = None
+
+    def _lock_file(self, exclusive):
+        """
+        Take the archive's ArchiveFileLock. This may wait for another process, so it is called without holding the condition: the state that makes the other threads wait is set before, and the lock is stored after.
+        """
+        if not self.full_filename:
+            return None
+        file_lock = katz.ArchiveFileLock(self.full_filename, exclusive)
+        file_lock.acquire()
+        return file_lock
+
+    def _unlock_file(self):
+        if self._file_lock:
+            self._file_lock.release()
+            self._file_lock = None
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting or self._reader_locking:
+                self._condition.wait()
+            self._readers += 1
+            # the first reader locks the archive for all of them; the
+            # others wait until it has
+            first = self._readers == 1
+            self._reader_locking = first
+
+        if first:
+            try:
+                file_lock = self._lock_file(exclusive=False)
+            except:
+                with self._condition:
+                    self._readers -= 1
+                    self._reader_locking = False
+                    self._condition.notify_all()
+                raise
+            with self._condition:
+                self._file_lock = file_lock
+                self._reader_locking = False
+                self._condition.notify_all()
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._unlock_file()
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            # the lock is this writer's while it locks the archive
+            self._writer = True
+
+        try:
+            file_lock = self._lock_file(exclusive=True)
+        except:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+            raise
+        with self._condition:
+            self._file_lock = file_lock
+
+    def release_write(self):
+        with self._condition:
+            self._unlock_file()
+            self._writer = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class ArchiveSession:
+    """
+    An archive that the daemon keeps open between requests. Its ArchiveIndex stays in memory for as long as the archive, its shards and its manifest keep the same size and modification time, so most requests don't read the central directory at all. Requests that only read the archive share its lock; requests that change it have it to themselves. The lock covers other processes, too (see ReadWriteLock).
+    """
+
+    def __init__(self, full_filename):
+        self.full_filename = full_filename
+        self.lock = ReadWriteLock(full_filename)
+        self._mutex = threading.Lock()
+        self._index = None
+        self._key = None
+
+    def key(self):
+        return katz.archive_key(self.full_filename)
+
+    def index(self):
+        """The archive's ArchiveIndex, read again only if the archive changed on disk."""
+        with self._mutex:
+            key = self.key()
+            if key != self._key:
+                # requests still using the old index keep it open; its
+                # archives are closed once the last of them is done with it
+                self._index, self._key = katz.ArchiveIndex(self.full_filename), key
+
+            return self._index
+
+    def invalidate(self):
+        """Close the index. Only called with the write lock held, so nothing else is using it."""
+        with self._mutex:
+            if self._index is not None:
+                self._index.close()
+            self._index, self._key = None, None
+
+
+class Daemon:
+    """
+    The requests that run_daemon() answers. A request is a JSON object with an "op" (see daemon_ops) and, except for "ping", the path of an "archive":
+        -- {"op": "list", "archive": ...}: the archive's files, in the order <L>ist numbers them, with their sizes and CRCs
+        -- {"op": "extract", "archive": ..., "files": [...], "folder": ..., "policy": ..., "durability": ...}: extract files (default: all) or folders to "folder" (default: a folder named after the archive, next to it); "policy" says what to do with files that already exist (see ExtractionPlan.resolve(); default: skip)
+        -- {"op": "add", "archive": ..., "folder": ..., "files": [...], "shards": n}: add files from "folder", as if <A>dd were run there; "files" are names or wildcards relative to "folder" (default: all files)
+        -- {"op": "remove", "archive": ..., "files": [...], "durability": ...}: remove files or folders
+        -- {"op": "test", "archive": ...}: test every file
+        -- {"op": "verify", "archive": ..., "folder": ..., "crc": true}: compare a folder on disk with the archive (see verify_tree()); "crc" compares contents rather than modification times
+
+    Every reply is a JSON object with "ok" (true or false) and, if "ok" is false, an "error".
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self._mutex = threading.Lock()
+
+    def session(self, archive):
+        """The ArchiveSession of an archive, started on the first request for it."""
+        file_name, full_path, full_filename = katz.parse_full_filename(archive)
+        with self._mutex:
+            if full_filename not in self.sessions:
+                self.sessions[full_filename] = ArchiveSession(full_filename)
+
+            return self.sessions[full_filename]
+
+    def close(self):
+        for session in self.sessions.values():
+            session.invalidate()
+
+    def dispatch(self, request):
+        """Answer one request; requests for the same archive are run under its ReadWriteLock."""
+        op = request.get('op')
+        if op not in daemon_ops:
+            raise ValueError('Unknown op: ' + str(op))
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid(), 'archives': len(self.sessions)}
+        if not request.get('archive'):
+            raise ValueError('No archive given.')
+
+        session = self.session(request['archive'])
+        lock = session.lock.writing() if op in ('add', 'remove') else session.lock.reading()
+        with lock:
+            return getattr(self, op + '_files')(session, request)
+
+    def list_files(self, session, request):
+        return {'ok': True, 'files': katz.list_members(session.index())}
+
+    def extract_files(self, session, request):
+        index = session.index()
+        selected_files = katz.select_members(index, request.get('files'))
+        policy = request.get('policy', 'skip')
+        if policy not in ('skip', 'overwrite', 'newer', 'crc', 'rename'):
+            raise ValueError('Unknown policy: ' + str(policy))
+
+        extract_location = request.get('folder') or session.full_filename[:-4]
+        plan = katz.ExtractionPlan(index, selected_files, extract_location)
+        num_skipped = plan.resolve(policy) if plan.conflicts else 0
+        free_space = plan.free_space()
+        if free_space < plan.total_size:
+            raise OSError('Not enough disk space: ' + str(plan.total_size) +
+                          ' bytes needed, ' + str(free_space) + ' bytes free.')
+
+        plan.make_dirs()
+        plan.run(durability=katz.durability_mode(request), verbose=False)
+
+        return {'ok': True, 'extracted': len(selected_files) - num_skipped, 'skipped': num_skipped}
+
+    def add_files(self, session, request):
+        if not request.get('folder') or not os.path.isdir(request['folder']):
+            raise ValueError('No folder to add files from.')
+        folder = os.path.abspath(request['folder'])
+
+        scanned = katz.scan_tree(folder)
+        if request.get('files') is None:
+            selected_files = [file for file, arcname, st in scanned]
+        else:
+            selected_files = []
+            for pattern in request['files']:
+                found = glob.glob(os.path.join(glob.escape(folder), pattern), recursive=True)
+                if not found:
+                    raise ValueError('No files match: ' + pattern)
+                selected_files.extend(file for file in sorted(found) if os.path.isfile(file))
+
+        # a new archive is created, as <N>ew would
+        if not os.path.exists(session.full_filename):
+            zipfile.ZipFile(session.full_filename, 'w').close()
+
+        session.invalidate()
+        num_added = katz.add_to_archive(session.full_filename, selected_files, folder, scanned,
+                                        int(request.get('shards', 0)))
+
+        return {'ok': True, 'added': num_added}
+
+    def remove_files(self, session, request):
+        if request.get('files') is None:
+            raise ValueError('No files to remove.')
+        index = session.index()
+        selected_files = katz.select_members(index, request.get('files'))
+
+        # the temporary archive is next to the archive, on the same disk
+        temp_zip_file = session.full_filename[:-4] + '._temp_zipfile_.zip'
+        try:
+            failed = katz.remove_members(index, selected_files, temp_zip_file, katz.durability_mode(request))
+        finally:
+            session.invalidate()
+            if os.path.isfile(temp_zip_file):
+                os.remove(temp_zip_file)
+
+        if failed:
+            return {'ok': False, 'error': 'Could not remove files from ' + ', '.join(failed)}
+        return {'ok': True, 'removed': len(selected_files)}
+
+    def test_files(self, session, request):
+        index = session.index()
+        num_files, bad_file = katz.test_archive(session.full_filename, index.archives)
+
+        if bad_file:
+            return {'ok': False, 'error': 'Bad file found: ' + bad_file, 'tested': num_files}
+        return {'ok': True, 'tested': num_files}
+
+    def verify_files(self, session, request):
+        if not request.get('folder') or not os.path.isdir(request['folder']):
+            raise ValueError('No folder to verify.')
+        report = katz.verify_tree(session.index(), request['folder'], bool(request.get('crc')))
+
+        return dict(report, ok=True)
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    One client connection to the daemon. Each line the client sends is a request; each gets a reply of one line. A client may keep its connection open for as many requests as it likes.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('A request must be a JSON object.')
+                reply = self.server.katz.dispatch(request)
+            except Exception as error:
+                reply = {'ok': False, 'error': str(error) or type(error).__name__}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+def run_daemon(path=None):
+    """
+    Run katz as a daemon: a server that keeps archives open between requests, so scripts don't pay for starting python and reading the archive on every call. It answers list, add, extract, remove and test requests (see Daemon) on a Unix socket, several requests at a time; requests for the same archive share it if they only read it, and wait for each other if they change it. Stop it with Ctrl+C.
+
+    Arguments:
+        path {str} -- path of the socket (default: daemon_socket in cache_location)
+
+    Returns: None
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        print('The katz daemon needs Unix domain sockets, which this system does not support.')
+        return None
+
+    path = path or str(Path(katz.cache_location, daemon_socket))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    # a socket may be left behind by a daemon that didn't stop cleanly
+    if os.path.exists(path):
+        try:
+            daemon_request({'op': 'ping'}, path)
+            print('A katz daemon is already running on', path)
+            return None
+        except OSError:
+            os.remove(path)
+
+    # rate limit and priority come from the settings, for all requests
+    katz.start_job()
+
+    # only the user who started the daemon may talk to it
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, DaemonHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.katz = Daemon()
+
+    print('katz daemon listening on', path, '(Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.katz.close()
+        os.remove(path)
+
+    return None
+
+
+def daemon_request(request, path=None):
+    """
+    Send one request to a running katz daemon (see Daemon) and wait for its reply. The "archive" and "folder" of the request are made absolute first, since the daemon's current directory is not the caller's.
+
+    Arguments:
+        request {dict} -- the request, e.g., {"op": "list", "archive": "data.zip"}
+        path {str} -- path of the daemon's socket (default: daemon_socket in cache_location)
+
+    Returns:
+        reply {dict} -- the daemon's reply
+    """
+    request = dict(request)
+    for key in ('archive', 'folder'):
+        if request.get(key):
+            request[key] = os.path.abspath(request[key])
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path or str(Path(katz.cache_location, daemon_socket)))
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+
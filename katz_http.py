@@ -0,0 +1,167 @@
+"""
+katz_http.py
+
+the HTTP server behind "serve": shares an archive's files, read-only, each
+at its own URL (see MemberRequestHandler); serveFiles() in
+katz_commandLine.py starts it
+"""
+
+import http.server
+import json
+import mimetypes
+import re
+import urllib.parse
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+
+import katz_commandLine as katz
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """
+    An HTTPServer that answers requests on a fixed pool of threads, rather than starting a thread for each connection.
+    """
+
+    def __init__(self, address, handler, workers):
+        # a server that can't bind closes itself before __init__ returns
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        super().__init__(address, handler)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class MemberRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers GET and HEAD requests for the files of the archive that the server shares (server.session, an ArchiveSession):
+        -- "/" lists the archive's files as JSON (see list_members())
+        -- "/folder/file.txt" sends that file
+
+    A file's ETag is its CRC and size, so clients can cache it ("If-None-Match"). A "Range" of bytes is sent straight from the memory map for stored files; compressed files are decompressed as they are sent, up to the end of the range.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # idle connections give their thread back to the pool after this many seconds
+    timeout = 30
+
+    def log_request(self, code='-', size='-'):
+        # errors are still printed (see log_error()), but not every request
+        pass
+
+    def do_GET(self):
+        self.send_member(head=False)
+
+    def do_HEAD(self):
+        self.send_member(head=True)
+
+    def send_member(self, head):
+        name = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip('/')
+        session = self.server.session
+        try:
+            with session.lock.reading():
+                index = session.index()
+                if not name:
+                    body = json.dumps(katz.list_members(index)).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    if not head:
+                        self.wfile.write(body)
+                    return
+
+                found = index.find(name)
+                if found is None or name.endswith('/'):
+                    self.send_error(404, 'Not in the archive')
+                    return
+                f = index.archives[found[0]]
+                self.send_data(f, f.members[found[1]], head)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except (zipfile.BadZipFile, zlib.error, EOFError) as error:
+            # the headers are gone already; all we can do is hang up
+            self.log_error('%s: %s', name, error)
+            self.close_connection = True
+
+    def send_data(self, f, member, head):
+        """Send a member, or the range of it that the client asked for."""
+        etag = '"{:08x}-{}"'.format(member.CRC, member.file_size)
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        size = member.file_size
+        byte_range = self.byte_range(size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */' + str(size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = byte_range or (0, size)
+
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', mimetypes.guess_type(member.filename)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(katz.member_timestamp(member), usegmt=True))
+        if byte_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, size))
+        self.end_headers()
+        if head or start == end:
+            return
+
+        # stored members go straight from the memory map to the socket
+        if member.compress_type == zipfile.ZIP_STORED and not member.flag_bits & 0x1:
+            pos, end = f.data_offset(member) + start, f.data_offset(member) + end
+            while pos < end:
+                count = min(katz.buffer_size, end - pos)
+                katz.throttle(count)
+                self.wfile.write(f.view[pos:pos + count])
+                pos += count
+            return
+
+        # others are decompressed from the start; bytes before the range
+        # are dropped
+        pos = 0
+        for chunk in f.read_chunks(member):
+            if pos + len(chunk) > start:
+                self.wfile.write(chunk[max(start - pos, 0):end - pos])
+            pos += len(chunk)
+            if pos >= end:
+                break
+
+    def byte_range(self, size):
+        """
+        The (start, end) of the one byte range in the "Range" header, with end exclusive; None if there is no (usable) range, or False if the range lies outside the file.
+        """
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        if not match or not any(match.groups()):
+            return None
+        first, last = match.groups()
+        if not first:
+            # the last "last" bytes
+            start, end = max(size - int(last), 0), size
+        else:
+            start, end = int(first), min(int(last) + 1, size) if last else size
+        if start >= size or start >= end:
+            return False
+
+        return start, end
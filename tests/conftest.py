@@ -0,0 +1,49 @@
+import os
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import katz_commandLine as katz
+
+
+@pytest.fixture
+def kz(tmp_path, monkeypatch):
+    """katz_commandLine with its caches in tmp_path and no katz.config."""
+    monkeypatch.setattr(katz, 'cache_location', str(tmp_path / 'cache'))
+    monkeypatch.setattr(katz, 'config_cache', {})
+    monkeypatch.setattr(katz, 'name_index_cache', None)
+    monkeypatch.chdir(tmp_path)
+    return katz
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """A small folder of files to archive: {name in archive: contents}."""
+    files = {
+        'proj/readme.txt': b'read me\n' * 10,
+        'proj/big.log': os.urandom(300 * 1024),
+        'proj/pic.jpg': os.urandom(5000),
+        'proj/src/main.py': b'print("hello")\n',
+        'proj/src/util.py': b'def util():\n    return 1\n' * 50,
+        'proj/src/sub/bin.dat': bytes(range(256)) * 40,
+        'proj/docs/notes.md': b'# notes\n',
+    }
+    for name, data in files.items():
+        path = tmp_path / 'disk' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return tmp_path / 'disk' / 'proj', files
+
+
+def new_archive(path):
+    zipfile.ZipFile(str(path), 'w').close()
+    return str(path)
+
+
+def add_tree(kz, archive, folder, num_shards=0):
+    scanned = kz.scan_tree(str(folder))
+    return kz.add_to_archive(archive, [file for file, arcname, st in scanned], str(folder),
+                             scanned, num_shards)
@@ -0,0 +1,24 @@
+import asyncio
+
+from katz_async import AsyncArchive
+from conftest import new_archive
+
+
+def test_async_add_list_read_extract(kz, tmp_path, tree):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'async.zip')
+
+    async def run():
+        async with await AsyncArchive.open(archive) as f:
+            assert await f.add(str(folder)) == len(files)
+            assert sorted(member['name'] for member in await f.list()) == sorted(files)
+            assert await f.read('proj/big.log') == files['proj/big.log']
+            extracted = await f.extract(['proj/src'], str(tmp_path / 'out'))
+            return extracted
+
+    # a folder selects the files in it, as in <E>xtract, not its subfolders
+    extracted = asyncio.run(run())
+    assert len(extracted) == 2
+    for name in ('proj/src/main.py', 'proj/src/util.py'):
+        assert (tmp_path / 'out' / name).read_bytes() == files[name]
+    assert not (tmp_path / 'out' / 'proj/src/sub/bin.dat').exists()
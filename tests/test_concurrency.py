@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pytest
+
+
+def test_map_keeps_order_and_thread_count(kz, tmp_path):
+    controller = kz.ConcurrencyController(str(tmp_path))
+    controller.workers = 3
+    running, most = [0], [0]
+    lock = threading.Lock()
+
+    def task(n):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.001)
+        with lock:
+            running[0] -= 1
+        return n * n
+
+    threads_before = threading.active_count()
+    for batch in range(20):
+        items = list(range(batch * 10, batch * 10 + 10))
+        assert controller.map(task, items, [1] * len(items)) == [n * n for n in items]
+
+    # batches share the controller's threads, and no more than "workers" run at once
+    assert most[0] <= 3
+    assert threading.active_count() - threads_before <= 3
+    controller.finish()
+
+
+def test_map_raises_the_first_error(kz, tmp_path):
+    controller = kz.ConcurrencyController(str(tmp_path))
+
+    def task(n):
+        if n == 5:
+            raise ValueError('bad item')
+        return n
+
+    with pytest.raises(ValueError):
+        controller.map(task, range(20), [1] * 20)
+    controller.finish()
@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.fixture
+def config(kz, tmp_path, monkeypatch):
+    """katz.config in tmp_path (not there yet), with the settings restored afterwards."""
+    path = tmp_path / 'katz.config'
+    monkeypatch.setattr(kz, 'config_file_path', lambda: path)
+    for name in ('default_workers', 'buffer_size', 'compression_level', 'compression_method',
+                 'max_memory', 'lock_timeout', 'pipeline_depth', 'small_batch_size',
+                 'setting_defaults', 'memory_available', 'memory_workers'):
+        monkeypatch.setattr(kz, name, getattr(kz, name))
+    return path
+
+
+def test_exit_without_config_writes_nothing(kz, config):
+    kz.save_last_location()
+    assert not config.exists()
+
+
+def test_exit_updates_last_location(kz, config, tmp_path):
+    config.write_text('use_last_location=True\nlast_location=/nowhere\nworkers=3\n')
+    kz.save_last_location()
+    assert config.read_text() == 'use_last_location=True\nlast_location={}\nworkers=3\n'.format(tmp_path)
+
+
+def test_removed_setting_goes_back_to_default(kz, config):
+    default = kz.buffer_size
+    kz.write_config({'buffer_size': '256K', 'workers': '3'})
+    kz.apply_settings()
+    assert (kz.buffer_size, kz.default_workers) == (256 * 1024, 3)
+
+    kz.write_config({})
+    kz.apply_settings()
+    assert (kz.buffer_size, kz.default_workers) == (default, 0)
+
+
+def test_memory_budget_is_not_applied_twice(kz, config, monkeypatch):
+    monkeypatch.setattr(kz, 'current_rss', lambda: 16 * 1024 * 1024)
+    kz.write_config({'max_memory': '64M', 'workers': '8'})
+    kz.apply_settings()
+    first = (kz.buffer_size, kz.default_workers, kz.pipeline_depth, kz.small_batch_size)
+
+    kz.apply_settings()
+    assert (kz.buffer_size, kz.default_workers, kz.pipeline_depth, kz.small_batch_size) == first
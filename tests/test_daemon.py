@@ -0,0 +1,82 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import katz_daemon
+from conftest import add_tree, new_archive
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'setsid') or sys.platform == 'win32',
+                                reason='the daemon needs Unix domain sockets')
+
+
+@pytest.fixture
+def daemon(kz, tmp_path):
+    """katz_commandLine.py --daemon, run as a script, as users start it."""
+    path = str(tmp_path / 'katz.sock')
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'katz_commandLine.py')
+    process = subprocess.Popen([sys.executable, script, '--daemon', '--socket', path],
+                               stdout=subprocess.DEVNULL, cwd=str(tmp_path))
+    for _ in range(200):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    process.send_signal(signal.SIGINT)
+    process.wait(10)
+
+
+def test_daemon_answers_requests(kz, tmp_path, tree, daemon):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'daemon.zip')
+
+    assert katz_daemon.daemon_request({'op': 'ping'}, daemon)['ok']
+
+    reply = katz_daemon.daemon_request({'op': 'add', 'archive': archive, 'folder': str(folder)}, daemon)
+    assert reply == {'ok': True, 'added': len(files)}
+
+    reply = katz_daemon.daemon_request({'op': 'list', 'archive': archive}, daemon)
+    assert sorted(member['name'] for member in reply['files']) == sorted(files)
+
+    reply = katz_daemon.daemon_request({'op': 'test', 'archive': archive}, daemon)
+    assert reply == {'ok': True, 'tested': len(files)}
+
+    reply = katz_daemon.daemon_request({'op': 'nap', 'archive': archive}, daemon)
+    assert not reply['ok'] and 'Unknown op' in reply['error']
+
+
+def test_lock_waits_for_the_archive_outside_the_condition(kz, tmp_path, monkeypatch):
+    # another process holds the archive: taking its file lock blocks
+    archive = new_archive(tmp_path / 'locked.zip')
+    held = kz.ArchiveFileLock(archive, exclusive=True)
+    held.acquire()
+    lock = katz_daemon.ReadWriteLock(archive)
+
+    writer = threading.Thread(target=lock.acquire_write)
+    writer.start()
+    time.sleep(0.2)
+    assert writer.is_alive()
+
+    # other threads can still look at the lock while the writer waits
+    assert lock._condition.acquire(timeout=1)
+    lock._condition.release()
+    reader_done = []
+    reader = threading.Thread(target=lambda: (lock.acquire_read(), reader_done.append(True),
+                                              lock.release_read()))
+    reader.start()
+    time.sleep(0.1)
+    assert not reader_done
+
+    held.release()
+    writer.join(10)
+    assert not writer.is_alive()
+    # the reader gets its turn once the writer is done
+    assert not reader_done
+    lock.release_write()
+    reader.join(10)
+    assert reader_done
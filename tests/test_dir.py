@@ -0,0 +1,17 @@
+def test_dir_shows_files_changed_in_place(kz, tmp_path, capsys):
+    folder = tmp_path / 'listing'
+    folder.mkdir()
+    (folder / 'a.txt').write_bytes(b'x' * 10)
+    (folder / 'b.txt').write_bytes(b'x' * 100)
+
+    kz.dir(str(folder) + ' /o:-s')
+    lines = [line for line in capsys.readouterr().out.splitlines() if '.txt' in line]
+    assert [line.split()[-1] for line in lines] == ['b.txt', 'a.txt']
+
+    # growing a file doesn't change its folder's modification time
+    with open(str(folder / 'a.txt'), 'ab') as file:
+        file.write(b'x' * 5000)
+
+    kz.dir(str(folder) + ' /o:-s')
+    lines = [line for line in capsys.readouterr().out.splitlines() if '.txt' in line]
+    assert [line.split()[-1] for line in lines] == ['a.txt', 'b.txt']
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from conftest import add_tree, new_archive
+
+
+@pytest.fixture
+def archive(kz, tree, tmp_path):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'data.zip')
+    add_tree(kz, archive, folder)
+    return archive, files
+
+
+def extract(kz, archive, name, folder):
+    with kz.MappedArchive(archive) as f:
+        member = f.members[f.members.find(name)]
+        return kz.extract_member(f, member, str(folder))
+
+
+def test_extract_member(kz, archive, tmp_path):
+    archive, files = archive
+    for name in ('proj/pic.jpg', 'proj/big.log'):
+        target = extract(kz, archive, name, tmp_path / 'out')
+        with open(target, 'rb') as file:
+            assert file.read() == files[name]
+    assert sorted(os.listdir(str(tmp_path / 'out' / 'proj'))) == ['big.log', 'pic.jpg']
+
+
+@pytest.mark.parametrize('name', ['proj/pic.jpg', 'proj/big.log'])
+def test_failed_extraction_leaves_no_partial_file(kz, archive, tmp_path, monkeypatch, name):
+    archive, files = archive
+
+    # an existing file that was to be overwritten survives, too
+    target = tmp_path / 'out' / name
+    target.parent.mkdir(parents=True)
+    target.write_bytes(b'previous version')
+
+    def truncated(*args):
+        raise OSError('Truncated')
+
+    # stored members are copied by kernel_copy(), others are inflated
+    monkeypatch.setattr(kz, 'kernel_copy', truncated)
+    monkeypatch.setattr(kz.MappedArchive, 'read_chunks', lambda self, info: truncated())
+    monkeypatch.setattr(kz, 'pipelined_inflate', truncated)
+
+    with pytest.raises(OSError):
+        extract(kz, archive, name, tmp_path / 'out')
+
+    assert target.read_bytes() == b'previous version'
+    assert os.listdir(str(target.parent)) == [target.name]
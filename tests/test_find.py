@@ -0,0 +1,75 @@
+from conftest import add_tree, new_archive
+
+
+def found_names(capsys):
+    return [line.split('. ', 1)[1] for line in capsys.readouterr().out.splitlines()
+            if line.strip()[:1].isdigit() and '. ' in line]
+
+
+def test_find_substring_glob_and_fuzzy(kz, tmp_path, tree, capsys):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'find.zip')
+    add_tree(kz, archive, folder)
+
+    kz.findFiles(archive, 'util')
+    assert found_names(capsys) == ['proj/src/util.py']
+
+    kz.findFiles(archive, 'proj/src/*.py')
+    assert sorted(found_names(capsys)) == ['proj/src/main.py', 'proj/src/util.py']
+
+    kz.findFiles(archive, 'utli')
+    assert found_names(capsys) == []
+    kz.findFiles(archive, 'utli /fuzzy')
+    assert 'proj/src/util.py' in found_names(capsys)
+
+    kz.findFiles(archive, '.py /max=1')
+    out = capsys.readouterr().out
+    assert 'and 1 more' in out
+
+
+def test_find_index_is_reloaded_and_rebuilt(kz, tmp_path, tree, capsys):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'find.zip')
+    add_tree(kz, archive, folder)
+
+    kz.findFiles(archive, 'notes')
+    assert found_names(capsys) == ['proj/docs/notes.md']
+
+    # a new session loads the index from cache_location
+    kz.name_index_cache = None
+    kz.findFiles(archive, 'notes')
+    assert found_names(capsys) == ['proj/docs/notes.md']
+
+    # the archive changed: the index is built again
+    (folder / 'docs' / 'more notes.md').write_bytes(b'more\n')
+    add_tree(kz, archive, folder)
+    kz.findFiles(archive, 'notes')
+    assert sorted(found_names(capsys)) == ['proj/docs/more notes.md', 'proj/docs/notes.md']
+
+
+def test_found_selects_the_files_found(kz, tmp_path, tree, capsys):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'find.zip')
+    add_tree(kz, archive, folder)
+
+    kz.findFiles(archive, 'proj/src/*.py')
+    with kz.ArchiveIndex(archive) as index:
+        selected = kz.get_chosen_files('found', archive, index)
+    assert sorted(selected) == ['proj/src/main.py', 'proj/src/util.py']
+
+    # the files found in another archive are not selected
+    other = new_archive(tmp_path / 'other.zip')
+    add_tree(kz, other, folder)
+    with kz.ArchiveIndex(other) as index:
+        assert kz.get_chosen_files('found', other, index) == []
+
+
+def test_find_text_after_double_dash(kz, tmp_path, tree, capsys):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'find.zip')
+    (folder / 'max').mkdir()
+    (folder / 'max' / 'a.txt').write_bytes(b'a\n')
+    add_tree(kz, archive, folder)
+
+    kz.findFiles(archive, '-- /max')
+    assert found_names(capsys) == ['proj/max/a.txt']
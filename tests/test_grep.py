@@ -0,0 +1,62 @@
+import zipfile
+
+from conftest import new_archive
+
+
+def grep_archive(kz, tmp_path):
+    archive = new_archive(tmp_path / 'grep.zip')
+    with zipfile.ZipFile(archive, 'a', zipfile.ZIP_DEFLATED) as f:
+        f.writestr('setup.cfg', 'prefix = /usr/lib\nname = katz\n')
+        f.writestr('notes.txt', 'see /i for details\n/USR/LIB in caps\n')
+    return archive
+
+
+def matches(capsys):
+    return [line for line in capsys.readouterr().out.splitlines() if line.count(':') >= 2]
+
+
+def test_grep_pattern_starting_with_slash(kz, tmp_path, capsys):
+    archive = grep_archive(kz, tmp_path)
+
+    kz.grepFiles(archive, '/usr/lib')
+    assert matches(capsys) == ['setup.cfg:1:prefix = /usr/lib']
+
+    kz.grepFiles(archive, '/usr/lib /i')
+    assert sorted(matches(capsys)) == ['notes.txt:2:/USR/LIB in caps', 'setup.cfg:1:prefix = /usr/lib']
+
+
+def test_grep_double_dash_ends_switches(kz, tmp_path, capsys):
+    archive = grep_archive(kz, tmp_path)
+
+    kz.grepFiles(archive, '/f -- /i')
+    assert matches(capsys) == ['notes.txt:1:see /i for details']
+
+
+def test_grep_skips_stored_binary_members(kz, tmp_path, capsys):
+    archive = new_archive(tmp_path / 'binary.zip')
+    binary = b'\0' * 100 + b' TODO binary ' + b'\0' * 100
+    with zipfile.ZipFile(archive, 'a') as f:
+        f.writestr('x/blob.bin', binary, zipfile.ZIP_STORED)
+        f.writestr('x/packed.bin', binary, zipfile.ZIP_DEFLATED)
+        f.writestr('x/notes.txt', 'TODO text\n', zipfile.ZIP_STORED)
+
+    kz.grepFiles(archive, 'TODO')
+    out = capsys.readouterr().out
+    assert [line for line in out.splitlines() if 'TODO' in line] == ['x/notes.txt:1:TODO text']
+    assert '2 binary file(s) skipped' in out
+
+
+def test_grep_pattern_is_not_a_job_switch(kz, tmp_path, capsys, monkeypatch):
+    archive = grep_archive(kz, tmp_path)
+    lowered, rates = [], []
+    monkeypatch.setattr(kz, 'lower_priority', lambda: lowered.append(True))
+    monkeypatch.setattr(kz, 'TokenBucket', lambda rate: rates.append(rate))
+    monkeypatch.setattr(kz, 'get_setting', lambda name, default='': default)
+
+    kz.parse_input('grep -- /low /rate=1M', archive)
+    kz.parse_input('find -- /rate=1M', archive)
+    kz.parse_input('verify -- /low', archive)
+    assert lowered == [] and rates == []
+
+    kz.parse_input('grep lib /low /rate=1M', archive)
+    assert lowered == [True] and len(rates) == 1
@@ -0,0 +1,75 @@
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+import katz_daemon
+import katz_http
+from conftest import add_tree, new_archive
+
+
+@pytest.fixture
+def server(kz, tmp_path, tree):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'served.zip')
+    add_tree(kz, archive, folder)
+
+    server = katz_http.PooledHTTPServer(('127.0.0.1', 0), katz_http.MemberRequestHandler, 4)
+    server.session = katz_daemon.ArchiveSession(archive)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server, files
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    server.session.invalidate()
+
+
+def get(server, path, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_serve_lists_and_sends_files(server):
+    server, files = server
+
+    response, body = get(server, '/')
+    assert response.status == 200
+    assert sorted(member['name'] for member in json.loads(body)) == sorted(files)
+
+    response, body = get(server, '/proj/big.log')
+    assert response.status == 200 and body == files['proj/big.log']
+
+    response, body = get(server, '/proj/nothing.txt')
+    assert response.status == 404
+
+
+def test_serve_ranges_and_etags(server):
+    server, files = server
+    data = files['proj/src/util.py']
+
+    response, body = get(server, '/proj/src/util.py', {'Range': 'bytes=10-19'})
+    assert response.status == 206 and body == data[10:20]
+    assert response.getheader('Content-Range') == 'bytes 10-19/{}'.format(len(data))
+
+    response, body = get(server, '/proj/pic.jpg', {'Range': 'bytes=-100'})
+    assert response.status == 206 and body == files['proj/pic.jpg'][-100:]
+
+    etag = get(server, '/proj/readme.txt')[0].getheader('ETag')
+    response, body = get(server, '/proj/readme.txt', {'If-None-Match': etag})
+    assert response.status == 304
+
+
+def test_serve_on_a_port_in_use(kz, tmp_path, capsys):
+    archive = new_archive(tmp_path / 'served.zip')
+    with socket.socket() as taken:
+        taken.bind(('127.0.0.1', 0))
+        taken.listen()
+        kz.serveFiles(archive, '/port={}'.format(taken.getsockname()[1]))
+    assert 'Cannot serve on' in capsys.readouterr().out
@@ -0,0 +1,77 @@
+import zipfile
+
+import pytest
+
+
+def make_archive(path, members):
+    """members: {name: (date_time, data)}"""
+    with zipfile.ZipFile(str(path), 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, (date_time, data) in members.items():
+            zf.writestr(zipfile.ZipInfo(name, date_time), data)
+    return str(path)
+
+
+OLD, NEW = (2020, 1, 1, 0, 0, 0), (2024, 6, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def archives(kz, tmp_path):
+    first = make_archive(tmp_path / 'a.zip', {'x.txt': (OLD, b'old x'), 'y.txt': (OLD, b'y')})
+    second = make_archive(tmp_path / 'b.zip', {'x.txt': (NEW, b'new x'), 'z.txt': (NEW, b'z')})
+    return first, second
+
+
+def contents(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('N', {'x.txt': b'new x', 'y.txt': b'y', 'z.txt': b'z'}),
+    ('F', {'x.txt': b'old x', 'y.txt': b'y', 'z.txt': b'z'}),
+    ('R', {'x.txt': b'old x', 'y.txt': b'y', 'x (1).txt': b'new x', 'z.txt': b'z'}),
+])
+def test_merge_policies(kz, archives, policy, expected):
+    first, second = archives
+    num_merged, num_collisions = kz.merge_archives(first, [second], policy)
+    assert num_collisions == 1
+    assert contents(first) == expected
+    assert contents(second) == {'x.txt': b'new x', 'z.txt': b'z'}
+
+
+def test_failed_merge_in_place_leaves_archive_as_it_was(kz, archives, monkeypatch):
+    first, second = archives
+    with open(first, 'rb') as file:
+        original = file.read()
+
+    copy_member = kz.copy_member
+
+    def fail_after_one(*args, **kwargs):
+        monkeypatch.setattr(kz, 'copy_member', failing)
+        return copy_member(*args, **kwargs)
+
+    def failing(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(kz, 'copy_member', fail_after_one)
+    source = make_archive(kz.os.path.join(kz.os.path.dirname(first), 'c.zip'),
+                          {'p.txt': (NEW, b'p'), 'q.txt': (NEW, b'q')})
+    with pytest.raises(OSError):
+        kz.merge_archives(first, [source], 'F')
+
+    with open(first, 'rb') as file:
+        assert file.read() == original
+
+
+def test_failed_open_releases_locks(kz, archives, tmp_path):
+    first, second = archives
+    broken = tmp_path / 'broken.zip'
+    broken.write_bytes(b'not a zip file')
+
+    with pytest.raises(Exception):
+        kz.merge_archives(first, [second, str(broken)], 'F')
+
+    # nothing still holds the other archives
+    with kz.ArchiveFileLock(second, exclusive=True, timeout=0):
+        pass
@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from conftest import add_tree, new_archive
+
+# add "folder" to "archive" in a child process that dies, as if killed,
+# right after the zipfile module has written the "stop"-th large file:
+# the archive is left without a central directory
+ADD_AND_DIE = '''
+import os, sys
+import katz_commandLine as katz
+archive, folder, cache, stop = sys.argv[1:]
+katz.cache_location = cache
+katz.config_cache = {}
+calls = []
+def throttle(count):
+    calls.append(count)
+    if len(calls) == int(stop):
+        os._exit(9)
+katz.throttle = throttle
+scanned = katz.scan_tree(folder)
+katz.add_to_archive(archive, [file for file, arcname, st in scanned], folder, scanned)
+'''
+
+
+def add_and_die(kz, archive, folder, stop):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    result = subprocess.run([sys.executable, '-c', ADD_AND_DIE, archive, str(folder),
+                             kz.cache_location, str(stop)], env=env)
+    assert result.returncode == 9
+
+
+@pytest.fixture
+def archive_and_new_files(kz, tree, tmp_path):
+    """An archive holding "tree", and a new folder of three large files to add to it."""
+    folder, files = tree
+    archive = new_archive(tmp_path / 'data.zip')
+    add_tree(kz, archive, folder)
+
+    new = tmp_path / 'disk' / 'new'
+    new.mkdir()
+    new_files = {}
+    for n in range(3):
+        data = (b'line %d of a large text file\n' % n) * 20000
+        (new / ('large%d.txt' % n)).write_bytes(data)
+        new_files['new/large%d.txt' % n] = data
+    os.chmod(str(new / 'large0.txt'), 0o640)
+
+    return archive, files, new, new_files
+
+
+def test_killed_during_first_file(kz, archive_and_new_files):
+    archive, files, new, new_files = archive_and_new_files
+    add_and_die(kz, archive, new, stop=1)
+
+    # the journal was on disk before the first file was written
+    assert os.path.isfile(kz.journal_path(archive, 'add'))
+    with pytest.raises(zipfile.BadZipFile):
+        zipfile.ZipFile(archive)
+
+    # opening the archive repairs it; every earlier file is still there
+    assert kz.openFile(archive) == archive
+    assert not os.path.exists(kz.journal_path(archive, 'add'))
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.testzip() is None
+        names = set(zf.namelist())
+    assert set(files) <= names <= set(files) | {'new/large0.txt'}
+
+
+def test_rerun_add_after_interrupt(kz, archive_and_new_files, monkeypatch):
+    archive, files, new, new_files = archive_and_new_files
+    add_and_die(kz, archive, new, stop=3)
+
+    # the next <A>dd repairs the archive before it reads it, then adds the rest
+    monkeypatch.chdir(new)
+    monkeypatch.setattr('builtins.input', lambda prompt='': 'all')
+    kz.addFiles(archive)
+
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == sorted(list(files) + list(new_files))
+        for name, data in new_files.items():
+            assert zf.read(name) == data
+        # the journaled mode survives the repair
+        assert (zf.getinfo('new/large0.txt').external_attr >> 16) & 0o777 == 0o640
+
+
+def test_recovery_keeps_earlier_members(kz, archive_and_new_files, monkeypatch):
+    archive, files, new, new_files = archive_and_new_files
+    # give the earlier members a mode and a comment, which only the
+    # central directory holds
+    with zipfile.ZipFile(archive, 'a') as zf:
+        info = zipfile.ZipInfo('notes/private.txt', (2020, 1, 2, 3, 4, 6))
+        info.external_attr = 0o600 << 16
+        info.comment = b'keep me'
+        zf.writestr(info, b'private\n')
+    add_and_die(kz, archive, new, stop=2)
+    assert not os.path.exists(kz.directory_path(archive)) or os.path.getsize(kz.directory_path(archive))
+
+    # only what the add wrote is checked; the earlier members come from
+    # the central directory that was saved before the add began
+    checked = []
+    member_data_ok = kz.member_data_ok
+    monkeypatch.setattr(kz, 'member_data_ok',
+                        lambda view, offset, info: checked.append(info.filename) or member_data_ok(view, offset, info))
+    assert kz.openFile(archive) == archive
+    assert not os.path.exists(kz.directory_path(archive))
+    assert set(checked) <= set(new_files)
+
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.testzip() is None
+        assert set(files) | {'notes/private.txt'} <= set(zf.namelist())
+        info = zf.getinfo('notes/private.txt')
+        assert info.comment == b'keep me'
+        assert (info.external_attr >> 16) & 0o777 == 0o600
+        assert info.date_time == (2020, 1, 2, 3, 4, 6)
@@ -0,0 +1,74 @@
+import json
+import os
+
+from conftest import add_tree, new_archive
+
+
+def test_sharded_add_list_extract(kz, tree, tmp_path):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'data.zip')
+    assert add_tree(kz, archive, folder, num_shards=3) == len(files)
+    # the archive itself plus its three shards
+    assert len(kz.shard_parts(archive)) == 4
+    # the manifest lists the shards and the shard that holds each file
+    with open(kz.manifest_path(archive)) as file:
+        manifest = json.load(file)
+    assert manifest['shards'] == ['data.001.zip', 'data.002.zip', 'data.003.zip']
+    assert manifest['members'] == kz.shard_members(archive, kz.shard_parts(archive)[1:], rescan=True)
+    assert sorted(manifest['members']) == sorted(files)
+
+    # every file is listed once, in <L>ist order (reversed by name)
+    with kz.ArchiveIndex(archive) as index:
+        assert list(index) == sorted(files, reverse=True)
+        assert sorted(index.folder_files('proj/src', recursive=True)) == \
+            sorted(n for n, name in enumerate(index) if name.startswith('proj/src/'))
+
+        plan = kz.ExtractionPlan(index, list(index), str(tmp_path / 'out'))
+        plan.make_dirs()
+        plan.run(verbose=False)
+
+    for name, data in files.items():
+        assert (tmp_path / 'out' / name).read_bytes() == data
+
+
+def test_sharded_remove(kz, tree, tmp_path):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'data.zip')
+    add_tree(kz, archive, folder, num_shards=3)
+
+    with kz.ArchiveIndex(archive) as index:
+        failed = kz.remove_members(index, ['proj/big.log', 'proj/src/main.py'],
+                                   str(tmp_path / 'temp.zip'))
+    assert not failed
+
+    with kz.ArchiveIndex(archive) as index:
+        assert sorted(index) == sorted(set(files) - {'proj/big.log', 'proj/src/main.py'})
+    assert kz.test_archive(archive) == (len(files) - 2, None)
+    assert not os.path.exists(tmp_path / 'temp.zip')
+
+    # the manifest forgets the files removed
+    members = kz.read_manifest(archive)['members']
+    assert sorted(members) == sorted(set(files) - {'proj/big.log', 'proj/src/main.py'})
+
+
+def test_sharded_add_uses_the_manifest(kz, tree, tmp_path, monkeypatch):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'data.zip')
+    add_tree(kz, archive, folder, num_shards=3)
+    (folder / 'new.txt').write_bytes(b'new\n')
+
+    # only the archive itself is opened to find the files already in it;
+    # the one shard the new file goes to is opened to save its central
+    # directory before it is appended to
+    opened = []
+    mapped_archive = kz.MappedArchive
+    monkeypatch.setattr(kz, 'MappedArchive', lambda path: opened.append(os.path.basename(path))
+                        or mapped_archive(path))
+    assert add_tree(kz, archive, folder) == 1
+    manifest = kz.read_manifest(archive)
+    shard = os.path.basename(manifest['shards'][manifest['members']['proj/new.txt']])
+    assert opened == ['data.zip', shard]
+
+    members = manifest['members']
+    assert sorted(members) == sorted(set(files) | {'proj/new.txt'})
+    assert members == kz.shard_members(archive, kz.shard_parts(archive)[1:], rescan=True)
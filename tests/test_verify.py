@@ -0,0 +1,75 @@
+import os
+
+from conftest import add_tree, new_archive
+
+
+def archived_tree(kz, tmp_path, tree):
+    folder, files = tree
+    archive = new_archive(tmp_path / 'verify.zip')
+    add_tree(kz, archive, folder)
+    return folder, archive
+
+
+def verify(kz, archive, folder, use_crc=False):
+    with kz.ArchiveIndex(archive) as index:
+        return kz.verify_tree(index, str(folder), use_crc)
+
+
+def test_verify_unchanged_folder(kz, tmp_path, tree):
+    folder, archive = archived_tree(kz, tmp_path, tree)
+
+    for use_crc in (False, True):
+        report = verify(kz, archive, folder, use_crc)
+        assert report == {'matched': 7, 'missing': [], 'extra': [], 'different': []}
+
+
+def test_verify_reports_each_difference(kz, tmp_path, tree):
+    folder, archive = archived_tree(kz, tmp_path, tree)
+
+    (folder / 'new.txt').write_bytes(b'new\n')
+    os.remove(str(folder / 'docs' / 'notes.md'))
+    (folder / 'src' / 'main.py').write_bytes(b'print("hello, world")\n')
+    st = os.stat(str(folder / 'readme.txt'))
+    os.utime(str(folder / 'readme.txt'), (st.st_atime, st.st_mtime + 3600))
+
+    # same size and time, other contents: only "/crc" tells
+    path = str(folder / 'src' / 'util.py')
+    st = os.stat(path)
+    with open(path, 'r+b') as file:
+        file.write(b'D')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    report = verify(kz, archive, folder)
+    assert report['missing'] == ['proj/new.txt']
+    assert report['extra'] == ['proj/docs/notes.md']
+    assert report['different'] == [('proj/readme.txt', 'time'), ('proj/src/main.py', 'size')]
+    assert report['matched'] == 4
+
+    report = verify(kz, archive, folder, use_crc=True)
+    assert report['different'] == [('proj/src/main.py', 'size'), ('proj/src/util.py', 'crc')]
+    assert report['matched'] == 4
+
+
+def test_verify_crc_reads_only_changed_files(kz, tmp_path, tree, monkeypatch):
+    folder, archive = archived_tree(kz, tmp_path, tree)
+
+    read = []
+    crc_of_file = kz.crc_of_file
+    monkeypatch.setattr(kz, 'crc_of_file', lambda path: read.append(path) or crc_of_file(path))
+
+    verify(kz, archive, folder, use_crc=True)
+    assert len(read) == 7
+
+    del read[:]
+    (folder / 'readme.txt').write_bytes(b'READ ME\n' * 10)
+    report = verify(kz, archive, folder, use_crc=True)
+    assert read == [str(folder / 'readme.txt')]
+    assert report['different'] == [('proj/readme.txt', 'crc')]
+
+
+def test_verify_folder_after_double_dash(kz, tmp_path, tree, capsys):
+    folder, archive = archived_tree(kz, tmp_path, tree)
+
+    kz.verifyFiles(archive, '/crc -- ' + str(folder))
+    out = capsys.readouterr().out
+    assert '7 OK.  0 missing from the archive.  0 extra in the archive.  0 different.' in out
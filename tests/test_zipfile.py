@@ -0,0 +1,111 @@
+import os
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from conftest import new_archive
+
+
+def zipcrypto(data, password, check_byte):
+    """Encrypt data the way PKZIP 2.0 does, with its 12-byte header."""
+    keys = [0x12345678, 0x23456789, 0x34567890]
+
+    def crc(value, byte):
+        return zlib.crc32(bytes([byte]), value ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+    def update(byte):
+        keys[0] = crc(keys[0], byte)
+        keys[1] = ((keys[1] + (keys[0] & 0xFF)) * 134775813 + 1) & 0xFFFFFFFF
+        keys[2] = crc(keys[2], keys[1] >> 24)
+
+    for byte in password:
+        update(byte)
+    encrypted = bytearray()
+    for byte in os.urandom(11) + bytes([check_byte]) + data:
+        k = keys[2] | 2
+        encrypted.append(byte ^ ((k * (k ^ 1)) >> 8) & 0xFF)
+        update(byte)
+    return bytes(encrypted)
+
+
+def encrypted_archive(path, name, data, password):
+    """An archive with one stored, encrypted member followed by a data descriptor."""
+    t, d = 0x6B2F, 0x5A21
+    flags = 0x1 | 0x08
+    crc = zlib.crc32(data)
+    body = zipcrypto(data, password, t >> 8)
+    name = name.encode()
+    local = struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, flags, 0, t, d, 0, 0, 0, len(name), 0) + name
+    descriptor = struct.pack('<4s3L', b'PK\x07\x08', crc, len(body), len(data))
+    central = struct.pack('<4s6H3L5H2L', b'PK\x01\x02', 20, 20, flags, 0, t, d, crc, len(body),
+                          len(data), len(name), 0, 0, 0, 0, 0o644 << 16, 0) + name
+    offset = len(local) + len(body) + len(descriptor)
+    end = struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, 1, 1, len(central), offset, 0)
+    with open(str(path), 'wb') as file:
+        file.write(local + body + descriptor + central + end)
+    return str(path)
+
+
+def test_copy_keeps_the_descriptor_of_encrypted_members(kz, tmp_path):
+    data = b'secret stuff\n' * 20
+    source = encrypted_archive(tmp_path / 'locked.zip', 'secret.txt', data, b'katz')
+    with zipfile.ZipFile(source) as f:
+        assert f.read('secret.txt', pwd=b'katz') == data
+
+    copy = new_archive(tmp_path / 'copy.zip')
+    with kz.MappedArchive(source) as src, zipfile.ZipFile(copy, 'a') as dst:
+        kz.copy_member(src, src.infolist()[0], dst)
+    with zipfile.ZipFile(copy) as f:
+        assert f.getinfo('secret.txt').flag_bits & 0x08
+        assert f.read('secret.txt', pwd=b'katz') == data
+
+
+def test_failed_append_leaves_the_archive_as_it_was(kz, tmp_path):
+    archive = new_archive(tmp_path / 'append.zip')
+    with zipfile.ZipFile(archive, 'a') as f:
+        f.writestr('first.txt', b'first\n')
+    before = open(archive, 'rb').read()
+
+    with zipfile.ZipFile(archive, 'a') as f:
+        with pytest.raises(OSError):
+            with kz.ZipAppender(f) as appender:
+                zinfo = zipfile.ZipInfo('second.txt')
+                zinfo.CRC, zinfo.file_size, zinfo.compress_size = 0, 100, 100
+                zinfo.header_offset = appender.offset
+                appender.fp.write(zinfo.FileHeader() + b'half a file')
+                appender.add(zinfo)
+                raise OSError('disk full')
+        assert f.namelist() == ['first.txt']
+    assert open(archive, 'rb').read() == before
+
+
+def test_zipfile_internals_are_checked_on_other_pythons(kz, tmp_path, monkeypatch):
+    monkeypatch.setattr(kz, 'zipfile_versions', ((2, 0), (2, 7)))
+    monkeypatch.setattr(kz, 'zipfile_checked', False)
+    kz.check_zipfile()
+    assert kz.zipfile_checked
+
+    # a zipfile without the internals: nothing is written
+    monkeypatch.setattr(kz, 'zipfile_checked', False)
+    monkeypatch.delattr(zipfile.ZipFile, '_writecheck')
+    archive = new_archive(tmp_path / 'new.zip')
+    (tmp_path / 'a.jpg').write_bytes(b'jpeg')
+    with pytest.raises(NotImplementedError, match='_writecheck'):
+        with zipfile.ZipFile(archive, 'a') as f:
+            kz.write_stored_member(f, str(tmp_path / 'a.jpg'), 'a.jpg')
+    with zipfile.ZipFile(archive) as f:
+        assert f.namelist() == []
+
+
+@pytest.mark.parametrize('method', [zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA])
+def test_bzip2_and_lzma_members(kz, tmp_path, method):
+    data = os.urandom(1000) * 200
+    archive = new_archive(tmp_path / 'methods.zip')
+    with zipfile.ZipFile(archive, 'a', compression=method) as f:
+        f.writestr('data.bin', data)
+
+    with kz.MappedArchive(archive) as f:
+        assert b''.join(bytes(chunk) for chunk in f.read_chunks(f.infolist()[0])) == data
+    assert kz.test_archive(archive) == (1, None)